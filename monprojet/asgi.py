@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'monprojet.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Notifications SSE / WebSocket (utilisateurs/realtime.py), le reste va à Django.
+# Importé après get_asgi_application() qui initialise les applications.
+from utilisateurs.realtime import router  # noqa: E402
+
+application = router(django_application)
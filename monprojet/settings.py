@@ -51,10 +51,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'utilisateurs.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'utilisateurs.middleware.HopitalMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -79,6 +81,20 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'monprojet.wsgi.application'
 
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'utilisateurs.renderers.MessagePackRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        'utilisateurs.renderers.MessagePackParser',
+    ],
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -139,4 +155,142 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Background task queue (utilisateurs/tasks.py), run with: python manage.py runworker
+TASK_QUEUE = {
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_BASE': 2,
+    'POLL_INTERVAL': 1,
+}
+
+# Dossier access audit log (utilisateurs/audit.py), written in batches by a background thread
+AUDIT = {
+    'BUFFER_SIZE': 100000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1,
+    'FLUSH_AT_EXIT': True,  # write what is left in the buffer at shutdown
+}
+
+# Token-bucket rate limits (utilisateurs/throttling.py), rate is 'N/s|min|hour|day'.
+# BACKEND 'memory' keeps buckets per worker, 'cache' shares them through CACHES[CACHE].
+# 'vues' overrides a scope for single views, by view name, e.g.
+# 'ecriture': {'rate': '120/min', 'burst': 30, 'vues': {'rediger_ordonnance': {'rate': '30/min', 'burst': 10}}}
+RATE_LIMITS = {
+    'BACKEND': 'memory',
+    'CACHE': 'default',
+    'login_email': {'rate': '5/min', 'burst': 5},
+    'login_ip': {'rate': '30/min', 'burst': 30},
+    'ecriture': {'rate': '120/min', 'burst': 30, 'vues': {}},
+}
+
+# Clinical change feed (utilisateurs/outbox.py), served by /api/events.
+# Prune events acknowledged by every consumer with: python manage.py compacter_evenements
+EVENTS = {
+    'BATCH_SIZE': 500,
+    'POLL_INTERVAL': 0.2,
+    'MAX_WAIT': 25,
+    'GAP_TIMEOUT': 5,
+    'GAP_MAX_AGE': 3600,
+}
+
+# Push notifications (utilisateurs/realtime.py), served by monprojet/asgi.py only:
+# SSE on SSE_PATH and WebSocket on WEBSOCKET_PATH, authenticated with the API token in the
+# Authorization header or with ?ticket= from POST /api/notifications/ticket (valid TICKET_TTL s).
+REALTIME = {
+    'SSE_PATH': '/api/notifications',
+    'WEBSOCKET_PATH': '/ws/notifications',
+    'QUEUE_SIZE': 100,
+    'KEEPALIVE': 15,
+    'POLL_INTERVAL': 1,
+    'TICKET_TTL': 30,
+}
+
+# Full-text search of clinical notes (utilisateurs/recherche.py): the total number of notes
+# used by the ranking is re-read from DossierSummary every TTL_DOCUMENTS seconds.
+RECHERCHE = {
+    'TTL_DOCUMENTS': 300,
+}
+
+# Cold storage of closed dossiers (utilisateurs/archivage.py), run: python manage.py archiver_dossiers
+# COMPRESSION 'zstd' needs the zstandard package, gzip is used otherwise.
+ARCHIVAGE = {
+    'COMPRESSION': 'zstd',
+    'INACTIF_JOURS': 3650,
+    'CLOTURE_JOURS': 365,
+}
+
+# Offline-first sync of ward tablets (utilisateurs/sync.py): GET/POST /api/sync.
+# Tombstones older than RETENTION_JOURS are purged by: python manage.py purger_sync
+SYNC = {
+    'LIMIT': 1000,
+    'MARGE': 30,
+    'RETENTION_JOURS': 90,
+    'MAX_OPERATIONS': 500,
+}
+
+# PDF printing (utilisateurs/impression.py): batches of SEUIL_POOL documents or more are
+# rendered in a process pool of PROCESSUS workers (0: one per CPU core).
+PDF = {
+    'PROCESSUS': 0,
+    'SEUIL_POOL': 20,
+    'MAX_DOCUMENTS': 5000,
+    'LOT': 200,  # documents loaded and rendered together while a batch is streamed
+}
+
+# Pseudonymized research extracts (utilisateurs/pseudonymisation.py), run:
+# python manage.py exporter_recherche <directory> [--format parquet] [--etude ...]
+# CLE is the HMAC key of the pseudonyms and date shifts: keep it secret, and keep it
+# to produce extracts that link with earlier ones.
+PSEUDONYMISATION = {
+    'CLE': os.getenv('PSEUDONYMISATION_CLE', ''),
+    'DECALAGE_MAX_JOURS': 180,
+    'TRANCHE_AGE': 5,
+    'AGE_MAX': 90,
+    'CHUNK_SIZE': 100000,
+    'PROCESSUS': 0,
+}
+
+# Duplicate patient detection (utilisateurs/doublons.py): GET /api/patients/doublons at
+# registration, batch scan with: python manage.py detecter_doublons [--reindexer]
+DOUBLONS = {
+    'SEUIL': 0.85,
+    'LIMIT': 10,
+    'MAX_BLOC': 500,
+    'PROCESSUS': 0,
+}
 
+# Admin changelists on large tables (utilisateurs/admin.py): without filters the row count
+# is estimated from table statistics above ESTIMATION_MIN rows; filtered or searched lists
+# are counted up to MAX_COMPTE rows only.
+ADMIN_LISTES = {
+    'ESTIMATION_MIN': 100000,
+    'MAX_COMPTE': 10000,
+}
+
+# Bulk staff provisioning (utilisateurs/provisionnement.py): POST /api/personnel or
+# python manage.py provisionner_personnel <file.csv|file.json>. Passwords of batches of
+# SEUIL_POOL accounts or more are hashed in a pool of PROCESSUS workers (0: one per core).
+PROVISIONNEMENT = {
+    'MAX_COMPTES': 2000,
+    'SEUIL_POOL': 8,
+    'PROCESSUS': 0,
+}
+
+# Bed census (utilisateurs/hospitalisation.py): GET /api/lits is served from an occupancy
+# index kept in memory by each worker. New bed moves are read at most every
+# RAFRAICHISSEMENT seconds, and the index is fully rebuilt every TTL seconds.
+HOSPITALISATION = {
+    'TTL': 300,
+    'RAFRAICHISSEMENT': 1,
+    'GAP_TIMEOUT': 5,
+    'GAP_MAX_AGE': 3600,
+    'CHUNK_SIZE': 10000,
+}
+
+# Coalescing of concurrent identical reads (utilisateurs/coalescence.py): while a dossier
+# read (GET /api/dossier/<id> and its PDF) is in flight, identical requests in the same
+# worker wait for it and share its result. After ATTENTE_MAX seconds a waiting request
+# computes the result itself.
+COALESCENCE = {
+    'ACTIF': True,
+    'ATTENTE_MAX': 30,
+}
@@ -1,12 +1,91 @@
-from django.contrib import admin
-from .models import Administratif, Medecin, Radiologue, Laborantin, Infirmier, SGPH, Patient
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .models import Administratif, Medecin, Radiologue, Laborantin, Infirmier, SGPH, Patient, Disponibilite, Stock, Hopital, Medicament, Service, Chambre, Lit
 from django.contrib.auth.hashers import make_password
+from . import doublons
+
+# Listes de l'admin sur de grandes tables (patients, personnel) : pas de COUNT(*) exact sur
+# toute la table, une recherche par préfixe sur une colonne indexée, les clés étrangères
+# lues en jointure et choisies par autocomplétion, les actions groupées en un seul UPDATE.
+ADMIN_LISTES = {
+    'ESTIMATION_MIN': 100000,  # Sans filtre, nombre de lignes estimé au-delà (statistiques de la table)
+    'MAX_COMPTE': 10000,       # Avec filtre ou recherche, comptées jusqu'à ce nombre seulement
+    **getattr(settings, 'ADMIN_LISTES', {}),
+}
+
+
+def estimer(modele):
+    # Nombre de lignes d'après les statistiques du moteur, None s'il n'en tient pas
+    table = modele._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute("SELECT table_rows FROM information_schema.tables "
+                           "WHERE table_schema = DATABASE() AND table_name = %s", [table])
+        elif connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [table])
+        else:
+            return None
+        ligne = cursor.fetchone()
+    return int(ligne[0]) if ligne and ligne[0] is not None and ligne[0] >= 0 else None
+
+
+class EstimationPaginator(Paginator):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimation = estimer(queryset.model)
+            if estimation is not None and estimation >= ADMIN_LISTES['ESTIMATION_MIN']:
+                return estimation
+        # COUNT(*) sur une sous-requête limitée : les pages au-delà passent par la recherche
+        return queryset.order_by()[:ADMIN_LISTES['MAX_COMPTE']].count()
+
+
+class HopitalActionForm(helpers.ActionForm):
+    hopital = forms.ModelChoiceField(Hopital.objects.all(), required=False, label='Hopital')
+
 
 # Base Admin class for Utilisateur-based models
 class UtilisateurAdmin(admin.ModelAdmin):
-    list_display = ('nom', 'prenom', 'email')  # Common fields for all user types
-    search_fields = ('nom', 'prenom', 'email')
+    list_display = ('nom', 'prenom', 'email', 'hopital')  # Common fields for all user types
+    # Recherche effective : get_search_results (un seul critère indexé, en préfixe)
+    search_fields = ('^nom', '^email')
+    search_help_text = 'Nom [prénom], email ou numéro, par le début'
+    list_filter = ('hopital',)
     exclude = ('is_staff', 'is_superuser')
+    list_select_related = ('hopital',)
+    autocomplete_fields = ('hopital',)
+    paginator = EstimationPaginator
+    show_full_result_count = False
+    champ_numero = None  # Colonne cherchée quand le terme n'a que des chiffres (nss des patients)
+    actions = ['desactiver_connexion']
+
+    def get_search_results(self, request, queryset, search_term):
+        # Un LIKE 'terme%' sur une colonne indexée plutôt qu'un icontains par champ (OR, jointure)
+        terme = search_term.strip()
+        if not terme:
+            return queryset, False
+        if '@' in terme:
+            return queryset.filter(email__istartswith=terme), False
+        if self.champ_numero and terme.replace(' ', '').isdigit():
+            return queryset.filter(**{f'{self.champ_numero}__startswith': terme.replace(' ', '')}), False
+        nom, _, prenom = terme.partition(' ')
+        queryset = queryset.filter(nom__istartswith=nom)  # Index (nom, prenom)
+        if prenom:
+            queryset = queryset.filter(prenom__istartswith=prenom.strip())
+        return queryset, False
+
+    @admin.action(description='Disable login of selected accounts')
+    def desactiver_connexion(self, request, queryset):
+        # Un UPDATE de la table utilisateur, même pour « tout sélectionner »
+        n = queryset.update(password='', date_maj=timezone.now())
+        self.message_user(request, f'Login disabled for {n} account(s)')
 
     def save_model(self, request, obj, form, change):
         if form.cleaned_data.get('password') and not change:
@@ -33,41 +112,120 @@ class AdministratifAdmin(UtilisateurAdmin):
             obj.password = make_password(form.cleaned_data['password'])
         super().save_model(request, obj, form, change)"""
 
+# Base Admin class for staff accounts: they can be moved to another hopital in bulk
+class PersonnelAdmin(UtilisateurAdmin):
+    action_form = HopitalActionForm
+    actions = UtilisateurAdmin.actions + ['affecter_hopital']
+
+    @admin.action(description='Move selected accounts to the hopital chosen above')
+    def affecter_hopital(self, request, queryset):
+        hopital = Hopital.objects.filter(pk=request.POST.get('hopital') or None).first()
+        if hopital is None:
+            self.message_user(request, 'Choose a hopital first', level=messages.ERROR)
+            return
+        n = queryset.update(hopital=hopital, date_maj=timezone.now())
+        self.message_user(request, f'{n} account(s) moved to {hopital}')
+
+# Admin for Hopital (tenants)
+@admin.register(Hopital)
+class HopitalAdmin(admin.ModelAdmin):
+    list_display = ('code', 'nom')
+    search_fields = ('code', 'nom')
+
 # Admin for Medecin
 @admin.register(Medecin)
-class MedecinAdmin(UtilisateurAdmin):
+class MedecinAdmin(PersonnelAdmin):
     list_display = UtilisateurAdmin.list_display + ('specialite',)  # Add specialite to display
     list_filter = UtilisateurAdmin.list_filter + ('specialite',)
 
 # Admin for Radiologue
 @admin.register(Radiologue)
-class RadiologueAdmin(UtilisateurAdmin):
+class RadiologueAdmin(PersonnelAdmin):
     list_display = UtilisateurAdmin.list_display
     search_fields = UtilisateurAdmin.search_fields
     list_filter = UtilisateurAdmin.list_filter
 
 # Admin for Laborantin
 @admin.register(Laborantin)
-class LaborantinAdmin(UtilisateurAdmin):
+class LaborantinAdmin(PersonnelAdmin):
     list_display = UtilisateurAdmin.list_display
     search_fields = UtilisateurAdmin.search_fields
     list_filter = UtilisateurAdmin.list_filter
 
 # Admin for Infirmier
 @admin.register(Infirmier)
-class InfirmierAdmin(UtilisateurAdmin):
+class InfirmierAdmin(PersonnelAdmin):
     list_display = UtilisateurAdmin.list_display
     search_fields = UtilisateurAdmin.search_fields
     list_filter = UtilisateurAdmin.list_filter
 
 # Admin for SGPH
 @admin.register(SGPH)
-class SGPHAdmin(UtilisateurAdmin):
+class SGPHAdmin(PersonnelAdmin):
     pass
 
 # Admin for Patient
 @admin.register(Patient)
 class PatientAdmin(UtilisateurAdmin):
     list_display = UtilisateurAdmin.list_display + ('nss', 'date_naissance', 'telephone', 'mutuelle', 'adresse')
-    search_fields = UtilisateurAdmin.search_fields + ('nss',)
-    list_filter = UtilisateurAdmin.list_filter + ('mutuelle',)
+    search_fields = UtilisateurAdmin.search_fields + ('^nss',)
+    champ_numero = 'nss'
+    # Pas de filtre sur mutuelle : un SELECT DISTINCT sur toute la table à chaque affichage
+    list_filter = UtilisateurAdmin.list_filter
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change:
+            # Enregistré quand même : la fusion éventuelle se fait par /api/patients/<id>/fusionner
+            candidats = doublons.candidats(obj.nom, obj.prenom, obj.date_naissance, obj.nss, obj.hopital_id, exclure=obj.pk)
+            if candidats:
+                self.message_user(request, 'Possible duplicate of: ' + ', '.join(
+                    f"{c['nom']} {c['prenom']} ({c['date_naissance']}, nss {c['nss']}, id {c['id_utilisateur']}, score {c['score']})"
+                    for c in candidats
+                ), level=messages.WARNING)
+
+# Admin for Disponibilite (plages de consultation des médecins)
+@admin.register(Disponibilite)
+class DisponibiliteAdmin(admin.ModelAdmin):
+    list_display = ('medecin', 'jour_semaine', 'heure_debut', 'heure_fin', 'duree_creneau')
+    list_filter = ('jour_semaine', 'medecin__specialite')
+    list_select_related = ('medecin',)
+    autocomplete_fields = ('medecin',)
+
+# Admin for Medicament (catalogue, needed by the Stock autocomplete)
+@admin.register(Medicament)
+class MedicamentAdmin(admin.ModelAdmin):
+    list_display = ('nom', 'dosage', 'forme')
+    search_fields = ('^nom',)
+
+# Admin for Stock (pharmacie)
+@admin.register(Stock)
+class StockAdmin(admin.ModelAdmin):
+    list_display = ('medicament', 'hopital_id', 'quantite', 'seuil_alerte', 'date_maj')
+    readonly_fields = ('quantite',)  # Modifié uniquement par dispensation / réapprovisionnement
+    list_select_related = ('medicament',)
+    autocomplete_fields = ('medicament',)
+
+# Admin for Service / Chambre / Lit (structure des services d'hospitalisation)
+@admin.register(Service)
+class ServiceAdmin(admin.ModelAdmin):
+    list_display = ('code', 'nom', 'hopital')
+    list_filter = ('hopital',)
+    search_fields = ('^code', '^nom')
+    list_select_related = ('hopital',)
+
+@admin.register(Chambre)
+class ChambreAdmin(admin.ModelAdmin):
+    list_display = ('numero', 'service')
+    list_filter = ('service__hopital',)
+    search_fields = ('^numero',)
+    list_select_related = ('service',)
+    autocomplete_fields = ('service',)
+
+@admin.register(Lit)
+class LitAdmin(admin.ModelAdmin):
+    list_display = ('numero', 'chambre', 'actif', 'dossier', 'depuis')
+    list_filter = ('actif', 'chambre__service')
+    list_select_related = ('chambre__service', 'dossier__patient')
+    autocomplete_fields = ('chambre',)
+    readonly_fields = ('dossier', 'depuis')  # Modifiés uniquement par admission / transfert / sortie
@@ -0,0 +1,129 @@
+import gzip
+from collections import defaultdict
+
+from django.conf import settings
+from django.core import serializers
+from django.db import transaction
+
+from .models import (
+    ArchiveDossier, BilanBiologique, Dispensation, DossierMedical, LigneDispensation, Medicament,
+    Ordonnance, Resume, Traitement, suivi_suppressions,
+)
+from .recherche import indexer
+
+try:
+    import zstandard
+except ImportError:  # zstandard est optionnel, gzip reste disponible
+    zstandard = None
+
+# Archivage des dossiers clos : le contenu clinique d'un dossier est sérialisé en JSON
+# compressé dans une ligne ArchiveDossier et supprimé des tables courantes, dont les index
+# ne contiennent plus que les patients actifs. DossierSummary est conservé tel quel.
+#
+# Lecture du dossier : charger() remplit le cache de prefetch depuis l'archive, sans rien
+# réécrire. Écriture dans le dossier : rehydrater() remet d'abord les lignes en place.
+
+ARCHIVAGE = {
+    'COMPRESSION': 'zstd',  # gzip si zstandard n'est pas installé
+    'NIVEAU': 10,
+    'INACTIF_JOURS': 3650,  # Sans consultation, ordonnance, bilan ni traitement depuis
+    'CLOTURE_JOURS': 365,   # Après la date de clôture (décès, sortie définitive)
+    **getattr(settings, 'ARCHIVAGE', {}),
+}
+
+
+def compresser(brut):
+    if ARCHIVAGE['COMPRESSION'] == 'zstd' and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ARCHIVAGE['NIVEAU']).compress(brut), 'zstd'
+    return gzip.compress(brut, compresslevel=min(ARCHIVAGE['NIVEAU'], 9)), 'gzip'
+
+
+def decompresser(archive):
+    donnees = bytes(archive.donnees)
+    if archive.compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(donnees)
+    return gzip.decompress(donnees)
+
+
+def contenu(dossier_id):
+    # Dans l'ordre des clés étrangères, pour que la restauration puisse insérer ligne par ligne
+    ordonnances = Ordonnance.tous.filter(dpi_patient_id=dossier_id)
+    return [
+        Resume.tous.filter(dpi_id=dossier_id).order_by('pk'),
+        ordonnances.order_by('pk'),
+        Traitement.tous.filter(ordonnance__in=ordonnances).order_by('pk'),
+        BilanBiologique.tous.filter(dpi_id=dossier_id).order_by('pk'),
+        Dispensation.objects.filter(ordonnance__in=ordonnances).order_by('pk'),
+        LigneDispensation.objects.filter(dispensation__ordonnance__in=ordonnances).order_by('pk'),
+    ]
+
+
+def archiver(dossier_id):
+    # Retourne l'ArchiveDossier créée, None si le dossier était déjà archivé
+    with transaction.atomic():
+        if not DossierMedical.tous.select_for_update().filter(pk=dossier_id, archive=False).exists():
+            return None
+        querysets = contenu(dossier_id)
+        objets = [objet for queryset in querysets for objet in queryset]
+        brut = serializers.serialize('json', objets).encode()
+        donnees, compression = compresser(brut)
+        archive, _ = ArchiveDossier.objects.update_or_create(dossier_id=dossier_id, defaults={
+            'compression': compression,
+            'donnees': donnees,
+            'taille': len(brut),
+            'nb_lignes': len(objets),
+        })
+
+        jeton = suivi_suppressions.set(False)
+        try:
+            # Les traitements et dispensations suivent les ordonnances par cascade
+            querysets[0].delete()
+            querysets[1].delete()
+            querysets[3].delete()
+        finally:
+            suivi_suppressions.reset(jeton)
+        # update() et non save() : ni nouvelle version ni tâche de QR code
+        DossierMedical.tous.filter(pk=dossier_id).update(archive=True)
+    return archive
+
+
+def rehydrater(dossier):
+    # Remet le contenu archivé dans les tables courantes, avant toute écriture dans le dossier
+    if not dossier.archive:
+        return False
+    with transaction.atomic():
+        archive = ArchiveDossier.objects.select_for_update().filter(dossier_id=dossier.pk).first()
+        if archive is not None:
+            # Comme loaddata : lignes réinsérées avec leurs clés, sans save() ni signaux
+            for objet in serializers.deserialize('json', decompresser(archive)):
+                objet.save()
+                if getattr(objet.object, 'champs_recherche', ()):
+                    indexer(objet.object, creation=True)  # Retirées de l'index à l'archivage
+            archive.delete()
+        DossierMedical.tous.filter(pk=dossier.pk).update(archive=False)
+    dossier.archive = False
+    return True
+
+
+def charger(dossier):
+    # Lecture seule : les relations rendues par DossierMedicalSerializer sont servies depuis
+    # l'archive via le cache de prefetch, prefetch_related ne relit alors pas la base
+    archive = ArchiveDossier.objects.filter(dossier_id=dossier.pk).first()
+    if archive is None:
+        return
+    par_modele = defaultdict(list)
+    for objet in serializers.deserialize('json', decompresser(archive)):
+        par_modele[type(objet.object)].append(objet.object)
+
+    medicaments = Medicament.objects.in_bulk({traitement.medicament_id for traitement in par_modele[Traitement]})
+    par_ordonnance = defaultdict(list)
+    for traitement in par_modele[Traitement]:
+        traitement.medicament = medicaments.get(traitement.medicament_id)
+        par_ordonnance[traitement.ordonnance_id].append(traitement)
+    for ordonnance in par_modele[Ordonnance]:
+        ordonnance._prefetched_objects_cache = {'medicaments': par_ordonnance[ordonnance.pk]}
+    dossier._prefetched_objects_cache = {
+        'consultations': par_modele[Resume],
+        'ordonnances': par_modele[Ordonnance],
+        'bilans': par_modele[BilanBiologique],
+    }
@@ -0,0 +1,20 @@
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+# Appels à la base depuis du code asyncio (long-poll et SSE d'outbox.py, PDF d'impression.py,
+# notifications de realtime.py) : dans un thread du pool, comme le ferait une vue.
+
+
+def avec_connexion(fonction):
+    # Comme la gestion des requêtes de Django : pas de connexion périmée réutilisée
+    def appel(*args, **kwargs):
+        close_old_connections()
+        try:
+            return fonction(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return appel
+
+
+def base(fonction):
+    return sync_to_async(avec_connexion(fonction), thread_sensitive=False)
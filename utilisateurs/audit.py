@@ -0,0 +1,152 @@
+import atexit
+import collections
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import AuditAcces
+
+# Journal d'audit des dossiers sans INSERT synchrone par requête :
+# les événements sont ajoutés à un buffer circulaire en mémoire et un thread
+# les écrit par lots (bulk_create). Perte bornée : au plus AUDIT['BUFFER_SIZE']
+# événements si la base est indisponible (les plus anciens sont écartés et
+# comptés), et au plus FLUSH_INTERVAL secondes d'événements si le processus est
+# tué brutalement. Un arrêt normal vide le buffer (atexit, sauf FLUSH_AT_EXIT False).
+#
+# Le verrou ne protège que le buffer (ajout, échange, remise après un échec) :
+# l'écriture en base se fait hors du verrou, les requêtes n'attendent jamais la base.
+
+AUDIT = {
+    'BUFFER_SIZE': 100000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1,   # secondes
+    'FLUSH_AT_EXIT': True,
+    **getattr(settings, 'AUDIT', {}),
+}
+
+logger = logging.getLogger(__name__)
+
+
+class AuditBuffer:
+    def __init__(self, buffer_size, batch_size, flush_interval):
+        self.events = collections.deque(maxlen=buffer_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.perdus = 0
+        self.lock = threading.Lock()
+        self.ecriture = threading.Lock()  # un seul flush à la fois (thread, atexit, appel explicite)
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    def ajouter(self, event):
+        self.demarrer()
+        with self.lock:
+            if len(self.events) == self.events.maxlen:
+                self.perdus += 1  # deque(maxlen) écarte le plus ancien
+            self.events.append(event)
+            plein = len(self.events) >= self.batch_size
+        if plein:
+            self.wakeup.set()
+
+    def demarrer(self):
+        # (Re)démarre le thread, y compris dans un processus fils après un fork
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is not None and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self.boucle, name='audit-flush', daemon=True)
+            self.thread.start()
+
+    def apres_fork(self):
+        # Fils : les événements hérités sont écrits par le parent, les verrous ont pu être
+        # copiés pris et le thread n'existe pas ici
+        self.events = collections.deque(maxlen=self.events.maxlen)
+        self.perdus = 0
+        self.lock = threading.Lock()
+        self.ecriture = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    def boucle(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                # Les événements non écrits sont remis en tête du buffer au prochain passage
+                logger.exception('Audit flush failed')
+
+    def flush(self):
+        with self.ecriture:
+            with self.lock:
+                events, self.events = self.events, collections.deque(maxlen=self.events.maxlen)
+            while events:
+                batch = [events.popleft() for _ in range(min(self.batch_size, len(events)))]
+                try:
+                    AuditAcces.tous.bulk_create(batch)
+                except Exception:
+                    events.extendleft(reversed(batch))
+                    self.remettre(events)
+                    raise
+            with self.lock:
+                perdus, self.perdus = self.perdus, 0
+        if perdus:
+            logger.warning('%d audit event(s) dropped, buffer was full', perdus)
+
+    def remettre(self, events):
+        # Non écrits devant ceux arrivés depuis ; si le buffer déborde, les plus anciens sont écartés
+        with self.lock:
+            restants = collections.deque(events, maxlen=self.events.maxlen)
+            restants.extend(self.events)
+            self.perdus += len(events) + len(self.events) - len(restants)
+            self.events = restants
+
+
+buffer = AuditBuffer(AUDIT['BUFFER_SIZE'], AUDIT['BATCH_SIZE'], AUDIT['FLUSH_INTERVAL'])
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=buffer.apres_fork)
+
+
+def enregistrer(request, utilisateur, action, ressource, objet_id=None, dossier_id=None):
+    buffer.ajouter(AuditAcces(
+        date=timezone.now(),
+        utilisateur_id=getattr(utilisateur, 'id_utilisateur', None),
+        hopital_id=getattr(utilisateur, 'hopital_id', None),
+        dossier_id=dossier_id,
+        action=action,
+        ressource=ressource,
+        objet_id=objet_id,
+        adresse_ip=request.META.get('REMOTE_ADDR'),
+    ))
+
+
+def lecture(request, utilisateur, ressource, objet_id=None, dossier_id=None):
+    enregistrer(request, utilisateur, AuditAcces.LECTURE, ressource, objet_id, dossier_id)
+
+
+def ecriture(request, utilisateur, ressource, objet_id=None, dossier_id=None):
+    enregistrer(request, utilisateur, AuditAcces.ECRITURE, ressource, objet_id, dossier_id)
+
+
+def flush():
+    buffer.flush()
+
+
+@atexit.register
+def _flush_at_exit():
+    if not AUDIT['FLUSH_AT_EXIT']:
+        return
+    try:
+        flush()
+    except Exception:
+        logger.exception('Audit events lost at shutdown')
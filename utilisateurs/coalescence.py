@@ -0,0 +1,87 @@
+import threading
+
+from django.conf import settings
+
+# Lectures identiques simultanées (dossier d'un patient critique ouvert sur plusieurs écrans) :
+# la première requête calcule, celles qui arrivent pendant le calcul avec la même clé attendent
+# et reçoivent le même résultat (ou la même exception). Rien n'est gardé après le calcul : ce
+# n'est pas un cache, une requête arrivée après la fin relit la base.
+#
+# Par processus. Les vues sont synchrones (WSGI threadé, et un thread par requête sous ASGI) :
+# les suiveurs attendent sur un threading.Event.
+#
+# La clé doit contenir tout ce qui change le résultat pour l'appelant : ressource, objet,
+# hôpital actif (filtre de TenantManager), paramètres de rendu.
+
+COALESCENCE = {
+    'ACTIF': True,
+    'ATTENTE_MAX': 30,  # secondes ; au-delà l'appelant calcule lui-même
+    **getattr(settings, 'COALESCENCE', {}),
+}
+
+
+class Vol:
+    def __init__(self):
+        self.termine = threading.Event()
+        self.resultat = None
+        self.erreur = None
+        self.suiveurs = 0
+
+
+class VolUnique:
+    def __init__(self):
+        self.en_cours = {}
+        self.lock = threading.Lock()
+        self.executions = 0
+        self.partages = 0
+
+    def rejoindre(self, cle):
+        # (vol, True) pour le premier appelant, qui calcule ; les suivants s'inscrivent
+        with self.lock:
+            vol = self.en_cours.get(cle)
+            if vol is None:
+                vol = self.en_cours[cle] = Vol()
+                self.executions += 1
+                return vol, True
+            vol.suiveurs += 1
+            self.partages += 1
+            return vol, False
+
+    def executer(self, cle, vol, fonction):
+        # La clé quitte en_cours quoi qu'il arrive, y compris sur KeyboardInterrupt ou SystemExit
+        resultat = erreur = None
+        try:
+            resultat = fonction()
+            return resultat
+        except BaseException as exception:
+            erreur = exception
+            raise
+        finally:
+            self.terminer(cle, vol, resultat, erreur)
+
+    def terminer(self, cle, vol, resultat=None, erreur=None):
+        with self.lock:
+            del self.en_cours[cle]
+            vol.resultat, vol.erreur = resultat, erreur
+            vol.termine.set()
+
+    def partager(self, cle, fonction):
+        if not COALESCENCE['ACTIF']:
+            return fonction()
+        vol, chef = self.rejoindre(cle)
+        if chef:
+            return self.executer(cle, vol, fonction)
+        if not vol.termine.wait(COALESCENCE['ATTENTE_MAX']):
+            return fonction()
+        if vol.erreur is not None and not isinstance(vol.erreur, Exception):
+            return fonction()  # Le calcul du premier a été interrompu, pas en échec
+        if vol.erreur is not None:
+            raise vol.erreur
+        return vol.resultat
+
+
+vols = VolUnique()
+
+
+def partager(cle, fonction):
+    return vols.partager(cle, fonction)
@@ -0,0 +1,273 @@
+import multiprocessing
+import os
+import re
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from . import archivage, hospitalisation
+from .models import (
+    BilanBiologique, CleDoublon, DossierMedical, DossierSummary, EvenementClinique, Lit, MouvementLit, Occurrence,
+    Ordonnance, Patient, RendezVous, Resume, Traitement,
+)
+
+# Détection des patients enregistrés deux fois (orthographe du nom, nss mal saisi).
+#
+# Blocage : chaque patient a trois clés dans CleDoublon (nom et prénom phonétiques, chacun
+# avec la date de naissance, et la paire nom/prénom sans ordre). Seuls les patients d'un
+# même hôpital partageant une clé sont comparés, jamais toutes les paires.
+#
+# Score : similarité de Dice sur les bigrammes de caractères (nom, prénom, nss), calculée
+# sur des matrices NumPy de comptes de bigrammes pour toutes les paires candidates à la
+# fois, plus la date de naissance (égale, ou une seule composante différente / jour et mois
+# inversés). La fusion est une décision humaine : le détecteur ne fait que proposer.
+
+DOUBLONS = {
+    'SEUIL': 0.85,       # Score minimal d'une paire proposée (0 à 1)
+    'LIMIT': 10,         # Candidats rendus à l'enregistrement
+    'MAX_BLOC': 500,     # Au-delà, une clé trop commune est ignorée par le scan
+    'PROCESSUS': 0,      # 0 : un par cœur
+    **getattr(settings, 'DOUBLONS', {}),
+}
+
+POIDS = {'nom': 0.3, 'prenom': 0.25, 'date_naissance': 0.25, 'nss': 0.2}
+DIMENSION = 256  # Colonnes des vecteurs de bigrammes (hachés)
+CHAMPS = ['id_utilisateur', 'nom', 'prenom', 'date_naissance', 'nss']
+
+# Graphies françaises ramenées à un son, dans l'ordre (CH avant C...)
+SONS = [
+    ('SCH', 'S'), ('CH', 'S'), ('SH', 'S'), ('PH', 'F'), ('QU', 'K'), ('GU', 'G'), ('CK', 'K'),
+    ('CE', 'SE'), ('CI', 'SI'), ('C', 'K'), ('Q', 'K'), ('EAU', 'O'), ('AU', 'O'), ('AI', 'E'),
+    ('EI', 'E'), ('OU', 'U'), ('Y', 'I'), ('W', 'V'), ('Z', 'S'), ('BV', 'V'),
+]
+
+
+class FusionImpossible(Exception):
+    pass
+
+
+def normaliser(chaine):
+    # Majuscules sans accents, lettres et chiffres seulement
+    chaine = unicodedata.normalize('NFKD', chaine or '').encode('ascii', 'ignore').decode().upper()
+    return re.sub('[^A-Z0-9]', '', chaine)
+
+
+def phonetique(chaine):
+    mot = re.sub('[^A-Z]', '', normaliser(chaine))
+    if not mot:
+        return ''
+    for graphie, son in SONS:
+        mot = mot.replace(graphie, son)
+    mot = re.sub(r'(.)\1+', r'\1', mot)
+    # Première lettre gardée, voyelles et H retirés ensuite, consonne finale muette ignorée
+    squelette = re.sub('[AEIOUH]', '', mot[1:])
+    squelette = re.sub('[DSTX]$', '', squelette)
+    return (mot[0] + squelette)[:8]
+
+
+def cles(nom, prenom, date_naissance):
+    phon_nom, phon_prenom = phonetique(nom), phonetique(prenom)
+    date = str(date_naissance)
+    return {
+        'N:' + ':'.join(sorted([phon_nom, phon_prenom])),  # Nom et prénom inversés : même clé
+        f'D:{phon_nom}:{date}',
+        f'P:{phon_prenom}:{date}',
+    }
+
+
+def indexer(patient):
+    # Appelé après chaque enregistrement d'un patient (receiver dans models.py)
+    with transaction.atomic():
+        CleDoublon.tous.filter(patient_id=patient.pk).delete()
+        CleDoublon.tous.bulk_create(
+            CleDoublon(patient_id=patient.pk, hopital_id=patient.hopital_id, cle=cle)
+            for cle in cles(patient.nom, patient.prenom, patient.date_naissance)
+        )
+
+
+def reconstruire(chunk_size=2000):
+    # Index complet, pour les patients enregistrés avant l'index ou importés sans save()
+    total = 0
+    CleDoublon.tous.all().delete()
+    queryset = Patient.tous.order_by('pk').values_list('pk', 'hopital_id', 'nom', 'prenom', 'date_naissance')
+    lot = []
+    for pk, hopital_id, nom, prenom, date_naissance in queryset.iterator(chunk_size=chunk_size):
+        lot += [CleDoublon(patient_id=pk, hopital_id=hopital_id, cle=cle) for cle in cles(nom, prenom, date_naissance)]
+        total += 1
+        if len(lot) >= chunk_size:
+            CleDoublon.tous.bulk_create(lot)
+            lot = []
+    CleDoublon.tous.bulk_create(lot)
+    return total
+
+
+def bigrammes(chaines):
+    # Une ligne par chaîne : comptes de ses bigrammes (bornes comprises), hachés sur DIMENSION colonnes
+    matrice = np.zeros((len(chaines), DIMENSION), dtype=np.uint8)
+    for i, chaine in enumerate(chaines):
+        codes = np.frombuffer(f' {normaliser(chaine)} '.encode(), dtype=np.uint8).astype(np.int64)
+        np.add.at(matrice[i], (codes[:-1] * 37 + codes[1:]) % DIMENSION, 1)
+    return matrice
+
+
+def dice(a, b):
+    # Lignes alignées de deux matrices de bigrammes : une similarité par paire
+    communs = np.minimum(a, b).sum(axis=1, dtype=np.float64)
+    total = a.sum(axis=1, dtype=np.float64) + b.sum(axis=1, dtype=np.float64)
+    return np.divide(2 * communs, total, out=np.zeros_like(total), where=total > 0)
+
+
+def similarite_dates(a, b):
+    # 1 si égales, 0.8 si une seule composante diffère ou si jour et mois sont inversés
+    a, b = np.asarray(a, dtype='datetime64[D]'), np.asarray(b, dtype='datetime64[D]')
+    composantes = []
+    for dates in (a, b):
+        annees = dates.astype('datetime64[Y]').astype(np.int64)
+        mois = dates.astype('datetime64[M]').astype(np.int64) % 12 + 1
+        jours = (dates - dates.astype('datetime64[M]')).astype(np.int64) + 1
+        composantes.append((annees, mois, jours))
+    (a_a, m_a, j_a), (a_b, m_b, j_b) = composantes
+    differences = (a_a != a_b).astype(int) + (m_a != m_b) + (j_a != j_b)
+    inverses = (a_a == a_b) & (m_a == j_b) & (j_a == m_b)
+    return np.select([differences == 0, (differences == 1) | inverses], [1.0, 0.8], 0.0)
+
+
+def scorer(gauche, droite):
+    # gauche, droite : listes alignées de dicts (CHAMPS) ; un score par paire
+    if not gauche:
+        return np.zeros(0)
+    vecteurs = {
+        champ: (bigrammes([p[champ] for p in gauche]), bigrammes([p[champ] for p in droite]))
+        for champ in ('nom', 'prenom', 'nss')
+    }
+    (nom_g, nom_d), (prenom_g, prenom_d) = vecteurs['nom'], vecteurs['prenom']
+    # Nom et prénom éventuellement saisis l'un pour l'autre
+    noms = np.maximum(POIDS['nom'] * dice(nom_g, nom_d) + POIDS['prenom'] * dice(prenom_g, prenom_d),
+                      POIDS['nom'] * dice(nom_g, prenom_d) + POIDS['prenom'] * dice(prenom_g, nom_d))
+    dates = similarite_dates([p['date_naissance'] for p in gauche], [p['date_naissance'] for p in droite])
+    return noms + POIDS['date_naissance'] * dates + POIDS['nss'] * dice(*vecteurs['nss'])
+
+
+def candidats(nom, prenom, date_naissance, nss, hopital_id, exclure=None, seuil=None, limit=None):
+    # À l'enregistrement : patients du même hôpital partageant une clé, classés par score
+    seuil = DOUBLONS['SEUIL'] if seuil is None else seuil
+    patient_ids = (CleDoublon.tous.filter(hopital_id=hopital_id, cle__in=cles(nom, prenom, date_naissance))
+                   .exclude(patient_id=exclure).values('patient_id'))
+    existants = list(Patient.tous.filter(pk__in=patient_ids).values(*CHAMPS))
+    nouveau = {'nom': nom, 'prenom': prenom, 'date_naissance': date_naissance, 'nss': nss}
+    scores = scorer([nouveau] * len(existants), existants)
+    resultats = [{**patient, 'score': round(float(score), 3)}
+                 for patient, score in zip(existants, scores) if score >= seuil]
+    resultats.sort(key=lambda resultat: -resultat['score'])
+    return resultats[:limit or DOUBLONS['LIMIT']]
+
+
+def blocs(hopital_id=None):
+    # Clés partagées par au moins deux patients : (hôpital, clé, nombre)
+    queryset = CleDoublon.tous.all()
+    if hopital_id is not None:
+        queryset = queryset.filter(hopital_id=hopital_id)
+    return list(queryset.values_list('hopital_id', 'cle').annotate(n=Count('id')).filter(n__gt=1).order_by())
+
+
+def scanner_blocs(liste, seuil):
+    # Tâche d'un processus du pool : paires (a, b, score) des blocs donnés, a < b
+    paires = {}
+    for hopital_id, cle in liste:
+        patient_ids = CleDoublon.tous.filter(hopital_id=hopital_id, cle=cle).values('patient_id')
+        patients = list(Patient.tous.filter(pk__in=patient_ids).order_by('pk').values(*CHAMPS))
+        i, j = np.triu_indices(len(patients), k=1)
+        scores = scorer([patients[k] for k in i], [patients[k] for k in j])
+        for a, b, score in zip(i.tolist(), j.tolist(), scores.tolist()):
+            if score >= seuil:
+                paire = (patients[a]['id_utilisateur'], patients[b]['id_utilisateur'])
+                paires[paire] = max(score, paires.get(paire, 0))
+    return paires
+
+
+def scanner(hopital_id=None, seuil=None, processus=None):
+    # Retourne ({(a, b): score}, clés ignorées car trop communes)
+    seuil = DOUBLONS['SEUIL'] if seuil is None else seuil
+    processus = processus or DOUBLONS['PROCESSUS'] or os.cpu_count()
+    retenus, ignores = [], []
+    for hopital_id_bloc, cle, n in blocs(hopital_id):
+        (retenus if n <= DOUBLONS['MAX_BLOC'] else ignores).append((hopital_id_bloc, cle))
+    # Des lots de blocs par tâche : peu d'échanges avec les processus, charge répartie
+    taille = max(1, min(200, len(retenus) // (processus * 4) or 1))
+    lots = [retenus[i:i + taille] for i in range(0, len(retenus), taille)]
+    if processus == 1 or len(lots) < 2:
+        resultats = [scanner_blocs(lot, seuil) for lot in lots]
+    else:
+        executeur = ProcessPoolExecutor(max_workers=min(processus, len(lots)),
+                                        mp_context=multiprocessing.get_context('forkserver'),
+                                        initializer=django.setup)  # Avant d'importer ce module et les modèles
+        with executeur:
+            resultats = list(executeur.map(scanner_blocs, lots, [seuil] * len(lots)))
+    paires = {}
+    for resultat in resultats:
+        for paire, score in resultat.items():
+            paires[paire] = max(score, paires.get(paire, 0))
+    return paires, ignores
+
+
+def fusionner(survivant_id, doublon_id, auteur=None):
+    # Le contenu clinique du doublon passe dans le dossier du survivant, puis le doublon est
+    # supprimé (son dossier vide suit par cascade). Retourne le nombre de lignes déplacées.
+    if survivant_id == doublon_id:
+        raise FusionImpossible('Cannot merge a patient with itself')
+    with transaction.atomic():
+        patients = {patient.pk: patient for patient in Patient.tous.select_for_update().filter(pk__in=[survivant_id, doublon_id])}
+        if len(patients) != 2:
+            raise FusionImpossible('Patient not found')
+        survivant, doublon = patients[survivant_id], patients[doublon_id]
+        if survivant.hopital_id != doublon.hopital_id:
+            raise FusionImpossible('Patients belong to different hopitaux')
+
+        dossiers = {dossier.patient_id: dossier for dossier in
+                    DossierMedical.tous.select_for_update().filter(patient_id__in=[survivant_id, doublon_id])}
+        deplaces = {'resumes': 0, 'ordonnances': 0, 'bilans': 0, 'rendez_vous': 0}
+        deplaces['rendez_vous'] = RendezVous.objects.filter(patient_id=doublon_id).update(patient_id=survivant_id)
+        cible, source = dossiers.get(survivant_id), dossiers.get(doublon_id)
+        if source is not None and cible is None:
+            # Le survivant n'avait pas de dossier : il reprend celui du doublon tel quel
+            DossierMedical.tous.filter(pk=source.pk).update(patient_id=survivant_id, date_maj=timezone.now(),
+                                                            version=F('version') + 1)
+        elif source is not None:
+            if Lit.tous.filter(dossier_id__in=[cible.pk, source.pk]).count() == 2:
+                raise FusionImpossible('Both patients are in a bed, discharge one of them first')
+            for dossier in (cible, source):
+                archivage.rehydrater(dossier)
+            maintenant = timezone.now()
+            for cle, modele, champ in (('resumes', Resume, 'dpi'), ('ordonnances', Ordonnance, 'dpi_patient'),
+                                       ('bilans', BilanBiologique, 'dpi')):
+                ids = list(modele.tous.filter(**{f'{champ}_id': source.pk}).values_list('pk', flat=True))
+                # update() : pas de save() par ligne ; version et date_maj changent pour les tablettes
+                deplaces[cle] = modele.tous.filter(pk__in=ids).update(
+                    **{f'{champ}_id': cible.pk}, version=F('version') + 1, date_maj=maintenant)
+                for instance in modele.tous.filter(pk__in=ids):
+                    EvenementClinique.enregistrer(instance, EvenementClinique.MODIFIE)
+                if modele is Ordonnance:
+                    Traitement.tous.filter(ordonnance_id__in=ids).update(date_maj=maintenant)
+            Occurrence.tous.filter(dossier_id=source.pk).update(dossier_id=cible.pk)
+            # Lit et historique des mouvements suivent le dossier (Lit.dossier est unique)
+            lit = Lit.tous.filter(dossier_id=source.pk).values_list('pk', flat=True).first()
+            if lit is not None:
+                Lit.tous.filter(pk=lit).update(dossier_id=cible.pk)
+            MouvementLit.tous.filter(dossier_id=source.pk).update(dossier_id=cible.pk)
+            if lit is not None:
+                # Sans mouvement, l'occupation en mémoire des workers (hospitalisation.py) garderait le doublon
+                MouvementLit.tous.create(
+                    type=MouvementLit.TRANSFERT, dossier_id=cible.pk, lit_depart_id=lit, lit_arrivee_id=lit,
+                    hopital_id=cible.hopital_id, auteur_id=auteur.pk if auteur else None, date=maintenant,
+                )
+                transaction.on_commit(hospitalisation.get_index().invalider)
+            DossierSummary.recalculer([cible.pk, source.pk])
+        # Cumuls des statistiques inchangés : même hôpital, mêmes dates
+        doublon.delete()
+    return deplaces
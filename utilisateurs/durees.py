@@ -0,0 +1,39 @@
+import re
+from datetime import date, timedelta
+
+# Traitement.duree est saisi librement ("7 jours", "2 mois", "1 semaine", "10"),
+# on le convertit en nombre de jours pour calculer la date de fin du traitement.
+
+UNITES = {
+    'j': 1, 'jour': 1, 'jours': 1, 'day': 1, 'days': 1,
+    'sem': 7, 'semaine': 7, 'semaines': 7, 'week': 7, 'weeks': 7,
+    'mois': 30, 'month': 30, 'months': 30,
+    'an': 365, 'ans': 365, 'annee': 365, 'annees': 365, 'année': 365, 'années': 365,
+    'year': 365, 'years': 365,
+}
+
+DUREE_RE = re.compile(r'^\s*(\d+)\s*([^\d\s]*)\s*$')
+
+
+def duree_en_jours(duree):
+    # Retourne None si la durée n'est pas interprétable
+    match = DUREE_RE.match((duree or '').lower())
+    if not match:
+        return None
+    nombre, unite = match.groups()
+    if not unite:
+        return int(nombre)  # Un nombre seul est compté en jours
+    unite = unite.rstrip('.')
+    if unite not in UNITES:
+        return None
+    return int(nombre) * UNITES[unite]
+
+
+def periode_traitement(debut, duree):
+    # (date_debut, date_fin) inclusives, date_fin est None si la durée est inconnue
+    if isinstance(debut, str):
+        debut = date.fromisoformat(debut)
+    jours = duree_en_jours(duree)
+    if debut is None or not jours:
+        return debut, None
+    return debut, debut + timedelta(days=jours - 1)
@@ -0,0 +1,65 @@
+from django.db.models import Prefetch
+
+from .models import Ordonnance, Traitement
+
+# Sérialisation en lecture seule pour les listes : deux requêtes .values_list()
+# (ordonnances, puis traitements joints à leur médicament) et une seule passe
+# sur les lignes, sans instance de modèle ni appel de serializer par champ.
+# La sortie est identique à OrdonnanceSerializer(many=True).data, voir tests.py.
+
+ORDONNANCE_COLONNES = ('id_ordonnance', 'date', 'medecin_id', 'dpi_patient_id', 'version')
+TRAITEMENT_COLONNES = (
+    'ordonnance_id', 'id_traitement',
+    'medicament__id_medicament', 'medicament__nom', 'medicament__dosage', 'medicament__forme',
+    'quantite', 'description', 'duree',
+)
+
+
+def traitements_ordonnes():
+    # Ordre des lignes partagé par le chemin rapide et le chemin serializer
+    return Traitement.objects.order_by('id_traitement')
+
+
+def prefetch_ordonnances(queryset):
+    # Chemin serializer équivalent (utilisé avec ?fields= / ?expand=)
+    return queryset.prefetch_related(
+        Prefetch('medicaments', queryset=traitements_ordonnes().select_related('medicament'))
+    )
+
+
+def ordonnances_data(queryset):
+    ordonnances = []
+    par_id = {}
+    for id_ordonnance, date, medecin, dpi_patient, version in queryset.values_list(*ORDONNANCE_COLONNES):
+        medicaments = []
+        ordonnances.append({
+            'id_ordonnance': id_ordonnance,
+            'date': date.isoformat(),
+            'medecin': medecin,
+            'dpi_patient': dpi_patient,
+            'medicaments': medicaments,
+            'version': version,
+        })
+        par_id[id_ordonnance] = medicaments
+
+    if not par_id:
+        return ordonnances
+
+    lignes = (traitements_ordonnes()
+              .filter(ordonnance_id__in=list(par_id))
+              .values_list(*TRAITEMENT_COLONNES))
+    for ordonnance, id_traitement, id_medicament, nom, dosage, forme, quantite, description, duree in lignes:
+        par_id[ordonnance].append({
+            'id_traitement': id_traitement,
+            'medicament': {
+                'id_medicament': id_medicament,
+                'nom': nom,
+                'dosage': dosage,
+                'forme': forme,
+            },
+            'quantite': quantite,
+            'description': description,
+            'duree': duree,
+            'ordonnance': ordonnance,
+        })
+    return ordonnances
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Lit, MouvementLit, Service
+from .outbox import Trous
+
+# Occupation des lits (GET /api/lits) et mouvements des patients (admission, transfert, sortie).
+#
+# Un mouvement est une suite d'UPDATE conditionnels sur Lit.dossier, dans une transaction :
+#   UPDATE lit SET dossier = NULL WHERE id = <départ> AND dossier = <patient>
+#   UPDATE lit SET dossier = <patient> WHERE id = <arrivée> AND actif AND dossier IS NULL
+# Deux mouvements concurrents sur le même lit ou le même patient se sérialisent sur la ligne,
+# le second ne touche aucune ligne et la transaction est annulée. La ligne MouvementLit est
+# insérée dans la même transaction.
+#
+# Chaque worker garde l'occupation en mémoire : la structure (services, chambres, lits) et le
+# rejeu de MouvementLit dans l'ordre de seq, puis seulement les mouvements plus récents que le
+# dernier appliqué (une lecture de la clé primaire, au plus toutes les RAFRAICHISSEMENT
+# secondes). Comme pour /api/events, un trou dans seq (transaction pas encore commitée) est
+# attendu GAP_TIMEOUT secondes après sa première observation par ce processus : la date du
+# mouvement est prise avant la transaction et ne dit pas depuis quand il manque. Reconstruction complète toutes les TTL secondes, pour les modifications
+# de structure dans l'admin, les noms de patients et les dossiers supprimés ou fusionnés.
+
+HOSPITALISATION = {
+    'TTL': 300,              # secondes avant reconstruction complète
+    'RAFRAICHISSEMENT': 1,   # secondes entre deux lectures des nouveaux mouvements
+    'GAP_TIMEOUT': 5,        # secondes
+    'GAP_MAX_AGE': 3600,     # secondes ; un trou suivi d'un mouvement plus ancien n'est pas attendu
+    'CHUNK_SIZE': 10000,
+    **getattr(settings, 'HOSPITALISATION', {}),
+}
+
+
+class MouvementImpossible(Exception):
+    pass
+
+
+trous = Trous()
+
+
+class IndexOccupation:
+    def __init__(self):
+        self.services = {}   # id -> {'hopital', 'code', 'nom', 'lits': [id, ...]}
+        self.lits = {}       # id -> [service, chambre, numero, actif, dossier, patient, depuis]
+        self.blocs = {}      # service -> (données de l'occupation, empreinte), calculé à la lecture
+        self.seq = 0
+        self.charge_le = None
+        self.verifie_le = 0.0
+        self.lock = threading.Lock()
+
+    def reconstruire(self):
+        self.services = {
+            service_id: {'hopital': hopital_id, 'code': code, 'nom': nom, 'lits': []}
+            for service_id, hopital_id, code, nom in
+            Service.tous.order_by('hopital_id', 'code').values_list('pk', 'hopital_id', 'code', 'nom')
+        }
+        self.lits = {}
+        for lit_id, service_id, chambre, numero, actif in (
+                Lit.tous.order_by('chambre__service_id', 'chambre__numero', 'numero')
+                .values_list('pk', 'chambre__service_id', 'chambre__numero', 'numero', 'actif')
+                .iterator(chunk_size=HOSPITALISATION['CHUNK_SIZE'])):
+            self.lits[lit_id] = [service_id, chambre, numero, actif, None, None, None]
+            self.services[service_id]['lits'].append(lit_id)
+        self.blocs = {}
+        self.seq = 0
+        self.appliquer(self.nouveaux())
+        self.charge_le = self.verifie_le = time.monotonic()
+
+    def nouveaux(self):
+        return (MouvementLit.tous.filter(seq__gt=self.seq).order_by('seq')
+                .values_list('seq', 'lit_depart_id', 'lit_arrivee_id', 'dossier_id',
+                             'dossier__patient__nom', 'dossier__patient__prenom', 'date')
+                .iterator(chunk_size=HOSPITALISATION['CHUNK_SIZE']))
+
+    def appliquer(self, mouvements):
+        # False si un mouvement vise un lit inconnu (créé depuis le chargement de la structure)
+        for seq, depart, arrivee, dossier_id, nom, prenom, date in mouvements:
+            if seq != self.seq + 1 and trous.ouvert(self.seq + 1, date, HOSPITALISATION['GAP_TIMEOUT'],
+                                                    HOSPITALISATION['GAP_MAX_AGE']):
+                break
+            for lit_id in (depart, arrivee):
+                if lit_id is not None and lit_id not in self.lits:
+                    return False
+            if depart is not None and self.lits[depart][4] == dossier_id:
+                self.lits[depart][4:] = [None, None, None]
+                self.blocs.pop(self.lits[depart][0], None)
+            if arrivee is not None:
+                self.lits[arrivee][4:] = [dossier_id, f'{nom} {prenom}', date]
+                self.blocs.pop(self.lits[arrivee][0], None)
+            self.seq = seq
+        return True
+
+    def rafraichir(self):
+        maintenant = time.monotonic()
+        if self.charge_le is None or maintenant - self.charge_le > HOSPITALISATION['TTL']:
+            self.reconstruire()
+        elif maintenant - self.verifie_le >= HOSPITALISATION['RAFRAICHISSEMENT']:
+            if not self.appliquer(self.nouveaux()):
+                self.reconstruire()
+            self.verifie_le = maintenant
+
+    def bloc(self, service_id):
+        # Occupation d'un service et son empreinte, recalculées quand un mouvement le touche
+        if service_id not in self.blocs:
+            service = self.services[service_id]
+            lits = []
+            for lit_id in service['lits']:
+                _, chambre, numero, actif, dossier_id, patient, depuis = self.lits[lit_id]
+                lits.append({
+                    "lit": lit_id,
+                    "chambre": chambre,
+                    "numero": numero,
+                    "actif": actif,
+                    "dossier": dossier_id,
+                    "patient": patient,
+                    "depuis": depuis.isoformat() if depuis else None,
+                })
+            occupes = sum(1 for lit in lits if lit["dossier"] is not None)
+            donnees = {
+                "service": service['code'],
+                "nom": service['nom'],
+                "lits": lits,
+                "occupes": occupes,
+                "libres": sum(1 for lit in lits if lit["actif"]) - occupes,
+            }
+            empreinte = hashlib.blake2b(json.dumps(donnees, sort_keys=True).encode(), digest_size=16).digest()
+            self.blocs[service_id] = (donnees, empreinte)
+        return self.blocs[service_id]
+
+    def occupation(self, hopital_id=None, code=None):
+        # (services, etag) ; l'ETag ne dépend que du contenu, identique d'un worker à l'autre
+        with self.lock:
+            self.rafraichir()
+            blocs = [self.bloc(service_id) for service_id, service in self.services.items()
+                     if (hopital_id is None or service['hopital'] == hopital_id)
+                     and (code is None or service['code'] == code)]
+        etag = hashlib.blake2b(b''.join(empreinte for _, empreinte in blocs), digest_size=16).hexdigest()
+        return [donnees for donnees, _ in blocs], f'"{etag}"'
+
+    def invalider(self):
+        # Après un mouvement de ce processus : relu à la prochaine lecture, sans attendre
+        self.verifie_le = 0.0
+
+
+_index = IndexOccupation()
+
+
+def get_index():
+    return _index
+
+
+def deplacer(dossier, type, lit_id=None, auteur=None):
+    # Admission (lit_id), transfert (lit_id) ou sortie du patient du dossier
+    date = timezone.now()
+    with transaction.atomic():
+        depart = Lit.tous.filter(dossier_id=dossier.pk).values_list('pk', flat=True).first()
+        if type == MouvementLit.ADMISSION and depart is not None:
+            raise MouvementImpossible('Patient already has a bed, use a transfer')
+        if type != MouvementLit.ADMISSION and depart is None:
+            raise MouvementImpossible('Patient has no bed')
+        if lit_id is not None and lit_id == depart:
+            raise MouvementImpossible('Patient is already in this bed')
+        if lit_id is not None:
+            hopital_id = Lit.tous.filter(pk=lit_id).values_list('chambre__service__hopital_id', flat=True).first()
+            if hopital_id is None:
+                raise MouvementImpossible('Bed not found')
+            if dossier.hopital_id is not None and hopital_id != dossier.hopital_id:
+                raise MouvementImpossible('Bed belongs to another hopital')
+
+        if depart is not None and not Lit.tous.filter(pk=depart, dossier_id=dossier.pk).update(dossier=None, depuis=None):
+            raise MouvementImpossible('Patient was moved by someone else, reload and try again')
+        if lit_id is not None:
+            try:
+                with transaction.atomic():
+                    occupe = Lit.tous.filter(pk=lit_id, actif=True, dossier__isnull=True).update(
+                        dossier_id=dossier.pk, depuis=date)
+            except IntegrityError:  # Lit.dossier unique : admission concurrente du même patient
+                raise MouvementImpossible('Patient was moved by someone else, reload and try again')
+            if not occupe:
+                raise MouvementImpossible('Bed is occupied or closed')
+
+        mouvement = MouvementLit.tous.create(
+            type=type, dossier_id=dossier.pk, lit_depart_id=depart, lit_arrivee_id=lit_id,
+            hopital_id=dossier.hopital_id, auteur_id=auteur.pk if auteur else None, date=date,
+        )
+        transaction.on_commit(_index.invalider)
+    return mouvement
+
+
+def admettre(dossier, lit_id, auteur=None):
+    return deplacer(dossier, MouvementLit.ADMISSION, lit_id, auteur)
+
+
+def transferer(dossier, lit_id, auteur=None):
+    return deplacer(dossier, MouvementLit.TRANSFERT, lit_id, auteur)
+
+
+def sortir(dossier, auteur=None):
+    return deplacer(dossier, MouvementLit.SORTIE, None, auteur)
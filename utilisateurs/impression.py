@@ -0,0 +1,240 @@
+import functools
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
+
+from . import archivage, pdf
+from .asynchrone import base
+from .models import BilanBiologique, DossierMedical, Ordonnance, Resume, Traitement
+from .tenancy import activer
+
+# Impression des ordonnances et comptes rendus de dossier (rendu dans pdf.py).
+# Les données sont lues ici en quelques requêtes par lot et transformées en dictionnaires
+# simples ; le rendu se fait dans un pool de processus (pas de base, pas de GIL partagé)
+# dès que le lot dépasse SEUIL_POOL documents. Le lot est renvoyé au fil du rendu, dans
+# l'ordre demandé, en un seul PDF ou en ZIP d'un PDF par document. Un gros lot n'est pas
+# chargé d'avance : les documents sont lus par paquets de LOT au fil de l'envoi.
+
+PDF = {
+    'PROCESSUS': 0,          # 0 : un par cœur
+    'SEUIL_POOL': 20,        # en dessous, rendu dans le processus de la requête
+    'MAX_DOCUMENTS': 5000,
+    'LOT': 200,              # documents lus et rendus ensemble pendant l'envoi
+    **getattr(settings, 'PDF', {}),
+}
+
+_pool = None
+
+
+def nouveau_pool(processus):
+    # forkserver : les processus de rendu ne copient ni les connexions à la base
+    # ni les threads (audit, notifications) du serveur
+    return ProcessPoolExecutor(max_workers=processus, mp_context=multiprocessing.get_context('forkserver'),
+                               initializer=pdf.precompiler)
+
+
+def pool():
+    # Un pool par processus web, démarré au premier lot
+    global _pool
+    if _pool is None:
+        _pool = nouveau_pool(PDF['PROCESSUS'] or os.cpu_count())
+    return _pool
+
+
+def nom(utilisateur):
+    return f'{utilisateur.prenom} {utilisateur.nom}' if utilisateur else ''
+
+
+def lignes(ordonnance):
+    return [{
+        'medicament': traitement.medicament.nom,
+        'dosage': traitement.medicament.dosage,
+        'forme': traitement.medicament.forme,
+        'quantite': traitement.quantite,
+        'duree': traitement.duree,
+        'description': traitement.description,
+    } for traitement in ordonnance.medicaments.all()]
+
+
+def document_ordonnance(ordonnance):
+    patient = ordonnance.dpi_patient.patient
+    return {
+        'type': 'ordonnance',
+        'id': ordonnance.id_ordonnance,
+        'dossier': ordonnance.dpi_patient_id,
+        'hopital': patient.hopital.nom if patient.hopital else '',
+        'medecin': f'Dr {nom(ordonnance.medecin)}',
+        'specialite': ordonnance.medecin.specialite,
+        'date': str(ordonnance.date),
+        'patient': nom(patient),
+        'naissance': str(patient.date_naissance),
+        'nss': patient.nss,
+        'lignes': lignes(ordonnance),
+    }
+
+
+def document_dossier(dossier):
+    patient = dossier.patient
+    par_date = lambda objet: (str(objet.date), objet.pk)
+    return {
+        'type': 'dossier',
+        'id': dossier.id,
+        'dossier': dossier.id,
+        'edition': timezone.localdate().isoformat(),
+        'hopital': patient.hopital.nom if patient.hopital else '',
+        'patient': nom(patient),
+        'naissance': str(patient.date_naissance),
+        'nss': patient.nss,
+        'cloture': str(dossier.date_cloture) if dossier.date_cloture else '',
+        'consultations': [{
+            'date': str(resume.date),
+            'medecin': f'Dr {nom(resume.medecin)}' if resume.medecin_id else '',
+            'description': resume.description,
+        } for resume in sorted(dossier.consultations.all(), key=par_date)],
+        'ordonnances': [{
+            'date': str(ordonnance.date),
+            'medecin': f'Dr {nom(ordonnance.medecin)}',
+            'lignes': lignes(ordonnance),
+        } for ordonnance in sorted(dossier.ordonnances.all(), key=par_date)],
+        'bilans': [{
+            'date': str(bilan.date),
+            'result': bilan.result,
+            'description': bilan.description,
+        } for bilan in sorted(dossier.bilans.all(), key=par_date)],
+    }
+
+
+def ordonnances(ids):
+    # Dans l'ordre demandé, les identifiants inconnus (ou d'un autre hôpital) sont ignorés
+    queryset = (Ordonnance.objects.filter(pk__in=ids)
+                .select_related('medecin', 'dpi_patient__patient__hopital')
+                .prefetch_related(Prefetch('medicaments', Traitement.tous.select_related('medicament').order_by('pk'))))
+    par_id = {ordonnance.pk: ordonnance for ordonnance in queryset}
+    return [document_ordonnance(par_id[i]) for i in ids if i in par_id]
+
+
+def dossiers(ids):
+    par_id = DossierMedical.objects.select_related('patient__hopital').in_bulk(ids)
+    courants = [dossier for dossier in par_id.values() if not dossier.archive]
+    for dossier in par_id.values():
+        if dossier.archive:
+            archivage.charger(dossier)  # Lu depuis l'archive, sans la rehydrater
+    prefetch_related_objects(
+        courants,
+        Prefetch('consultations', Resume.tous.select_related('medecin')),
+        Prefetch('ordonnances', Ordonnance.tous.select_related('medecin')),
+        Prefetch('ordonnances__medicaments', Traitement.tous.select_related('medicament').order_by('pk')),
+        Prefetch('bilans', BilanBiologique.tous.all()),
+    )
+    return [document_dossier(par_id[i]) for i in ids if i in par_id]
+
+
+def references(ids_ordonnances, ids_dossiers):
+    # [(type, id, dossier)] dans l'ordre demandé, sans charger les documents
+    ordonnances = dict(Ordonnance.objects.filter(pk__in=ids_ordonnances).values_list('pk', 'dpi_patient_id'))
+    dossiers = set(DossierMedical.objects.filter(pk__in=ids_dossiers).values_list('pk', flat=True))
+    return ([('ordonnance', i, ordonnances[i]) for i in ids_ordonnances if i in ordonnances]
+            + [('dossier', i, i) for i in ids_dossiers if i in dossiers])
+
+
+def charger(references, hopital_id=None):
+    with activer(hopital_id):
+        par_cle = {('ordonnance', document['id']): document
+                   for document in ordonnances([i for type, i, _ in references if type == 'ordonnance'])}
+        par_cle.update({('dossier', document['id']): document
+                        for document in dossiers([i for type, i, _ in references if type == 'dossier'])})
+    # Un document supprimé depuis la lecture des références est ignoré
+    return [par_cle[type, i] for type, i, _ in references if (type, i) in par_cle]
+
+
+def lots(references, hopital_id=None):
+    # Paquets de documents pour flux_pdf / flux_zip, chargés à la demande. Lu après la sortie
+    # de HopitalMiddleware : l'hôpital est réactivé à chaque paquet.
+    for debut in range(0, len(references), PDF['LOT']):
+        yield charger(references[debut:debut + PDF['LOT']], hopital_id)
+
+
+def rendre_lot(documents, processus=None):
+    # Itérateur des résultats de pdf.rendre, dans l'ordre des documents
+    defaut = PDF['PROCESSUS'] or os.cpu_count()
+    processus = processus or defaut
+    if len(documents) < PDF['SEUIL_POOL'] or processus == 1:
+        return map(pdf.rendre, documents)
+    # Autre taille que celle du réglage (commande imprimer, benchmark) : pool dédié au lot
+    dedie = processus != defaut
+    executeur = nouveau_pool(processus) if dedie else pool()
+    # Des paquets de documents par échange avec les processus, assez petits pour répartir la charge
+    chunksize = max(1, min(16, len(documents) // (processus * 4)))
+    return resultats(executeur, documents, chunksize, dedie)
+
+
+def resultats(executeur, documents, chunksize, dedie):
+    global _pool
+    try:
+        yield from executeur.map(pdf.rendre, documents, chunksize=chunksize)
+    except BrokenProcessPool:
+        if not dedie:
+            _pool = None  # Un processus de rendu a été tué : nouveau pool au prochain lot
+        raise
+    finally:
+        if dedie:
+            executeur.shutdown(wait=False, cancel_futures=True)
+
+
+def flux_pdf(lots, processus=None):
+    # Un seul PDF, envoyé par morceaux au fil du rendu ; lots : listes de documents successives
+    ecriture = pdf.EcriturePDF()
+    yield ecriture.entete()
+    for documents in lots:
+        for pages in rendre_lot(documents, processus):
+            yield b''.join(ecriture.page(*page) for page in pages)
+    yield ecriture.fin()
+
+
+class _Tampon:
+    # Sortie non positionnable pour ZipFile : il écrit alors des descripteurs de données
+    def __init__(self):
+        self.morceaux = []
+
+    def write(self, octets):
+        self.morceaux.append(bytes(octets))
+        return len(octets)
+
+    def flush(self):
+        pass
+
+    def vider(self):
+        octets = b''.join(self.morceaux)
+        self.morceaux = []
+        return octets
+
+
+def flux_zip(lots, processus=None):
+    # Un PDF par document ; déjà compressés (FlateDecode), stockés sans recompression
+    tampon = _Tampon()
+    with zipfile.ZipFile(tampon, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for documents in lots:
+            for document, pages in zip(documents, rendre_lot(documents, processus)):
+                archive.writestr(f"{document['type']}-{document['id']}.pdf", pdf.assembler(pages))
+                yield tampon.vider()
+    yield tampon.vider()
+
+
+async def flux_async(flux):
+    # Sous ASGI, StreamingHttpResponse lirait un itérateur synchrone en entier avant d'envoyer
+    # le premier octet : chaque morceau (lecture, rendu) est produit dans un thread
+    suivant = base(functools.partial(next, flux, None))
+    while (morceau := await suivant()) is not None:
+        yield morceau
+
+
+FORMATS = {
+    'pdf': (flux_pdf, 'application/pdf'),
+    'zip': (flux_zip, 'application/zip'),
+}
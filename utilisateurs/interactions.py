@@ -0,0 +1,78 @@
+import time
+
+from django.conf import settings
+
+from .models import InteractionMedicamenteuse
+
+# Index en mémoire de la table InteractionMedicamenteuse.
+# Chaque nom de médicament reçoit un code entier, une paire (a, b) avec a < b
+# est rangée sous la clé (a << 32) | b : une vérification est une suite de
+# lookups dans un dict, sans requête SQL.
+
+INTERACTIONS_TTL = getattr(settings, 'INTERACTIONS_TTL', 300)  # secondes avant rechargement
+
+
+def normaliser(nom):
+    return nom.strip().lower()
+
+
+class InteractionIndex:
+    def __init__(self, interactions=()):
+        self.codes = {}
+        self.paires = {}
+        for medicament_a, medicament_b, gravite, description in interactions:
+            self.ajouter(medicament_a, medicament_b, gravite, description)
+
+    def code(self, nom):
+        return self.codes.setdefault(normaliser(nom), len(self.codes))
+
+    def ajouter(self, medicament_a, medicament_b, gravite, description=''):
+        a, b = self.code(medicament_a), self.code(medicament_b)
+        if a > b:
+            a, b = b, a
+        self.paires[(a << 32) | b] = (gravite, description)
+
+    def verifier(self, nouveaux, actifs=()):
+        # Toutes les paires nouveau x actif et nouveau x nouveau, en une passe
+        codes = self.codes
+        nouveaux = [(codes[n], nom) for nom in nouveaux if (n := normaliser(nom)) in codes]
+        if not nouveaux:
+            return []
+        actifs = [(codes[n], nom) for nom in actifs if (n := normaliser(nom)) in codes]
+
+        paires = self.paires
+        alertes = []
+        for i, (a, nom_a) in enumerate(nouveaux):
+            for b, nom_b in nouveaux[i + 1:] + actifs:
+                interaction = paires.get((a << 32) | b if a < b else (b << 32) | a)
+                if interaction is not None:
+                    alertes.append({
+                        "medicament": nom_a,
+                        "interagit_avec": nom_b,
+                        "gravite": interaction[0],
+                        "description": interaction[1],
+                    })
+        return alertes
+
+    def __len__(self):
+        return len(self.paires)
+
+
+_index = None
+_charge_le = 0.0
+
+
+def get_index():
+    # Un index par processus, rechargé au plus toutes les INTERACTIONS_TTL secondes
+    global _index, _charge_le
+    if _index is None or time.monotonic() - _charge_le > INTERACTIONS_TTL:
+        _index = InteractionIndex(InteractionMedicamenteuse.objects.values_list(
+            'medicament_a', 'medicament_b', 'gravite', 'description'
+        ).iterator(chunk_size=10000))
+        _charge_le = time.monotonic()
+    return _index
+
+
+def invalider():
+    global _index
+    _index = None
@@ -0,0 +1,26 @@
+import contextlib
+import time
+
+from django.db import connection
+
+# Outils communs aux commandes bench_* (ignoré comme commande grâce au "_")
+
+
+def mesurer(fonction, repetitions):
+    # Retourne (dernier résultat, durée moyenne en secondes)
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        resultat = fonction()
+    return resultat, (time.perf_counter() - start) / repetitions
+
+
+@contextlib.contextmanager
+def base_de_test():
+    # Les benchmarks qui écrivent des données tournent sur une base de test jetable,
+    # jamais sur la base configurée
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
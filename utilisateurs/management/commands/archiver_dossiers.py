@@ -0,0 +1,65 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db.models import DateField, Q, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from utilisateurs import archivage
+from utilisateurs.models import DossierMedical
+
+
+class Command(BaseCommand):
+    help = "Archive le contenu clinique des dossiers clos ou inactifs dans ArchiveDossier"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inactif-depuis', type=int, default=archivage.ARCHIVAGE['INACTIF_JOURS'],
+                            help="Jours sans activité (DossierSummary) avant archivage")
+        parser.add_argument('--cloture-depuis', type=int, default=archivage.ARCHIVAGE['CLOTURE_JOURS'],
+                            help="Jours après DossierMedical.date_cloture avant archivage")
+        parser.add_argument('--limit', type=int, default=None)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        aujourd_hui = timezone.localdate()
+        jamais = Value(datetime.date.min, output_field=DateField())
+        # Dernière activité connue d'après le résumé, un traitement en cours compte jusqu'à sa fin
+        derniere_activite = Greatest(
+            Coalesce('summary__derniere_consultation', jamais),
+            Coalesce('summary__derniere_ordonnance', jamais),
+            Coalesce('summary__dernier_bilan', jamais),
+            Coalesce('summary__fin_traitements', jamais),
+        )
+        dossiers = (DossierMedical.tous
+                    .filter(archive=False)
+                    .annotate(derniere_activite=derniere_activite)
+                    .filter(
+                        Q(date_cloture__lte=aujourd_hui - datetime.timedelta(days=options['cloture_depuis']))
+                        | Q(derniere_activite__lt=aujourd_hui - datetime.timedelta(days=options['inactif_depuis']))
+                    )
+                    .order_by('id')
+                    .values_list('id', flat=True))
+        if options['limit']:
+            dossiers = dossiers[:options['limit']]
+        dossiers = list(dossiers)
+
+        if options['dry_run']:
+            self.stdout.write(f'{len(dossiers)} dossier(s) would be archived')
+            return
+
+        total = brut = compresse = lignes = 0
+        # Une transaction par dossier : l'archivage peut être interrompu et relancé
+        for dossier_id in dossiers:
+            archive = archivage.archiver(dossier_id)
+            if archive is None:
+                continue
+            total += 1
+            brut += archive.taille
+            compresse += len(archive.donnees)
+            lignes += archive.nb_lignes
+            if total % 100 == 0:
+                self.stdout.write(f'{total} dossier(s) archived')
+        ratio = f', compression x{brut / compresse:.1f}' if compresse else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'Done, {total} dossier(s), {lignes} row(s) moved, {brut} bytes -> {compresse} bytes{ratio}'
+        ))
@@ -0,0 +1,83 @@
+import datetime
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Sum
+
+from utilisateurs import pharmacie
+from utilisateurs.models import (DossierMedical, LigneDispensation, Medecin, Medicament, Ordonnance, Patient, SGPH,
+                                 Stock)
+
+from ._bench import base_de_test
+
+
+class Command(BaseCommand):
+    help = "Dispense en rafale des ordonnances qui tirent toutes sur le même médicament (base de test)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ordonnances', type=int, default=2000)
+        parser.add_argument('--stock', type=int, default=5000, help="Stock initial du médicament partagé")
+        parser.add_argument('--threads', type=int, default=1, help="> 1 seulement sur une base qui le supporte (MySQL)")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with base_de_test():
+            self.run(options)
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        medecin = Medecin.objects.create(nom='Bench', prenom='Medecin', email='bench@example.com')
+        sgph = SGPH.objects.create(nom='Bench', prenom='SGPH', email='sgph@example.com')
+        patient = Patient.objects.create(nom='Bench', prenom='Patient', email='patient@example.com',
+                                         nss='bench', date_naissance=datetime.date(1980, 1, 1))
+        dossier = DossierMedical.objects.create(patient=patient)
+        medicaments = Medicament.objects.bulk_create(
+            Medicament(nom=f'Medicament {i}', dosage='500mg', forme='Comprimé') for i in range(20)
+        )
+        partage = medicaments[0]
+        Stock.objects.bulk_create(Stock(medicament=medicament, quantite=10 ** 9) for medicament in medicaments[1:])
+        Stock.objects.create(medicament=partage, quantite=options['stock'])
+        ordonnances = Ordonnance.objects.bulk_create(
+            Ordonnance(date=datetime.date(2024, 1, 1), medecin=medecin, dpi_patient=dossier)
+            for _ in range(options['ordonnances'])
+        )
+        # Chaque ordonnance : le médicament partagé + 0 à 3 autres
+        besoins = {
+            ordonnance.id_ordonnance: {
+                partage.id_medicament: rng.randrange(1, 6),
+                **{medicament.id_medicament: rng.randrange(1, 30) for medicament in rng.sample(medicaments[1:], rng.randrange(4))},
+            }
+            for ordonnance in ordonnances
+        }
+
+        def dispenser(ordonnance):
+            try:
+                pharmacie.dispenser(ordonnance, sgph, besoins[ordonnance.id_ordonnance])
+                return True
+            except pharmacie.DispensationImpossible:
+                return False
+            finally:
+                if options['threads'] > 1:
+                    connection.close()
+
+        start = time.perf_counter()
+        if options['threads'] > 1:
+            with ThreadPoolExecutor(options['threads']) as pool:
+                resultats = list(pool.map(dispenser, ordonnances))
+        else:
+            resultats = [dispenser(ordonnance) for ordonnance in ordonnances]
+        duree = time.perf_counter() - start
+
+        delivre = LigneDispensation.objects.filter(medicament=partage).aggregate(total=Sum('quantite'))['total'] or 0
+        restant = Stock.objects.get(medicament=partage).quantite
+        self.stdout.write(
+            f'{len(resultats)} dispensations in {duree:.2f} s ({len(resultats) / duree:.0f}/s), '
+            f'{sum(resultats)} served, {len(resultats) - sum(resultats)} refused for lack of stock'
+        )
+        self.stdout.write(
+            f'shared drug: initial {options["stock"]}, dispensed {delivre}, remaining {restant}, '
+            f'consistent: {options["stock"] - delivre == restant and restant >= 0}'
+        )
@@ -0,0 +1,45 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from utilisateurs.interactions import InteractionIndex
+
+
+class Command(BaseCommand):
+    help = "Mesure la vérification d'interactions sur une table synthétique"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medicaments', type=int, default=20000)
+        parser.add_argument('--interactions', type=int, default=1000000)
+        parser.add_argument('--ordonnances', type=int, default=10000)
+        parser.add_argument('--nouveaux', type=int, default=5, help="Médicaments par ordonnance")
+        parser.add_argument('--actifs', type=int, default=15, help="Traitements en cours du patient")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        noms = [f'medicament {i}' for i in range(options['medicaments'])]
+
+        start = time.perf_counter()
+        index = InteractionIndex()
+        for _ in range(options['interactions']):
+            a, b = rng.sample(noms, 2)
+            index.ajouter(a, b, 'moderee', 'synthetic')
+        build = time.perf_counter() - start
+
+        prescriptions = [
+            (rng.sample(noms, options['nouveaux']), rng.sample(noms, options['actifs']))
+            for _ in range(options['ordonnances'])
+        ]
+        alertes = 0
+        start = time.perf_counter()
+        for nouveaux, actifs in prescriptions:
+            alertes += len(index.verifier(nouveaux, actifs))
+        check = time.perf_counter() - start
+
+        self.stdout.write(f'index: {len(index)} pairs over {len(index.codes)} drugs, built in {build:.2f} s')
+        self.stdout.write(
+            f'check: {options["ordonnances"]} prescriptions ({options["nouveaux"]} new x {options["actifs"]} active), '
+            f'{check / options["ordonnances"] * 1e6:.1f} us per prescription, {alertes} warnings'
+        )
@@ -0,0 +1,87 @@
+import asyncio
+import datetime
+import time
+import tracemalloc
+
+import jwt
+from django.core.management.base import BaseCommand
+
+from utilisateurs import realtime
+from utilisateurs.asynchrone import base
+from utilisateurs.models import BilanBiologique, DossierMedical, Medecin, Ordonnance, Patient
+
+from ._bench import base_de_test
+
+
+class Command(BaseCommand):
+    help = "Ouvre des milliers de connexions SSE inactives dans un worker et mesure la diffusion d'un bilan"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connexions', type=int, default=5000)
+        parser.add_argument('--medecins', type=int, default=200)
+
+    def handle(self, *args, **options):
+        with base_de_test():
+            patient = Patient.objects.create(nom='Patient', prenom='Bench', email='patient@example.com',
+                                             nss='bench', date_naissance=datetime.date(1980, 1, 1))
+            dossier = DossierMedical.objects.create(patient=patient)
+            medecins = []
+            for i in range(options['medecins']):
+                medecin = Medecin.objects.create(nom=f'Medecin{i}', prenom='Bench', email=f'medecin{i}@example.com')
+                # Chaque médecin a prescrit dans le dossier : tous reçoivent le bilan
+                Ordonnance.objects.create(medecin=medecin, dpi_patient=dossier, date=datetime.date.today())
+                medecins.append(medecin.id_utilisateur)
+            asyncio.run(self.simuler(options['connexions'], medecins, dossier.id))
+
+    async def simuler(self, nombre, medecins, dossier_id):
+        tokens = [jwt.encode({'id': medecin}, 'secret', algorithm='HS256') for medecin in medecins]
+        deconnexion = asyncio.Event()
+        recus = 0
+        tous_recus = asyncio.Event()
+
+        async def receive():
+            await deconnexion.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal recus
+            if message.get('body', b'').startswith(b'id: '):
+                recus += 1
+                if recus == nombre:
+                    tous_recus.set()
+
+        tracemalloc.start()
+        avant = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        clients = [
+            asyncio.ensure_future(realtime.sse({
+                'type': 'http',
+                'path': realtime.REALTIME['SSE_PATH'],
+                'headers': [(b'authorization', tokens[i % len(tokens)].encode())],
+                'query_string': b'',
+            }, receive, send))
+            for i in range(nombre)
+        ]
+        while len(realtime.connexions) < nombre:
+            await asyncio.sleep(0.05)
+        ouverture = time.perf_counter() - start
+        memoire = tracemalloc.get_traced_memory()[0] - avant
+        tracemalloc.stop()
+        self.stdout.write(
+            f'{nombre} idle connections opened in {ouverture:.2f} s, '
+            f'{memoire / nombre / 1024:.1f} KiB per connection ({memoire / 2 ** 20:.1f} MiB)'
+        )
+
+        # Laisse le diffuseur lire le seq de départ avant l'écriture
+        await asyncio.sleep(0.1)
+        start = time.perf_counter()
+        await base(lambda: BilanBiologique.objects.create(
+            dpi_id=dossier_id, date=datetime.date.today(), result='Hb 13.5'
+        ))()
+        await asyncio.wait_for(tous_recus.wait(), 30)
+        self.stdout.write(f'bilan fanned out to {recus} connections in {(time.perf_counter() - start) * 1000:.1f} ms')
+
+        deconnexion.set()
+        await asyncio.gather(*clients)
+        await asyncio.sleep(0)
+        self.stdout.write(f'{len(realtime.connexions)} connection(s) left after disconnect')
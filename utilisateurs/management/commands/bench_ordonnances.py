@@ -0,0 +1,58 @@
+import datetime
+import random
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from utilisateurs.fastpath import ordonnances_data, prefetch_ordonnances
+from utilisateurs.models import DossierMedical, Medecin, Medicament, Ordonnance, Patient, Traitement
+from utilisateurs.serializers import OrdonnanceSerializer
+
+from ._bench import base_de_test, mesurer
+
+
+class Command(BaseCommand):
+    help = "Compare OrdonnanceSerializer et le chemin rapide .values_list() sur une base de test"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ordonnances', type=int, default=500)
+        parser.add_argument('--traitements', type=int, default=4, help="Traitements par ordonnance")
+        parser.add_argument('--repetitions', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with base_de_test():
+            self.remplir(options)
+            queryset = Ordonnance.objects.order_by('-date', '-id_ordonnance')
+            repetitions = options['repetitions']
+
+            serializer, duree_serializer = mesurer(
+                lambda: JSONRenderer().render(OrdonnanceSerializer(prefetch_ordonnances(queryset), many=True).data),
+                repetitions,
+            )
+            rapide, duree_rapide = mesurer(lambda: JSONRenderer().render(ordonnances_data(queryset)), repetitions)
+
+        self.stdout.write(f'{options["ordonnances"]} ordonnances x {options["traitements"]} traitements, {len(rapide)} bytes')
+        self.stdout.write(f'OrdonnanceSerializer: {duree_serializer * 1000:.1f} ms')
+        self.stdout.write(f'fast path:            {duree_rapide * 1000:.1f} ms ({duree_serializer / duree_rapide:.1f}x)')
+        self.stdout.write(f'identical output:     {serializer == rapide}')
+
+    def remplir(self, options):
+        rng = random.Random(options['seed'])
+        medecin = Medecin.objects.create(nom='Bench', prenom='Medecin', email='bench@example.com')
+        medicaments = Medicament.objects.bulk_create(
+            Medicament(nom=f'Medicament {i}', dosage='500mg', forme='Comprimé') for i in range(200)
+        )
+        patient = Patient.objects.create(nom='Bench', prenom='Patient', email='patient@example.com',
+                                         nss='bench', date_naissance=datetime.date(1980, 1, 1))
+        dossier = DossierMedical.objects.create(patient=patient)
+        ordonnances = Ordonnance.objects.bulk_create(
+            Ordonnance(date=datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 365), medecin=medecin, dpi_patient=dossier)
+            for i in range(options['ordonnances'])
+        )
+        Traitement.objects.bulk_create(
+            Traitement(ordonnance=ordonnance, medicament=rng.choice(medicaments), quantite=rng.randrange(1, 4),
+                       duree=f'{rng.randrange(3, 30)} jours')
+            for ordonnance in ordonnances
+            for _ in range(options['traitements'])
+        )
@@ -0,0 +1,83 @@
+import datetime
+import gzip
+import random
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from utilisateurs.middleware import brotli
+from utilisateurs.models import Patient
+from utilisateurs.renderers import MessagePackRenderer
+from utilisateurs.serializers import PatientSerializer, parse_field_paths
+
+from ._bench import mesurer
+
+
+def garder(data, fields):
+    # Équivalent de ?fields= sur des dicts déjà sérialisés
+    if isinstance(data, list):
+        return [garder(item, fields) for item in data]
+    return {name: garder(data[name], subtree) if subtree else data[name] for name, subtree in fields.items()}
+
+
+class Command(BaseCommand):
+    help = "Compare la taille et le temps de sérialisation des réponses par format (JSON, MessagePack, gzip, brotli)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=500)
+        parser.add_argument('--ordonnances', type=int, default=500)
+        parser.add_argument('--repetitions', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        repetitions = options['repetitions']
+
+        patients = [
+            Patient(
+                id_utilisateur=i, nom=f'Nom{i}', prenom=f'Prenom{i}', email=f'patient{i}@example.com',
+                date_naissance=datetime.date(1940, 1, 1) + datetime.timedelta(days=rng.randrange(30000)),
+                telephone=f'0{rng.randrange(10 ** 9):09d}', adresse=f'{i} rue de la Santé, Alger',
+                mutuelle=rng.choice([None, 'CNAS', 'CASNOS']), nss=f'{i:012d}',
+            )
+            for i in range(options['patients'])
+        ]
+        # Même forme que OrdonnanceSerializer.data
+        ordonnances = [
+            {
+                'id_ordonnance': i, 'date': '2024-12-23', 'medecin': rng.randrange(100), 'dpi_patient': i, 'version': 0,
+                'medicaments': [
+                    {
+                        'id_traitement': i * 10 + j,
+                        'medicament': {'id_medicament': j, 'nom': f'Medicament {j}', 'dosage': '500mg', 'forme': 'Comprimé'},
+                        'quantite': rng.randrange(1, 4), 'description': 'Après repas', 'duree': '7 jours', 'ordonnance': i,
+                    }
+                    for j in range(rng.randrange(1, 6))
+                ],
+            }
+            for i in range(options['ordonnances'])
+        ]
+
+        # Les ordonnances sont déjà sous forme de dicts : seul le rendu est mesuré
+        cas = [
+            ('patients, full', lambda: PatientSerializer(patients, many=True).data),
+            ('patients, ?fields=nom,prenom', lambda: PatientSerializer(
+                patients, many=True, fields=parse_field_paths('nom,prenom')).data),
+            ('ordonnances, full', None, ordonnances),
+            ('ordonnances, ?fields=date,medicaments.medicament.nom', None,
+             garder(ordonnances, parse_field_paths('date,medicaments.medicament.nom'))),
+        ]
+        formats = [('json', JSONRenderer()), ('msgpack', MessagePackRenderer())]
+
+        self.stdout.write(f'{"payload":<55}{"format":<10}{"serialize ms":>14}{"render ms":>12}{"bytes":>10}{"gzip":>10}{"brotli":>10}')
+        for nom, construire, *data in cas:
+            if construire:
+                data, serialize = mesurer(construire, repetitions)
+                serialize = f'{serialize * 1000:.2f}'
+            else:
+                data, serialize = data[0], '-'
+            for format, renderer in formats:
+                body, render = mesurer(lambda: renderer.render(data), repetitions)
+                gz = len(gzip.compress(body, 6))
+                br = len(brotli.compress(body, quality=5)) if brotli else '-'
+                self.stdout.write(f'{nom:<55}{format:<10}{serialize:>14}{render * 1000:>12.2f}{len(body):>10}{gz:>10}{br:>10}')
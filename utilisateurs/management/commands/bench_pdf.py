@@ -0,0 +1,100 @@
+import datetime
+import os
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from utilisateurs import impression, pdf
+from utilisateurs.models import DossierMedical, Medecin, Medicament, Ordonnance, Patient, Resume, Traitement
+
+from ._bench import base_de_test, mesurer
+
+DESCRIPTIONS = [
+    'Patient vu en consultation, examen clinique sans particularité. Traitement adapté, contrôle dans un mois.',
+    'Douleurs abdominales depuis trois jours, fièvre modérée. Bilan biologique demandé, surveillance à domicile.',
+    'Suivi de l\'hypertension artérielle, tension stable sous traitement. Pas d\'effet indésirable rapporté.',
+]
+
+
+class Command(BaseCommand):
+    help = "Débit d'impression PDF des ordonnances et comptes rendus (base de test)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ordonnances', type=int, default=2000)
+        parser.add_argument('--dossiers', type=int, default=200)
+        parser.add_argument('--processus', type=int, default=os.cpu_count())
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with base_de_test():
+            self.run(options)
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        medecin = Medecin.objects.create(nom='Bench', prenom='Medecin', email='bench@example.com', specialite='cardiologie')
+        medicaments = Medicament.objects.bulk_create(
+            Medicament(nom=f'Medicament {i}', dosage='500mg', forme='Comprimé') for i in range(50)
+        )
+        with transaction.atomic():
+            dossiers = []
+            for i in range(options['dossiers']):
+                patient = Patient.objects.create(nom=f'Patient{i}', prenom='Bench', email=f'patient{i}@example.com',
+                                                 nss=f'bench{i:06d}', date_naissance=datetime.date(1980, 1, 1))
+                dossiers.append(DossierMedical.objects.create(patient=patient))
+            ordonnances = Ordonnance.objects.bulk_create(
+                Ordonnance(date=datetime.date(2024, 1, 1), medecin=medecin, dpi_patient=rng.choice(dossiers))
+                for _ in range(options['ordonnances'])
+            )
+            Traitement.objects.bulk_create(
+                Traitement(ordonnance=ordonnance, medicament=medicament, quantite=rng.randrange(1, 4), duree='7 jours')
+                for ordonnance in ordonnances for medicament in rng.sample(medicaments, rng.randrange(1, 6))
+            )
+            Resume.objects.bulk_create(
+                Resume(dpi=dossier, medecin=medecin, date=datetime.date(2024, 1, 1) + datetime.timedelta(days=j),
+                       description=rng.choice(DESCRIPTIONS))
+                for dossier in dossiers for j in range(rng.randrange(5, 40))
+            )
+
+        ids = [ordonnance.pk for ordonnance in ordonnances]
+        start = time.perf_counter()
+        documents = impression.ordonnances(ids)
+        self.stdout.write(f'load {len(documents)} ordonnances: {time.perf_counter() - start:.2f} s')
+        start = time.perf_counter()
+        comptes_rendus = impression.dossiers([dossier.pk for dossier in dossiers])
+        self.stdout.write(f'load {len(comptes_rendus)} dossiers: {time.perf_counter() - start:.2f} s')
+
+        # Gabarits recompilés à chaque document, puis compilés une fois (QR codes déjà en cache)
+        echantillon = documents[:200]
+        [pdf.rendre(document) for document in echantillon]
+
+        def sans_cache():
+            for document in echantillon:
+                pdf.gabarit.cache_clear()
+                pdf.rendre(document)
+
+        _, duree = mesurer(sans_cache, 3)
+        self.stdout.write(f'ordonnance, layout compiled per document: {duree / len(echantillon) * 1000:.3f} ms/doc')
+        pdf.precompiler()
+        _, duree = mesurer(lambda: [pdf.rendre(document) for document in echantillon], 3)
+        self.stdout.write(f'ordonnance, precompiled layout:           {duree / len(echantillon) * 1000:.3f} ms/doc')
+
+        # Pool partagé démarré avant les mesures, comme dans un serveur qui a déjà imprimé
+        impression.PDF['PROCESSUS'] = options['processus']
+        start = time.perf_counter()
+        list(impression.pool().map(pdf.rendre, echantillon[:options['processus']]))
+        self.stdout.write(f'pool of {options["processus"]} process(es) started in {time.perf_counter() - start:.2f} s')
+
+        for nom, lot in (('ordonnances', documents), ('dossiers', comptes_rendus)):
+            for format in ('pdf', 'zip'):
+                flux, content_type = impression.FORMATS[format]
+                for processus in sorted({1, options['processus']}):
+                    start = time.perf_counter()
+                    taille = sum(len(morceau) for morceau in flux([lot], processus))
+                    duree = time.perf_counter() - start
+                    self.stdout.write(
+                        f'{nom:11} {format} x{processus}: {len(lot)} docs in {duree:.2f} s '
+                        f'({len(lot) / duree:.0f} docs/s), {taille / 1024:.0f} KiB'
+                    )
+        impression.pool().shutdown()
@@ -0,0 +1,77 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from utilisateurs import recherche
+from utilisateurs.models import DossierMedical, Patient, Resume
+
+from ._bench import base_de_test, mesurer
+
+SYMPTOMES = [
+    'douleur abdominale', 'douleurs thoraciques', 'fièvre persistante', 'toux sèche', 'céphalées',
+    'nausées', 'vomissements', 'vertiges', 'dyspnée', 'fatigue', 'éruption cutanée', 'palpitations',
+    'hypertension artérielle', 'diabète de type 2', 'insuffisance rénale', 'pneumopathie', 'angine',
+    'gastro-entérite', 'lombalgie', 'migraine', 'asthme', 'anémie', 'otite', 'sinusite', 'arthrose',
+]
+REMPLISSAGE = [
+    'patient vu en consultation', 'examen clinique sans particularité', 'traitement adapté',
+    'contrôle dans un mois', 'bilan biologique demandé', 'antécédents familiaux', 'pas d\'allergie connue',
+    'tension normale', 'auscultation normale', 'surveillance à domicile', 'avis spécialisé',
+]
+
+
+class Command(BaseCommand):
+    help = "Compare la recherche plein texte à description__icontains sur une base de test"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes', type=int, default=200000)
+        parser.add_argument('--dossiers', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with base_de_test():
+            # Pas de bulk_create sur un modèle hérité (Patient -> Utilisateur)
+            with transaction.atomic():
+                dossiers = []
+                for i in range(options['dossiers']):
+                    patient = Patient.objects.create(nom=f'Patient{i}', prenom='Bench', email=f'patient{i}@example.com',
+                                                     nss=f'bench{i}', date_naissance=datetime.date(1980, 1, 1))
+                    dossiers.append(DossierMedical.objects.create(patient=patient).id)
+
+            # bulk_create ne passe pas par save() : l'index est construit ensuite en une fois
+            debut = datetime.date(2000, 1, 1)
+            lot = []
+            for i in range(options['notes']):
+                phrases = rng.sample(REMPLISSAGE, 3) + rng.sample(SYMPTOMES, rng.randint(1, 2))
+                rng.shuffle(phrases)
+                lot.append(Resume(dpi_id=rng.choice(dossiers), date=debut + datetime.timedelta(days=rng.randrange(9000)),
+                                  description='. '.join(phrases).capitalize() + '.'))
+                if len(lot) == 10000:
+                    Resume.objects.bulk_create(lot)
+                    lot = []
+            Resume.objects.bulk_create(lot)
+
+            start = time.perf_counter()
+            documents = recherche.reconstruire()
+            self.stdout.write(f'{documents} notes indexed in {time.perf_counter() - start:.1f} s')
+
+            dossier = dossiers[0]
+            requetes = [
+                ('rare term', 'otites', {}),
+                ('two terms', 'douleurs abdominales', {}),
+                ('three terms', 'fièvre toux sèche', {}),
+                ('one dossier', 'douleur', {'dossier': dossier}),
+                ('date range', 'migraines', {'debut': datetime.date(2020, 1, 1), 'fin': datetime.date(2021, 1, 1)}),
+            ]
+            for nom, requete, filtres in requetes:
+                (resultats, suivante), duree = mesurer(lambda: recherche.rechercher(requete, limit=20, **filtres), 5)
+                self.stdout.write(f'{nom:12} "{requete}": {len(resultats)} results, {duree * 1000:.1f} ms')
+
+            # Pour classer ou compter, icontains doit lire toutes les notes
+            mot = 'abdominale'
+            nombre, duree = mesurer(lambda: Resume.objects.filter(description__icontains=mot).count(), 3)
+            self.stdout.write(f'icontains "{mot}": {nombre} matches, {duree * 1000:.1f} ms')
@@ -0,0 +1,121 @@
+import datetime
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from utilisateurs import planning
+from utilisateurs.models import Disponibilite, Medecin, Patient, RendezVous
+
+from ._bench import base_de_test, mesurer
+
+
+def chevauchements():
+    # Rendez-vous qui commencent avant la fin du précédent du même médecin. Pas un simple compte
+    # des (medecin, debut) en double, que la contrainte unique rend toujours nul
+    total = 0
+    precedent = (None, None)
+    for medecin_id, debut, fin in RendezVous.objects.order_by('medecin', 'debut').values_list('medecin', 'debut', 'fin'):
+        if medecin_id == precedent[0] and debut < precedent[1]:
+            total += 1
+        precedent = (medecin_id, max(fin, precedent[1]) if medecin_id == precedent[0] else fin)
+    return total
+
+
+class Command(BaseCommand):
+    help = "Simule une rafale de réservations du matin sur une base de test"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medecins', type=int, default=50)
+        parser.add_argument('--patients', type=int, default=2000)
+        parser.add_argument('--reservations', type=int, default=2000, help="Tentatives de réservation de la rafale")
+        parser.add_argument('--threads', type=int, default=1, help="> 1 seulement sur une base qui le supporte (MySQL)")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--decalage', type=int, default=0,
+                            help="Minutes : ajoute une seconde plage décalée par médecin, aux créneaux chevauchants")
+
+    def handle(self, *args, **options):
+        self.agenda_seul()
+        with base_de_test():
+            self.rafale(options)
+
+    def agenda_seul(self):
+        # Coût du test de chevauchement en fonction de la taille de l'agenda
+        debut = timezone.now()
+        for taille in (1000, 100000, 1000000):
+            agenda = planning.Agenda(
+                (debut + datetime.timedelta(minutes=20 * i), debut + datetime.timedelta(minutes=20 * i + 15))
+                for i in range(taille)
+            )
+            tests = [debut + datetime.timedelta(minutes=random.randrange(20 * taille)) for _ in range(10000)]
+            start = time.perf_counter()
+            for test in tests:
+                agenda.est_libre(test, test + datetime.timedelta(minutes=5))
+            duree = (time.perf_counter() - start) / len(tests)
+            self.stdout.write(f'Agenda.est_libre with {taille} appointments: {duree * 1e6:.2f} us')
+
+    def rafale(self, options):
+        rng = random.Random(options['seed'])
+        jour = timezone.localdate() + datetime.timedelta(days=1)
+        medecins = [
+            Medecin.objects.create(nom=f'Medecin{i}', prenom='Bench', email=f'medecin{i}@example.com', specialite='cardiologie')
+            for i in range(options['medecins'])
+        ]
+        Disponibilite.objects.bulk_create(
+            Disponibilite(medecin=medecin, jour_semaine=jour.weekday(), heure_debut=datetime.time(8),
+                          heure_fin=datetime.time(12), duree_creneau=15)
+            for medecin in medecins
+        )
+        if options['decalage']:
+            # Données antérieures à Disponibilite.clean (bulk_create ne l'appelle pas) : seul le
+            # verrou de planning.reserver empêche alors deux rendez-vous qui se chevauchent
+            Disponibilite.objects.bulk_create(
+                Disponibilite(medecin=medecin, jour_semaine=jour.weekday(),
+                              heure_debut=datetime.time(8, options['decalage']),
+                              heure_fin=datetime.time(12), duree_creneau=15)
+                for medecin in medecins
+            )
+        # Pas de bulk_create sur un modèle hérité (Patient -> Utilisateur)
+        with transaction.atomic():
+            patients = [
+                Patient.objects.create(nom=f'Patient{i}', prenom='Bench', email=f'patient{i}@example.com',
+                                       nss=f'bench{i}', date_naissance=datetime.date(1980, 1, 1)).id_utilisateur
+                for i in range(options['patients'])
+            ]
+
+        libres, recherche = mesurer(lambda: planning.creneaux_libres('cardiologie', jour), 5)
+        self.stdout.write(f'{len(medecins)} medecins, {len(libres)} free slots, search {recherche * 1000:.1f} ms')
+
+        # Tout le monde vise les premiers créneaux de la matinée : beaucoup de collisions
+        populaires = libres[:max(1, len(libres) // 4)]
+
+        def tenter(_):
+            creneau = rng.choice(populaires if rng.random() < 0.7 else libres)
+            try:
+                planning.reserver(creneau['medecin'], rng.choice(patients), creneau['debut'])
+                return True
+            except planning.CreneauIndisponible:
+                return False
+            finally:
+                if options['threads'] > 1:
+                    connection.close()
+
+        start = time.perf_counter()
+        if options['threads'] > 1:
+            with ThreadPoolExecutor(options['threads']) as pool:
+                resultats = list(pool.map(tenter, range(options['reservations'])))
+        else:
+            resultats = [tenter(i) for i in range(options['reservations'])]
+        duree = time.perf_counter() - start
+
+        reserves = sum(resultats)
+        doublons = chevauchements()
+        self.stdout.write(
+            f'burst: {len(resultats)} attempts in {duree:.2f} s ({len(resultats) / duree:.0f}/s), '
+            f'{reserves} booked, {len(resultats) - reserves} conflicts, {doublons} double bookings'
+        )
+        _, recherche = mesurer(lambda: planning.creneaux_libres('cardiologie', jour), 5)
+        self.stdout.write(f'search after burst: {recherche * 1000:.1f} ms')
@@ -0,0 +1,77 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+
+from utilisateurs import statistiques
+from utilisateurs.models import DossierMedical, Medecin, Medicament, Ordonnance, Patient, Traitement
+
+from ._bench import base_de_test, mesurer
+
+
+class Command(BaseCommand):
+    help = "Compare les statistiques lues dans les cumuls à un GROUP BY sur les tables cliniques (base de test)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ordonnances', type=int, default=100000)
+        parser.add_argument('--dossiers', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with base_de_test():
+            self.run(options)
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        medecins = [Medecin.objects.create(nom=f'Medecin{i}', prenom='Bench', email=f'medecin{i}@example.com',
+                                           specialite=rng.choice(['cardiologie', 'pediatrie', 'generaliste']))
+                    for i in range(20)]
+        medicaments = Medicament.objects.bulk_create(
+            Medicament(nom=f'Medicament {i}', dosage='500mg', forme='Comprimé') for i in range(200)
+        )
+        with transaction.atomic():
+            dossiers = []
+            for i in range(options['dossiers']):
+                patient = Patient.objects.create(nom=f'Patient{i}', prenom='Bench', email=f'patient{i}@example.com',
+                                                 nss=f'bench{i:06d}', date_naissance=datetime.date(1980, 1, 1))
+                dossiers.append(DossierMedical.objects.create(patient=patient))
+            # bulk_create ne passe pas par save() : les cumuls sont construits ensuite en une fois
+            debut = datetime.date(2020, 1, 1)
+            for i in range(0, options['ordonnances'], 10000):
+                ordonnances = Ordonnance.objects.bulk_create(
+                    Ordonnance(date=debut + datetime.timedelta(days=rng.randrange(1800)), medecin=rng.choice(medecins),
+                               dpi_patient=rng.choice(dossiers))
+                    for _ in range(min(10000, options['ordonnances'] - i))
+                )
+                Traitement.objects.bulk_create(
+                    Traitement(ordonnance=ordonnance, medicament=medicament, quantite=1, duree='7 jours')
+                    for ordonnance in ordonnances for medicament in rng.sample(medicaments, rng.randrange(1, 5))
+                )
+
+        start = time.perf_counter()
+        cumuls = statistiques.reconstruire()
+        self.stdout.write(f'{Traitement.objects.count()} lines, {cumuls} counters rebuilt in '
+                          f'{time.perf_counter() - start:.1f} s')
+
+        fin = debut + datetime.timedelta(days=1800)
+        periode = fin - datetime.timedelta(days=365)
+        # Ce que ferait l'endpoint sans cumuls : un GROUP BY sur toutes les lignes de la période
+        direct = lambda: list(
+            Traitement.objects.filter(ordonnance__date__gte=periode - datetime.timedelta(days=366), ordonnance__date__lte=fin)
+            .values('medicament_id', p=TruncMonth('ordonnance__date'))
+            .annotate(n=Count('pk')).order_by()
+        )
+        lignes, duree = mesurer(direct, 5)
+        self.stdout.write(f'GROUP BY on traitements: {len(lignes)} rows, {duree * 1000:.1f} ms')
+        resultat, duree = mesurer(lambda: statistiques.analyser('prescriptions', periode, fin, top=10), 5)
+        self.stdout.write(f'rollups + analysis: {len(resultat["series"])} series, {duree * 1000:.1f} ms')
+
+        # Coût d'une écriture avec le cumul tenu à jour
+        ordonnance = Ordonnance.objects.first()
+        _, duree = mesurer(lambda: Traitement.objects.create(ordonnance=ordonnance, medicament=medicaments[0],
+                                                             quantite=1, duree='7 jours'), 200)
+        self.stdout.write(f'traitement insert with rollup: {duree * 1000:.2f} ms')
@@ -0,0 +1,43 @@
+import csv
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from utilisateurs.interactions import normaliser
+from utilisateurs.models import InteractionMedicamenteuse
+
+
+class Command(BaseCommand):
+    help = "Charge une table d'interactions (CSV : medicament_a,medicament_b,gravite,description)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('fichier')
+        parser.add_argument('--remplacer', action='store_true', help="Vider la table avant le chargement")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        gravites = {gravite for gravite, label in InteractionMedicamenteuse.GRAVITES}
+        total = 0
+        with open(options['fichier'], newline='', encoding='utf-8') as fichier, transaction.atomic():
+            if options['remplacer']:
+                InteractionMedicamenteuse.objects.all().delete()
+            batch = []
+            for ligne in csv.DictReader(fichier):
+                medicament_a, medicament_b = sorted((normaliser(ligne['medicament_a']), normaliser(ligne['medicament_b'])))
+                gravite = ligne.get('gravite') or InteractionMedicamenteuse.MODEREE
+                if gravite not in gravites:
+                    self.stderr.write(f'Unknown gravite {gravite!r} for {medicament_a} + {medicament_b}, skipped')
+                    continue
+                batch.append(InteractionMedicamenteuse(
+                    medicament_a=medicament_a,
+                    medicament_b=medicament_b,
+                    gravite=gravite,
+                    description=ligne.get('description') or '',
+                ))
+                if len(batch) >= options['batch_size']:
+                    InteractionMedicamenteuse.objects.bulk_create(batch, ignore_conflicts=True)
+                    total += len(batch)
+                    batch = []
+            InteractionMedicamenteuse.objects.bulk_create(batch, ignore_conflicts=True)
+            total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'{total} interaction(s) loaded'))
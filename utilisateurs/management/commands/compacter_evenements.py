@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils import timezone
+
+from utilisateurs.models import CurseurConsommateur, EvenementClinique
+
+
+class Command(BaseCommand):
+    help = "Supprime les événements cliniques déjà lus par tous les consommateurs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--retention-days', type=int, default=None,
+                            help="Supprime aussi les événements plus anciens, même non acquittés")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        # Par hôpital, jusqu'au plus petit curseur de ses consommateurs ; sans consommateur
+        # enregistré, rien de l'hôpital n'est considéré comme lu
+        limites = {
+            curseur['hopital_id']: curseur['seq']
+            for curseur in CurseurConsommateur.tous.values('hopital_id').annotate(seq=Min('seq'))
+        }
+        total = 0
+        for hopital_id, limite in limites.items():
+            total += self.supprimer(EvenementClinique.tous.filter(hopital_id=hopital_id, seq__lte=limite), chunk_size, total)
+        if options['retention_days'] is not None:
+            avant = timezone.now() - timedelta(days=options['retention_days'])
+            total += self.supprimer(EvenementClinique.tous.filter(date__lt=avant), chunk_size, total)
+        self.stdout.write(self.style.SUCCESS(f'Done, {total} event(s) deleted'))
+
+    def supprimer(self, evenements, chunk_size, total):
+        # Suppression par plages de clé primaire pour garder des transactions courtes
+        supprimes = 0
+        while True:
+            seqs = list(evenements.order_by('seq').values_list('seq', flat=True)[:chunk_size])
+            if not seqs:
+                return supprimes
+            deleted, _ = evenements.filter(seq__gte=seqs[0], seq__lte=seqs[-1]).delete()
+            supprimes += deleted
+            self.stdout.write(f'{total + supprimes} event(s) deleted')
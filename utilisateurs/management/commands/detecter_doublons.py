@@ -0,0 +1,49 @@
+import csv
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from utilisateurs import doublons
+from utilisateurs.models import Hopital, Patient
+
+
+class Command(BaseCommand):
+    help = "Paires de patients probablement enregistrés deux fois (CSV), à vérifier avant fusion"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hopital', help="Hopital.code, tous les hôpitaux par défaut")
+        parser.add_argument('--seuil', type=float, help="Score minimal (DOUBLONS['SEUIL'] par défaut)")
+        parser.add_argument('--processus', type=int)
+        parser.add_argument('--output', '-o', help="Fichier CSV, sortie standard par défaut")
+        parser.add_argument('--reindexer', action='store_true', help="Reconstruit d'abord l'index de blocage")
+
+    def handle(self, *args, **options):
+        hopital_id = None
+        if options['hopital']:
+            hopital_id = Hopital.objects.filter(code=options['hopital']).values_list('pk', flat=True).first()
+            if hopital_id is None:
+                raise CommandError(f"Unknown hopital {options['hopital']}")
+        start = time.perf_counter()
+        if options['reindexer']:
+            self.stderr.write(f'{doublons.reconstruire()} patient(s) indexed')
+
+        paires, ignores = doublons.scanner(hopital_id, options['seuil'], options['processus'])
+        for _, cle in ignores:
+            self.stderr.write(f'Skipped key {cle}: more than {doublons.DOUBLONS["MAX_BLOC"]} patients')
+
+        patients = Patient.tous.in_bulk({patient_id for paire in paires for patient_id in paire})
+        stream = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            ecriture = csv.writer(stream)
+            ecriture.writerow(['score', 'patient_a', 'nom_a', 'prenom_a', 'naissance_a', 'nss_a',
+                               'patient_b', 'nom_b', 'prenom_b', 'naissance_b', 'nss_b'])
+            for (a, b), score in sorted(paires.items(), key=lambda item: -item[1]):
+                ecriture.writerow([round(score, 3)] + [
+                    valeur for patient in (patients[a], patients[b])
+                    for valeur in (patient.pk, patient.nom, patient.prenom, patient.date_naissance, patient.nss)
+                ])
+        finally:
+            if options['output']:
+                stream.close()
+        self.stderr.write(self.style.SUCCESS(f'{len(paires)} pair(s) in {time.perf_counter() - start:.1f} s'))
@@ -0,0 +1,170 @@
+import itertools
+import sys
+
+from django.apps import apps
+from django.core import serializers
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+
+from utilisateurs.models import (
+    Administratif, ArchiveDossier, AuditAcces, BilanBiologique, Chambre, CleDoublon, Cumul, CurseurConsommateur,
+    Disponibilite, Dispensation, DossierMedical, DossierSummary, EvenementClinique, Hopital, Infirmier, Laborantin,
+    LigneDispensation, Lit, Medecin, Medicament, MouvementLit, Occurrence, OperationSync, Ordonnance, Patient,
+    RapportImagerie, Radiologue, RendezVous, Resume, Service, SGPH, Soin, Stock, Suppression, Tache, Traitement,
+    Utilisateur, suivi_suppressions,
+)
+
+# Données d'un hôpital, dans l'ordre des clés étrangères : (modèle, chemin vers l'hôpital).
+# Les types d'utilisateurs viennent après Utilisateur, chacun ne contient que ses propres colonnes.
+MODELES = [
+    (Hopital, 'pk'),
+    (Utilisateur, 'hopital'),
+    (Administratif, 'hopital'),
+    (Medecin, 'hopital'),
+    (Radiologue, 'hopital'),
+    (Laborantin, 'hopital'),
+    (Infirmier, 'hopital'),
+    (SGPH, 'hopital'),
+    (Patient, 'hopital'),
+    (CleDoublon, 'hopital_id'),
+    (DossierMedical, 'hopital'),
+    (ArchiveDossier, 'dossier__hopital'),  # Contenu clinique des dossiers archivés
+    (DossierSummary, 'dossier__hopital'),
+    (Resume, 'dpi__hopital'),
+    (Ordonnance, 'dpi_patient__hopital'),
+    (Medicament, None),
+    (Stock, 'hopital_id'),
+    (Traitement, 'ordonnance__dpi_patient__hopital'),
+    (BilanBiologique, 'dpi__hopital'),
+    (Occurrence, 'dossier__hopital'),
+    (Dispensation, 'ordonnance__dpi_patient__hopital'),
+    (LigneDispensation, 'dispensation__ordonnance__dpi_patient__hopital'),
+    (RapportImagerie, 'radiologue__hopital'),
+    (Soin, 'infirmier__hopital'),
+    (Disponibilite, 'medecin__hopital'),
+    (RendezVous, 'patient__hopital'),
+    (Service, 'hopital'),
+    (Chambre, 'service__hopital'),
+    (Lit, 'chambre__service__hopital'),
+    (MouvementLit, 'hopital_id'),
+    (Cumul, 'hopital_id'),
+    (Suppression, 'hopital_id'),
+    (EvenementClinique, 'hopital_id'),
+    (CurseurConsommateur, 'hopital_id'),
+    (AuditAcces, 'hopital_id'),
+    (OperationSync, 'hopital_id'),
+    (Tache, 'hopital_id'),
+]
+
+
+def non_exportes():
+    # Modèles de l'application rattachés à un hôpital (chemin_hopital, ou clé étrangère vers un
+    # modèle exporté) mais absents de MODELES : les déplacer sans eux perdrait des données
+    listes = {modele for modele, chemin in MODELES}
+    exportes = {modele for modele, chemin in MODELES if chemin is not None}
+    return [
+        modele.__name__ for modele in apps.get_app_config('utilisateurs').get_models()
+        if modele not in listes and (
+            hasattr(modele, 'chemin_hopital')
+            or any(champ.related_model in exportes for champ in modele._meta.concrete_fields if champ.is_relation)
+        )
+    ]
+
+
+def donnees(hopital):
+    for modele, chemin in MODELES:
+        if modele is Medicament:
+            # Catalogue commun : seulement les médicaments prescrits, dispensés ou en stock dans cet hôpital
+            prescrits = Traitement.tous.filter(ordonnance__dpi_patient__hopital=hopital).values('medicament_id')
+            dispenses = LigneDispensation.objects.filter(
+                dispensation__ordonnance__dpi_patient__hopital=hopital).values('medicament_id')
+            en_stock = Stock.tous.filter(hopital_id=hopital.pk).values('medicament_id')
+            queryset = Medicament.objects.filter(
+                models.Q(id_medicament__in=prescrits) | models.Q(id_medicament__in=dispenses)
+                | models.Q(id_medicament__in=en_stock))
+        else:
+            queryset = modele._base_manager.filter(**{chemin: hopital.pk})
+        yield modele, queryset.order_by('pk')
+
+
+class Command(BaseCommand):
+    help = "Exporte (fixture JSON pour loaddata) ou déplace vers une autre base les données d'un hôpital"
+
+    def add_arguments(self, parser):
+        parser.add_argument('code', help="Hopital.code")
+        parser.add_argument('--output', '-o', help="Fichier JSON, sortie standard par défaut")
+        parser.add_argument('--database', help="Copie directement dans cet alias de DATABASES (base vide ou shard)")
+        parser.add_argument('--supprimer', action='store_true', help="Supprime l'hôpital de la base source après la copie")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        manquants = non_exportes()
+        if manquants:
+            raise CommandError(f"Models attached to a hopital are missing from MODELES: {', '.join(manquants)}")
+        hopital = Hopital.objects.filter(code=options['code']).first()
+        if hopital is None:
+            raise CommandError(f"Unknown hopital {options['code']}")
+        if options['supprimer'] and not options['database']:
+            raise CommandError("--supprimer requires --database")
+
+        if options['database']:
+            self.copier(hopital, options['database'], options['chunk_size'])
+        else:
+            self.exporter(hopital, options['output'], options['chunk_size'])
+
+        if options['supprimer']:
+            self.supprimer(hopital)
+            self.stderr.write(f'{hopital.code} deleted from the source database')
+
+    def supprimer(self, hopital):
+        # Ordre inverse des clés étrangères (Service.hopital, MouvementLit.lit_* sont PROTECT).
+        # Pas de suivi : l'hôpital déménage, ce ne sont ni des suppressions cliniques ni des
+        # pierres tombales à synchroniser (elles ont été copiées avec le reste).
+        jeton = suivi_suppressions.set(False)
+        try:
+            with transaction.atomic():
+                for modele, chemin in reversed(MODELES):
+                    if chemin not in (None, 'pk'):
+                        modele._base_manager.filter(**{chemin: hopital.pk}).delete()
+                hopital.delete()
+        finally:
+            suivi_suppressions.reset(jeton)
+
+    def exporter(self, hopital, output, chunk_size):
+        objets = itertools.chain.from_iterable(
+            queryset.iterator(chunk_size=chunk_size) for modele, queryset in donnees(hopital)
+        )
+        stream = open(output, 'w') if output else sys.stdout
+        try:
+            serializers.serialize('json', objets, stream=stream)
+        finally:
+            if output:
+                stream.close()
+
+    def collisions(self, hopital, alias, chunk_size):
+        # save_base(raw=True) écraserait une ligne de la base cible qui a la même clé primaire :
+        # la copie est refusée avant d'écrire quoi que ce soit
+        for modele, queryset in donnees(hopital):
+            pks = queryset.values_list('pk', flat=True).iterator(chunk_size=chunk_size)
+            for lot in iter(lambda: list(itertools.islice(pks, chunk_size)), []):
+                cible = modele._base_manager.using(alias).filter(pk__in=lot)
+                if modele is Medicament:
+                    # Catalogue commun : le même id doit désigner le même médicament
+                    champs = ('pk', 'nom', 'dosage', 'forme')
+                    differents = set(cible.values_list(*champs)) - set(queryset.filter(pk__in=lot).values_list(*champs))
+                    pris = sorted(pk for pk, *valeurs in differents)[:10]
+                else:
+                    pris = list(cible.values_list('pk', flat=True)[:10])
+                if pris:
+                    raise CommandError(f"{modele.__name__} ids already used in {alias}: {pris}")
+
+    def copier(self, hopital, alias, chunk_size):
+        with transaction.atomic(using=alias):
+            self.collisions(hopital, alias, chunk_size)
+            for modele, queryset in donnees(hopital):
+                total = 0
+                for objet in queryset.iterator(chunk_size=chunk_size):
+                    # Comme loaddata : raw, sans save() ni signaux (pas de tâche ni d'événement)
+                    models.Model.save_base(objet, using=alias, raw=True)
+                    total += 1
+                self.stderr.write(f'{modele.__name__}: {total}')
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from utilisateurs import pseudonymisation
+
+
+class Command(BaseCommand):
+    help = "Extraction pseudonymisée (patients, traitements, bilans, résumés) pour une équipe de recherche"
+
+    def add_arguments(self, parser):
+        parser.add_argument('repertoire', help="Un sous-répertoire par table, un fichier part-NNNNN par plage")
+        parser.add_argument('--tables', default=','.join(pseudonymisation.TABLES),
+                            help=f"Parmi {', '.join(pseudonymisation.TABLES)}")
+        parser.add_argument('--format', choices=pseudonymisation.FORMATS, default='csv')
+        parser.add_argument('--hopital', help="Hopital.code, tous les hôpitaux par défaut")
+        parser.add_argument('--etude', default='', help="Identifiant de l'étude : pseudonymes propres à l'étude")
+        parser.add_argument('--texte', action='store_true',
+                            help="Exporte aussi le texte libre, identifiants du patient masqués")
+        parser.add_argument('--processus', type=int)
+        parser.add_argument('--chunk-size', type=int)
+
+    def handle(self, *args, **options):
+        tables = [table for table in options['tables'].split(',') if table]
+        inconnues = set(tables) - set(pseudonymisation.TABLES)
+        if inconnues:
+            raise CommandError(f"Unknown table(s): {', '.join(sorted(inconnues))}")
+        start = time.perf_counter()
+        try:
+            totaux = pseudonymisation.exporter(
+                options['repertoire'], tables, options['format'], hopital=options['hopital'], etude=options['etude'],
+                avec_texte=options['texte'], processus=options['processus'], chunk_size=options['chunk_size'],
+            )
+        except (pseudonymisation.CleManquante, ImportError, FileExistsError) as e:
+            raise CommandError(str(e))
+        for table, lignes in totaux.items():
+            self.stderr.write(f'{table}: {lignes}')
+        self.stdout.write(self.style.SUCCESS(f'Done in {time.perf_counter() - start:.1f} s'))
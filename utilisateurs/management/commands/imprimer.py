@@ -0,0 +1,36 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from utilisateurs import impression
+from utilisateurs.models import Ordonnance
+
+
+class Command(BaseCommand):
+    help = "Imprime des ordonnances et comptes rendus de dossier en un PDF ou un ZIP"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ordonnances', type=int, nargs='*', default=[])
+        parser.add_argument('--dossiers', type=int, nargs='*', default=[])
+        parser.add_argument('--date', help="Toutes les ordonnances de ce jour (AAAA-MM-JJ)")
+        parser.add_argument('--format', choices=sorted(impression.FORMATS), default='pdf')
+        parser.add_argument('--output', '-o', help="Fichier, sortie standard par défaut")
+        parser.add_argument('--processus', type=int, default=None, help="Processus de rendu, un par cœur par défaut")
+
+    def handle(self, *args, **options):
+        ids = list(options['ordonnances'])
+        if options['date']:
+            ids += Ordonnance.objects.filter(date=options['date']).order_by('dpi_patient_id', 'pk').values_list('pk', flat=True)
+        references = impression.references(ids, options['dossiers'])
+        if not references:
+            raise CommandError("Nothing to print")
+
+        flux, content_type = impression.FORMATS[options['format']]
+        stream = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for morceau in flux(impression.lots(references), options['processus']):
+                stream.write(morceau)
+        finally:
+            if options['output']:
+                stream.close()
+        self.stderr.write(f'{len(references)} document(s) printed')
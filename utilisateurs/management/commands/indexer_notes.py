@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from utilisateurs import recherche
+
+
+class Command(BaseCommand):
+    help = "Reconstruit l'index plein texte des résumés et bilans (à lancer hors trafic)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        documents = recherche.reconstruire(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Done, {documents} note(s) indexed in {time.perf_counter() - start:.1f} s'
+        ))
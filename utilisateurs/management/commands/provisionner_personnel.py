@@ -0,0 +1,52 @@
+import csv
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from utilisateurs import provisionnement
+from utilisateurs.models import Hopital
+from utilisateurs.serializers import ProvisionnementSerializer
+
+
+class Command(BaseCommand):
+    help = "Crée un lot de comptes du personnel depuis un fichier CSV ou JSON (tout ou rien)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('fichier', help="CSV (en-tête type,nom,prenom,email,password,specialite,hopital) ou JSON (liste)")
+        parser.add_argument('--hopital', help="Hopital.code des entrées qui n'en donnent pas")
+        parser.add_argument('--processus', type=int)
+
+    def handle(self, *args, **options):
+        with open(options['fichier'], newline='', encoding='utf-8') as fichier:
+            if options['fichier'].endswith('.json'):
+                comptes = json.load(fichier)
+            else:
+                # Colonnes vides : champ absent (mot de passe, spécialité, hôpital)
+                comptes = [{cle: valeur for cle, valeur in ligne.items() if valeur} for ligne in csv.DictReader(fichier)]
+
+        hopital_id = None
+        if options['hopital']:
+            hopital_id = Hopital.objects.filter(code=options['hopital']).values_list('pk', flat=True).first()
+            if hopital_id is None:
+                raise CommandError(f"Unknown hopital {options['hopital']}")
+
+        serializer = ProvisionnementSerializer(data=comptes, many=True)
+        if not serializer.is_valid():
+            erreurs = provisionnement.erreurs_par_index(serializer.errors)
+        else:
+            erreurs = {i: {'email': [e]} for i, e in provisionnement.verifier_emails(serializer.validated_data).items()}
+        if erreurs:
+            for i, e in sorted(erreurs.items()):
+                self.stderr.write(f'Entry {i}: {e}')
+            raise CommandError(f'{len(erreurs)} invalid entr(y/ies), nothing created')
+
+        start = time.perf_counter()
+        try:
+            crees = provisionnement.creer(serializer.validated_data, hopital_id=hopital_id, processus=options['processus'])
+        except KeyError as e:
+            raise CommandError(f'Unknown hopital: {e.args[0]}')
+        except IntegrityError:
+            raise CommandError('An email of this batch was registered meanwhile, nothing created')
+        self.stdout.write(self.style.SUCCESS(f'{len(crees)} account(s) created in {time.perf_counter() - start:.1f} s'))
@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from utilisateurs import sync
+
+
+class Command(BaseCommand):
+    help = "Supprime les tombstones et les opérations de synchronisation plus anciens que la rétention"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=sync.SYNC['RETENTION_JOURS'],
+                            help="Les tablettes dont le jeton est plus ancien refont une synchronisation complète")
+
+    def handle(self, *args, **options):
+        avant = timezone.now() - timedelta(days=options['retention_days'])
+        suppressions, operations = sync.purger(avant)
+        self.stdout.write(self.style.SUCCESS(
+            f'Done, {suppressions} tombstone(s) and {operations} operation(s) deleted'
+        ))
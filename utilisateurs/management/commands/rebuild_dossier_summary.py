@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from utilisateurs.models import DossierMedical, DossierSummary
+
+
+class Command(BaseCommand):
+    help = "Recalcule la table DossierSummary par lots de dossiers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = 0
+        total = 0
+        # Parcours par clé primaire croissante : chaque lot est une lecture d'index
+        while True:
+            ids = list(DossierMedical.objects.filter(id__gt=last_id)
+                       .order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                DossierSummary.recalculer(ids)
+            last_id = ids[-1]
+            total += len(ids)
+            self.stdout.write(f'{total} dossier(s) rebuilt')
+        self.stdout.write(self.style.SUCCESS(f'Done, {total} dossier(s)'))
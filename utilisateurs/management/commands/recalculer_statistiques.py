@@ -0,0 +1,21 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+
+from utilisateurs import statistiques
+
+
+class Command(BaseCommand):
+    help = "Recalcule les cumuls des statistiques d'activité (tous, ou à partir du mois de --depuis)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depuis', type=datetime.date.fromisoformat, help='YYYY-MM-DD')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        cumuls = statistiques.reconstruire(options['depuis'], options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Done, {cumuls} counter(s) rebuilt in {time.perf_counter() - start:.1f} s'
+        ))
@@ -0,0 +1,55 @@
+import multiprocessing
+import signal
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from utilisateurs import tasks
+
+
+def _worker(stop):
+    # Chaque processus ouvre sa propre connexion à la base
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    tasks.run_worker(stop)
+
+
+class Command(BaseCommand):
+    help = "Exécute les tâches en attente (QR codes, ...) avec un pool de processus"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                            help="Nombre de processus worker")
+        parser.add_argument('--once', action='store_true',
+                            help="Vider la file dans le processus courant puis s'arrêter")
+        parser.add_argument('--requeue-after', type=int, default=3600,
+                            help="Remettre en attente les tâches en cours depuis plus de N secondes")
+
+    def handle(self, *args, **options):
+        requeued = tasks.requeue_stale(timedelta(seconds=options['requeue_after']))
+        if requeued:
+            self.stdout.write(f'{requeued} stale task(s) requeued')
+
+        if options['once']:
+            tasks.run_worker(once=True)
+            return
+
+        # Les connexions héritées ne doivent pas être partagées entre processus
+        connections.close_all()
+        stop = multiprocessing.Event()
+        workers = [
+            multiprocessing.Process(target=_worker, args=(stop,), daemon=True)
+            for _ in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f'{len(workers)} worker(s) started, Ctrl+C to stop')
+
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            # Les workers terminent leur tâche en cours avant de s'arrêter
+            stop.set()
+            for worker in workers:
+                worker.join()
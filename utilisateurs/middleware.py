@@ -0,0 +1,76 @@
+import jwt
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+from . import tenancy
+from .models import Utilisateur
+
+try:
+    import brotli
+except ImportError:  # brotli est optionnel, gzip reste disponible
+    brotli = None
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Brotli when the client accepts it (and the brotli package is installed),
+    gzip otherwise, through Django's GZipMiddleware.
+    """
+    min_length = 200
+
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '')
+        if content_type.startswith('text/event-stream'):
+            return response  # Chaque événement SSE doit partir sans attendre le tampon du compresseur
+        if content_type.startswith(('application/pdf', 'application/zip')):
+            return response  # Déjà compressés
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if (
+            brotli is None
+            or 'br' not in accept_encoding
+            or response.streaming
+            or response.has_header('Content-Encoding')
+            or len(response.content) < self.min_length
+        ):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressed = brotli.compress(response.content, quality=5)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        # Comme GZipMiddleware : le corps change, l'ETag devient faible
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
+
+
+class HopitalMiddleware:
+    """
+    Activates the hospital of the token's user for the whole request, so that
+    TenantManager scopes every query to it. The hospital is read from the
+    token's 'hopital' claim, or from the database for tokens issued before
+    the claim existed. An invalid token activates nothing, the view rejects it.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with tenancy.activer(self.hopital(request)):
+            return self.get_response(request)
+
+    def hopital(self, request):
+        token = request.headers.get('Authorization')
+        if not token:
+            return None
+        try:
+            payload = jwt.decode(token, 'secret', algorithms=['HS256'])
+        except jwt.InvalidTokenError:
+            return None
+        if 'hopital' in payload:
+            return payload['hopital']
+        return Utilisateur.tous.filter(id_utilisateur=payload.get('id')).values_list('hopital_id', flat=True).first()
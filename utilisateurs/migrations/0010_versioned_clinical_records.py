@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0009_remove_medicament_duree_remove_medicament_id_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bilanbiologique',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dossiermedical',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ordonnance',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='resume',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0010_versioned_clinical_records'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tache',
+            fields=[
+                ('id_tache', models.BigAutoField(primary_key=True, serialize=False)),
+                ('nom', models.CharField(max_length=100)),
+                ('arguments', models.JSONField(default=list)),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('terminee', 'Terminée'), ('echouee', 'Échouée')], default='en_attente', max_length=20)),
+                ('tentatives', models.PositiveIntegerField(default=0)),
+                ('max_tentatives', models.PositiveIntegerField(default=5)),
+                ('executer_apres', models.DateTimeField(default=django.utils.timezone.now)),
+                ('resultat', models.JSONField(blank=True, null=True)),
+                ('erreur', models.TextField(blank=True, default='')),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+                ('date_debut', models.DateTimeField(blank=True, null=True)),
+                ('date_fin', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['statut', 'executer_apres'], name='tache_prete_idx')],
+            },
+        ),
+    ]
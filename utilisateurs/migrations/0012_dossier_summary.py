@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0011_tache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DossierSummary',
+            fields=[
+                ('dossier', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='utilisateurs.dossiermedical')),
+                ('nb_consultations', models.PositiveIntegerField(default=0)),
+                ('derniere_consultation', models.DateField(blank=True, null=True)),
+                ('nb_ordonnances', models.PositiveIntegerField(default=0)),
+                ('derniere_ordonnance', models.DateField(blank=True, null=True)),
+                ('nb_traitements', models.PositiveIntegerField(default=0)),
+                ('nb_bilans', models.PositiveIntegerField(default=0)),
+                ('dernier_bilan', models.DateField(blank=True, null=True)),
+                ('date_maj', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-derniere_consultation'], name='summary_derniere_consult_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:04
+
+import re
+from datetime import timedelta
+
+from django.db import migrations, models
+
+# Copie figée de utilisateurs/durees.py au moment de la migration : une modification
+# ultérieure du module ne doit pas changer les dates calculées ici.
+
+UNITES = {
+    'j': 1, 'jour': 1, 'jours': 1, 'day': 1, 'days': 1,
+    'sem': 7, 'semaine': 7, 'semaines': 7, 'week': 7, 'weeks': 7,
+    'mois': 30, 'month': 30, 'months': 30,
+    'an': 365, 'ans': 365, 'annee': 365, 'annees': 365, 'année': 365, 'années': 365,
+    'year': 365, 'years': 365,
+}
+
+DUREE_RE = re.compile(r'^\s*(\d+)\s*([^\d\s]*)\s*$')
+
+
+def duree_en_jours(duree):
+    match = DUREE_RE.match((duree or '').lower())
+    if not match:
+        return None
+    nombre, unite = match.groups()
+    if not unite:
+        return int(nombre)
+    unite = unite.rstrip('.')
+    if unite not in UNITES:
+        return None
+    return int(nombre) * UNITES[unite]
+
+
+def periode_traitement(debut, duree):
+    jours = duree_en_jours(duree)
+    if debut is None or not jours:
+        return debut, None
+    return debut, debut + timedelta(days=jours - 1)
+
+
+def calculer_periodes(apps, schema_editor):
+    Traitement = apps.get_model('utilisateurs', 'Traitement')
+    last_id = 0
+    while True:
+        traitements = list(Traitement.objects.filter(id_traitement__gt=last_id)
+                           .select_related('ordonnance').order_by('id_traitement')[:1000])
+        if not traitements:
+            break
+        for traitement in traitements:
+            traitement.date_debut, traitement.date_fin = periode_traitement(traitement.ordonnance.date, traitement.duree)
+        Traitement.objects.bulk_update(traitements, ['date_debut', 'date_fin'])
+        last_id = traitements[-1].id_traitement
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0012_dossier_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dossiersummary',
+            name='fin_traitements',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='traitement',
+            name='date_debut',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='traitement',
+            name='date_fin',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='traitement',
+            index=models.Index(fields=['date_fin', 'date_debut'], name='traitement_periode_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='traitement',
+            index=models.Index(fields=['medicament', 'date_fin', 'date_debut'], name='traitement_medicament_idx'),
+        ),
+        migrations.RunPython(calculer_periodes, migrations.RunPython.noop),
+    ]
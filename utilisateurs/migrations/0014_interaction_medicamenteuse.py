@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0013_traitement_periode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InteractionMedicamenteuse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('medicament_a', models.CharField(max_length=255)),
+                ('medicament_b', models.CharField(max_length=255)),
+                ('gravite', models.CharField(choices=[('mineure', 'Mineure'), ('moderee', 'Modérée'), ('majeure', 'Majeure'), ('contre_indication', 'Contre-indication')], default='moderee', max_length=20)),
+                ('description', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('medicament_a', 'medicament_b'), name='interaction_unique_paire')],
+            },
+        ),
+    ]
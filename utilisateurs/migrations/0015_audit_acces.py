@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0014_interaction_medicamenteuse'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditAcces',
+            fields=[
+                ('id_audit', models.BigAutoField(primary_key=True, serialize=False)),
+                ('date', models.DateTimeField()),
+                ('utilisateur_id', models.IntegerField(null=True)),
+                ('dossier_id', models.BigIntegerField(null=True)),
+                ('action', models.CharField(choices=[('lecture', 'Lecture'), ('ecriture', 'Écriture')], max_length=10)),
+                ('ressource', models.CharField(max_length=50)),
+                ('objet_id', models.BigIntegerField(null=True)),
+                ('adresse_ip', models.GenericIPAddressField(null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['dossier_id', 'date'], name='audit_dossier_date_idx'), models.Index(fields=['utilisateur_id', 'date'], name='audit_utilisateur_date_idx'), models.Index(fields=['date'], name='audit_date_idx')],
+            },
+        ),
+    ]
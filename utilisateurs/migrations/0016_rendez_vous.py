@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0015_audit_acces'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Disponibilite',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jour_semaine', models.PositiveSmallIntegerField(choices=[(0, 'Lundi'), (1, 'Mardi'), (2, 'Mercredi'), (3, 'Jeudi'), (4, 'Vendredi'), (5, 'Samedi'), (6, 'Dimanche')])),
+                ('heure_debut', models.TimeField()),
+                ('heure_fin', models.TimeField()),
+                ('duree_creneau', models.PositiveIntegerField(default=20)),
+                ('medecin', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='disponibilites', to='utilisateurs.medecin')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['medecin', 'jour_semaine'], name='disponibilite_medecin_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RendezVous',
+            fields=[
+                ('id_rendez_vous', models.BigAutoField(primary_key=True, serialize=False)),
+                ('debut', models.DateTimeField()),
+                ('fin', models.DateTimeField()),
+                ('motif', models.CharField(blank=True, default='', max_length=255)),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+                ('medecin', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rendez_vous', to='utilisateurs.medecin')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rendez_vous', to='utilisateurs.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['patient', 'debut'], name='rendez_vous_patient_idx')],
+                'constraints': [models.UniqueConstraint(fields=('medecin', 'debut'), name='rendez_vous_unique_creneau')],
+            },
+        ),
+    ]
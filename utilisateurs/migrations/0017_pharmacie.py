@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:12
+
+import django.db.models.deletion
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0016_rendez_vous'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Dispensation',
+            fields=[
+                ('id_dispensation', models.BigAutoField(primary_key=True, serialize=False)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('ordonnance', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='dispensation', to='utilisateurs.ordonnance')),
+                ('sgph', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='dispensations', to='utilisateurs.sgph')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LigneDispensation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantite', models.PositiveIntegerField()),
+                ('dispensation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lignes', to='utilisateurs.dispensation')),
+                ('medicament', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='utilisateurs.medicament')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Stock',
+            fields=[
+                ('medicament', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock', serialize=False, to='utilisateurs.medicament')),
+                ('quantite', models.IntegerField(default=0)),
+                ('seuil_alerte', models.IntegerField(default=0)),
+                ('date_maj', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(django.db.models.expressions.CombinedExpression(models.F('quantite'), '-', models.F('seuil_alerte')), name='stock_marge_idx')],
+                'constraints': [models.CheckConstraint(condition=models.Q(('quantite__gte', 0)), name='stock_quantite_positive')],
+            },
+        ),
+    ]
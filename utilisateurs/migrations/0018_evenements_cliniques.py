@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:14
+
+import django.core.serializers.json
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0017_pharmacie'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurseurConsommateur',
+            fields=[
+                ('nom', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('seq', models.BigIntegerField(default=0)),
+                ('date_maj', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EvenementClinique',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('type', models.CharField(max_length=50)),
+                ('objet_id', models.BigIntegerField()),
+                ('dossier_id', models.BigIntegerField(null=True)),
+                ('payload', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
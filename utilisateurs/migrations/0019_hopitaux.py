@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def hopital_principal(apps, schema_editor):
+    # Les données existantes appartiennent à un seul hôpital
+    Utilisateur = apps.get_model('utilisateurs', 'Utilisateur')
+    DossierMedical = apps.get_model('utilisateurs', 'DossierMedical')
+    Hopital = apps.get_model('utilisateurs', 'Hopital')
+    db = schema_editor.connection.alias
+    if not Utilisateur.objects.using(db).exists():
+        return
+    hopital = Hopital.objects.using(db).create(code='principal', nom='Hôpital principal')
+    Utilisateur.objects.using(db).update(hopital=hopital)
+    DossierMedical.objects.using(db).update(hopital=hopital)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0018_evenements_cliniques'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Hopital',
+            fields=[
+                ('id_hopital', models.AutoField(primary_key=True, serialize=False)),
+                ('code', models.CharField(max_length=20, unique=True)),
+                ('nom', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='nss',
+            field=models.CharField(db_index=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='dossiermedical',
+            name='hopital',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='dossiers', to='utilisateurs.hopital'),
+        ),
+        migrations.AddField(
+            model_name='utilisateur',
+            name='hopital',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='utilisateurs', to='utilisateurs.hopital'),
+        ),
+        migrations.RunPython(hopital_principal, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='dossiermedical',
+            index=models.Index(fields=['hopital', 'patient'], name='dossier_hopital_patient_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='utilisateur',
+            index=models.Index(fields=['hopital', 'nom', 'prenom'], name='utilisateur_hopital_nom_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0019_hopitaux'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveDossier',
+            fields=[
+                ('dossier', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive_froide', serialize=False, to='utilisateurs.dossiermedical')),
+                ('compression', models.CharField(max_length=10)),
+                ('donnees', models.BinaryField()),
+                ('taille', models.PositiveIntegerField()),
+                ('nb_lignes', models.PositiveIntegerField()),
+                ('date_archivage', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='dossiermedical',
+            name='archive',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='dossiermedical',
+            name='date_cloture',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0020_archive_dossier'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Terme',
+            fields=[
+                ('terme', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('nb_documents', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Occurrence',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('terme', models.CharField(max_length=40)),
+                ('ressource', models.CharField(max_length=10)),
+                ('objet_id', models.IntegerField()),
+                ('date', models.DateField()),
+                ('poids', models.FloatField()),
+                ('dossier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='utilisateurs.dossiermedical')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['terme', 'dossier', 'date'], name='occurrence_terme_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ressource', 'objet_id', 'terme'), name='occurrence_unique')],
+            },
+        ),
+    ]
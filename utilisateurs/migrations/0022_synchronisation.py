@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:32
+
+import django.core.serializers.json
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0021_recherche_plein_texte'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bilanbiologique',
+            name='date_maj',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='dossiermedical',
+            name='date_maj',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='ordonnance',
+            name='date_maj',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='resume',
+            name='date_maj',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='traitement',
+            name='date_maj',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='utilisateur',
+            name='date_maj',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='OperationSync',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('utilisateur_id', models.IntegerField()),
+                ('operation', models.CharField(max_length=64)),
+                ('resultat', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('date', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('utilisateur_id', 'operation'), name='operation_sync_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Suppression',
+            fields=[
+                ('id_suppression', models.BigAutoField(primary_key=True, serialize=False)),
+                ('ressource', models.CharField(max_length=20)),
+                ('objet_id', models.BigIntegerField()),
+                ('hopital_id', models.IntegerField(null=True)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hopital_id', 'date'], name='suppression_hopital_date_idx'), models.Index(fields=['date'], name='suppression_date_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0022_synchronisation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cumul',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('hopital_id', models.IntegerField(default=0)),
+                ('indicateur', models.CharField(max_length=30)),
+                ('periode', models.DateField()),
+                ('dimension', models.CharField(blank=True, default='', max_length=50)),
+                ('valeur', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['indicateur', 'periode'], name='cumul_indicateur_idx')],
+                'constraints': [models.UniqueConstraint(fields=('hopital_id', 'indicateur', 'periode', 'dimension'), name='cumul_unique')],
+            },
+        ),
+    ]
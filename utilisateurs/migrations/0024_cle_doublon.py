@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0023_statistiques_activite'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CleDoublon',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('hopital_id', models.IntegerField(null=True)),
+                ('cle', models.CharField(max_length=40)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='utilisateurs.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hopital_id', 'cle'], name='cle_doublon_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0024_cle_doublon'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='utilisateur',
+            index=models.Index(fields=['nom', 'prenom'], name='utilisateur_nom_idx'),
+        ),
+    ]
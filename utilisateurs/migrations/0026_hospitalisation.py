@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:53
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0025_utilisateur_nom_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Chambre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('numero', models.CharField(max_length=20)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Lit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('numero', models.CharField(max_length=10)),
+                ('actif', models.BooleanField(default=True)),
+                ('depuis', models.DateTimeField(blank=True, null=True)),
+                ('chambre', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lits', to='utilisateurs.chambre')),
+                ('dossier', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='lit', to='utilisateurs.dossiermedical')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MouvementLit',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('type', models.CharField(choices=[('admission', 'Admission'), ('transfert', 'Transfert'), ('sortie', 'Sortie')], max_length=10)),
+                ('hopital_id', models.IntegerField(null=True)),
+                ('auteur_id', models.IntegerField(null=True)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('dossier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mouvements_lit', to='utilisateurs.dossiermedical')),
+                ('lit_arrivee', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='utilisateurs.lit')),
+                ('lit_depart', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='utilisateurs.lit')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Service',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=20)),
+                ('nom', models.CharField(max_length=255)),
+                ('hopital', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='services', to='utilisateurs.hopital')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chambre',
+            name='service',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chambres', to='utilisateurs.service'),
+        ),
+        migrations.AddConstraint(
+            model_name='lit',
+            constraint=models.UniqueConstraint(fields=('chambre', 'numero'), name='lit_unique_numero'),
+        ),
+        migrations.AddIndex(
+            model_name='mouvementlit',
+            index=models.Index(fields=['dossier', 'date'], name='mouvement_lit_dossier_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='service',
+            constraint=models.UniqueConstraint(fields=('hopital', 'code'), name='service_unique_code'),
+        ),
+        migrations.AddConstraint(
+            model_name='chambre',
+            constraint=models.UniqueConstraint(fields=('service', 'numero'), name='chambre_unique_numero'),
+        ),
+    ]
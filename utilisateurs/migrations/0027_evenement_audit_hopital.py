@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def hopital_des_lignes(apps, schema_editor):
+    # Événements : hôpital du dossier ; accès : hôpital de l'utilisateur, ou du dossier
+    EvenementClinique = apps.get_model('utilisateurs', 'EvenementClinique')
+    AuditAcces = apps.get_model('utilisateurs', 'AuditAcces')
+    DossierMedical = apps.get_model('utilisateurs', 'DossierMedical')
+    Utilisateur = apps.get_model('utilisateurs', 'Utilisateur')
+    db = schema_editor.connection.alias
+    du_dossier = Subquery(DossierMedical.objects.using(db).filter(pk=OuterRef('dossier_id')).values('hopital_id')[:1])
+    de_l_utilisateur = Subquery(Utilisateur.objects.using(db).filter(pk=OuterRef('utilisateur_id')).values('hopital_id')[:1])
+    EvenementClinique.objects.using(db).update(hopital_id=du_dossier)
+    AuditAcces.objects.using(db).update(hopital_id=Coalesce(de_l_utilisateur, du_dossier))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0026_hospitalisation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='auditacces',
+            name='hopital_id',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='evenementclinique',
+            name='hopital_id',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.RunPython(hopital_des_lignes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='auditacces',
+            index=models.Index(fields=['hopital_id', 'date'], name='audit_hopital_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='evenementclinique',
+            index=models.Index(fields=['hopital_id', 'seq'], name='evenement_hopital_seq_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:30
+
+from django.db import migrations
+
+
+def supprimer_compteur_documents(apps, schema_editor):
+    # Le nombre total de notes est maintenant lu dans DossierSummary (recherche.nombre_documents)
+    Terme = apps.get_model('utilisateurs', 'Terme')
+    Terme.objects.using(schema_editor.connection.alias).filter(terme='#documents').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0027_evenement_audit_hopital'),
+    ]
+
+    operations = [
+        migrations.RunPython(supprimer_compteur_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:31
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0028_terme_sans_documents'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='dossiersummary',
+            name='nb_traitements',
+        ),
+    ]
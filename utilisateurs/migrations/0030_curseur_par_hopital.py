@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Curseurs par (hôpital, nom). Les curseurs existants étaient globaux : ils restent sans
+    # hôpital, les consommateurs de chaque hôpital recréent le leur au prochain acquittement.
+
+    dependencies = [
+        ('utilisateurs', '0029_summary_sans_nb_traitements'),
+    ]
+
+    operations = [
+        # La clé primaire nom est retirée avant d'ajouter id_curseur (MySQL : une seule clé primaire)
+        migrations.AlterField(
+            model_name='curseurconsommateur',
+            name='nom',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AddField(
+            model_name='curseurconsommateur',
+            name='id_curseur',
+            field=models.AutoField(primary_key=True, serialize=False),
+        ),
+        migrations.AddField(
+            model_name='curseurconsommateur',
+            name='hopital_id',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='curseurconsommateur',
+            constraint=models.UniqueConstraint(fields=('hopital_id', 'nom'), name='curseur_hopital_nom_uniq'),
+        ),
+    ]
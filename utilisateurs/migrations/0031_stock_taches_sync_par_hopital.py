@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def rattacher(apps, schema_editor):
+    # Stock existant : à l'hôpital s'il n'y en a qu'un, sinon 0 (à répartir par l'administrateur).
+    # Opérations de synchronisation : hôpital de leur utilisateur.
+    Hopital = apps.get_model('utilisateurs', 'Hopital')
+    Stock = apps.get_model('utilisateurs', 'Stock')
+    OperationSync = apps.get_model('utilisateurs', 'OperationSync')
+    Utilisateur = apps.get_model('utilisateurs', 'Utilisateur')
+    db = schema_editor.connection.alias
+    hopitaux = list(Hopital.objects.using(db).values_list('pk', flat=True)[:2])
+    if len(hopitaux) == 1:
+        Stock.objects.using(db).update(hopital_id=hopitaux[0])
+    de_l_utilisateur = Subquery(Utilisateur.objects.using(db).filter(pk=OuterRef('utilisateur_id')).values('hopital_id')[:1])
+    OperationSync.objects.using(db).update(hopital_id=de_l_utilisateur)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0030_curseur_par_hopital'),
+    ]
+
+    operations = [
+        # La clé primaire medicament est retirée avant d'ajouter id (MySQL : une seule clé primaire)
+        migrations.AlterField(
+            model_name='stock',
+            name='medicament',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stocks', to='utilisateurs.medicament'),
+        ),
+        migrations.AddField(
+            model_name='stock',
+            name='id',
+            field=models.BigAutoField(primary_key=True, serialize=False),
+        ),
+        migrations.AddField(
+            model_name='stock',
+            name='hopital_id',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='operationsync',
+            name='hopital_id',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='tache',
+            name='hopital_id',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.RunPython(rattacher, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='stock',
+            constraint=models.UniqueConstraint(fields=('hopital_id', 'medicament'), name='stock_hopital_medicament_uniq'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def recopier_hopital(apps, schema_editor):
+    Patient = apps.get_model('utilisateurs', 'Patient')
+    Utilisateur = apps.get_model('utilisateurs', 'Utilisateur')
+    db = schema_editor.connection.alias
+    hopital = Subquery(Utilisateur.objects.using(db).filter(pk=OuterRef('pk')).values('hopital_id')[:1])
+    Patient.objects.using(db).update(hopital_nss=Coalesce(hopital, 0))
+
+
+class Migration(migrations.Migration):
+    # Unicité (hôpital, nss) portée par la base au lieu du verrou sur Hopital dans Patient.save()
+
+    dependencies = [
+        ('utilisateurs', '0031_stock_taches_sync_par_hopital'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='hopital_nss',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(recopier_hopital, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='patient',
+            constraint=models.UniqueConstraint(fields=('hopital_nss', 'nss'), name='patient_hopital_nss_uniq'),
+        ),
+    ]
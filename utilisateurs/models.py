@@ -1,13 +1,118 @@
-from django.db import models
+import contextvars
+
+from django.db import models, transaction
+from django.db.models import F, Value, Count, Max
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .durees import periode_traitement
+from .tenancy import TenantManager, hopital_courant
 from django.contrib.auth.hashers import make_password
 import qrcode
 from io import BytesIO
 from django.core.files import File
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
 # Create your models here.
 
+class VersionConflict(Exception):
+    """Raised when a versioned row was modified by someone else in the meantime."""
+
+    def __init__(self, instance, expected_version):
+        self.instance = instance
+        self.expected_version = expected_version
+        super().__init__(f'{type(instance).__name__} {instance.pk} is no longer at version {expected_version}')
+
+
+class VersionedModel(models.Model):
+    """
+    Optimistic concurrency control: every update is a conditional
+    UPDATE ... WHERE version = n, so concurrent edits never take a row lock
+    up front and never silently overwrite each other.
+    date_maj is bumped by every write, /api/sync reads the changes from it.
+    """
+    version = models.PositiveIntegerField(default=0)
+    date_maj = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        abstract = True
+
+    def update_if_version(self, expected_version, **fields):
+        # _base_manager : pas de jointure ajoutée par le filtre d'hôpital, l'UPDATE reste conditionnel
+        date_maj = timezone.now()  # update() ne passe pas par auto_now
+        updated = type(self)._base_manager.filter(pk=self.pk, version=expected_version).update(
+            version=F('version') + 1, date_maj=date_maj, **fields
+        )
+        if not updated:
+            raise VersionConflict(self, expected_version)
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.version = expected_version + 1
+        self.date_maj = date_maj
+        return self
+
+
+class SuiviDossierMixin:
+    """
+    Keeps the DossierSummary of the owning dossier up to date and appends the
+    change to the EvenementClinique outbox, in the same transaction as the write.
+    Deletes are handled by the post_delete receiver at the bottom of this file
+    so cascades are covered too. Models listing text fields in
+    `champs_recherche` are also kept in the full-text index (recherche.py),
+    and the activity rollups (Cumul) follow the fields in `champs_cumuls`.
+    """
+    champs_recherche = ()
+    champs_cumuls = frozenset({'date', 'medecin', 'medicament'})
+
+    def save(self, *args, **kwargs):
+        from . import statistiques
+        with transaction.atomic():
+            creating = self._state.adding
+            # Modification par save() (rare) : les compteurs de l'ancienne ligne sont relus
+            avant = None if creating else statistiques.cles(type(self).tous.filter(pk=self.pk).first(), lignes=True)
+            super().save(*args, **kwargs)
+            if creating:
+                DossierSummary.enregistrer(self)
+                statistiques.ajouter(self)
+            else:
+                DossierSummary.recalculer([self.dossier_suivi_id])
+                statistiques.deplacer(self, avant)
+            EvenementClinique.enregistrer(self, EvenementClinique.CREE if creating else EvenementClinique.MODIFIE)
+            if self.champs_recherche:
+                from .recherche import indexer
+                indexer(self, creation=creating)
+
+    def update_if_version(self, expected_version, **fields):
+        from . import statistiques
+        with transaction.atomic():
+            suivis = fields.keys() & self.champs_cumuls
+            avant = statistiques.cles(self, lignes=True) if suivis else None
+            super().update_if_version(expected_version, **fields)
+            if 'date' in fields:
+                DossierSummary.recalculer([self.dossier_suivi_id])
+            if suivis:
+                statistiques.deplacer(self, avant)
+            EvenementClinique.enregistrer(self, EvenementClinique.MODIFIE)
+            if self.champs_recherche and fields.keys() & {'date', *self.champs_recherche}:
+                from .recherche import indexer
+                indexer(self)
+        return self
+
+
+# Hôpital (tenant) : chaque utilisateur et chaque dossier appartient à un hôpital
+class Hopital(models.Model):
+    id_hopital = models.AutoField(primary_key=True)
+    code = models.CharField(max_length=20, unique=True)
+    nom = models.CharField(max_length=255)
+
+    def __str__(self):
+        return self.nom
+
+
 class Utilisateur(models.Model):
     id_utilisateur = models.AutoField(primary_key=True)
     nom = models.CharField(max_length=255)
@@ -16,6 +121,27 @@ class Utilisateur(models.Model):
     email = models.EmailField(max_length=254, unique=True, default='')
     is_staff = models.BooleanField(default=False)
     is_superuser = models.BooleanField(default=False)
+    # Null pour les comptes communs à tous les hôpitaux
+    hopital = models.ForeignKey(Hopital, on_delete=models.PROTECT, null=True, blank=True, related_name='utilisateurs')
+    # Dernière modification, lue par /api/sync pour les patients
+    date_maj = models.DateTimeField(auto_now=True, db_index=True)
+
+    # Filtré sur l'hôpital de la requête, hérité par tous les types d'utilisateurs
+    chemin_hopital = 'hopital'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['hopital', 'nom', 'prenom'], name='utilisateur_hopital_nom_idx'),
+            # Recherche par préfixe de l'admin, tous hôpitaux confondus
+            models.Index(fields=['nom', 'prenom'], name='utilisateur_nom_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.hopital_id is None:
+            self.hopital_id = hopital_courant()
+        super().save(*args, **kwargs)
 
     def set_password(self, raw_password):
         self.password = make_password(raw_password)
@@ -70,7 +196,10 @@ class SGPH(Utilisateur):  # Inherits from Utilisateur
 
 
 class Patient(Utilisateur):
-    nss = models.CharField(max_length=50, unique=True)
+    # Unique par hôpital : une contrainte ne peut pas porter à la fois sur nss (table patient)
+    # et hopital (table utilisateur), l'hôpital est recopié dans la table patient par save()
+    nss = models.CharField(max_length=50, db_index=True)
+    hopital_nss = models.IntegerField(default=0, editable=False)  # hopital_id, 0 sans hôpital
     date_naissance = models.DateField()
     adresse = models.TextField(default="Adresse inconnue")
     telephone = models.CharField(max_length=15, default="0000000000")
@@ -78,11 +207,27 @@ class Patient(Utilisateur):
     # Mutuelle ou assurance, facultatif
     mutuelle = models.CharField(max_length=50, null=True, blank=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hopital_nss', 'nss'], name='patient_hopital_nss_uniq'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.hopital_id is None:
+            self.hopital_id = hopital_courant()
+        self.hopital_nss = self.hopital_id or 0
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'hopital', 'hopital_id'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'hopital_nss'}
+        # Les lignes utilisateur et patient ensemble : un nss en double n'en laisse aucune
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f'Patient: {self.nom} - {self.prenom}'
 
 
-class Resume(models.Model):
+class Resume(SuiviDossierMixin, VersionedModel):
     id_resume = models.AutoField(primary_key=True)
     date = models.DateField()  # Date of the resume
     description = models.TextField()  # Summary description
@@ -100,6 +245,15 @@ class Resume(models.Model):
         related_name='resumes'
     )  # Medecin who wrote this resume
 
+    champs_recherche = ('description',)
+    chemin_hopital = 'dpi__hopital'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    @property
+    def dossier_suivi_id(self):
+        return self.dpi_id
+
     def __str__(self):
         return f'Resume {self.id_resume} - {self.date}'
 
@@ -117,7 +271,42 @@ class Medicament(models.Model):
     dosage = models.CharField(max_length=100)  # Exemple : 500mg, 1000mg
     forme = models.CharField(max_length=100)  # Exemple : Comprimé, Sirop
 
-class Traitement(models.Model):
+# Table d'interactions médicamenteuses chargée localement (manage.py charger_interactions),
+# indexée en mémoire par interactions.py. Les noms sont normalisés et medicament_a < medicament_b.
+class InteractionMedicamenteuse(models.Model):
+    MINEURE = 'mineure'
+    MODEREE = 'moderee'
+    MAJEURE = 'majeure'
+    CONTRE_INDICATION = 'contre_indication'
+    GRAVITES = [
+        (MINEURE, 'Mineure'),
+        (MODEREE, 'Modérée'),
+        (MAJEURE, 'Majeure'),
+        (CONTRE_INDICATION, 'Contre-indication'),
+    ]
+
+    medicament_a = models.CharField(max_length=255)  # Medicament.nom
+    medicament_b = models.CharField(max_length=255)  # Medicament.nom
+    gravite = models.CharField(max_length=20, choices=GRAVITES, default=MODEREE)
+    description = models.TextField(blank=True, default='')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['medicament_a', 'medicament_b'], name='interaction_unique_paire'),
+        ]
+
+    def __str__(self):
+        return f'{self.medicament_a} + {self.medicament_b} ({self.gravite})'
+
+
+class TraitementQuerySet(models.QuerySet):
+    def actifs(self, jour=None):
+        # Deux bornes indexées : date_fin >= jour puis date_debut <= jour
+        jour = jour or timezone.localdate()
+        return self.filter(date_fin__gte=jour, date_debut__lte=jour)
+
+
+class Traitement(SuiviDossierMixin, models.Model):
     id_traitement = models.AutoField(primary_key=True, default=None)  # default=None is done because of modification, should be deleted when first executing the code
     medicament = models.ForeignKey(
         'Medicament',
@@ -133,17 +322,50 @@ class Traitement(models.Model):
         related_name='medicaments', # Access the médicaments via ordonnance.medicaments
         default=None                # This is done because of modification, should be deleted when first executing the code
     )
+    # Calculées à l'enregistrement à partir de la date de l'ordonnance et de duree,
+    # date_fin est nulle si duree n'est pas interprétable
+    date_debut = models.DateField(null=True, blank=True)
+    date_fin = models.DateField(null=True, blank=True)
+    date_maj = models.DateTimeField(auto_now=True, db_index=True)  # Pour /api/sync
+
+    chemin_hopital = 'ordonnance__dpi_patient__hopital'
+    objects = TenantManager.from_queryset(TraitementQuerySet)()
+    tous = TraitementQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Traitements en cours (tous patients) : parcours de date_fin >= aujourd'hui
+            models.Index(fields=['date_fin', 'date_debut'], name='traitement_periode_idx'),
+            # Patients sous un médicament donné
+            models.Index(fields=['medicament', 'date_fin', 'date_debut'], name='traitement_medicament_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.date_debut, self.date_fin = periode_traitement(self.ordonnance.date, self.duree)
+        super().save(*args, **kwargs)
+
+    @property
+    def dossier_suivi_id(self):
+        return self.ordonnance.dpi_patient_id
 
     def __str__(self):
         return f'{self.nom} ({self.dosage}, {self.forme})'
 
 # Modèle Ordonnance
-class Ordonnance(models.Model):
+class Ordonnance(SuiviDossierMixin, VersionedModel):
     id_ordonnance = models.AutoField(primary_key=True)  # Identifiant unique pour l'ordonnance
     date = models.DateField()  # Date de l'ordonnance
     medecin = models.ForeignKey('Medecin', on_delete=models.CASCADE, default=None)  # Relation avec Medecin
     dpi_patient = models.ForeignKey('DossierMedical', on_delete=models.CASCADE, default=None, related_name='ordonnances')  # Relation avec Patient (Dossier)
 
+    chemin_hopital = 'dpi_patient__hopital'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    @property
+    def dossier_suivi_id(self):
+        return self.dpi_patient_id
+
     def __str__(self):
         return f'Ordonnance {self.id_ordonnance} - {self.date}'
 
@@ -161,7 +383,7 @@ class Soin(models.Model):
     infirmier = models.ForeignKey(Infirmier, on_delete=models.CASCADE)
 
 
-class BilanBiologique(models.Model):
+class BilanBiologique(SuiviDossierMixin, VersionedModel):
     id_bilan = models.AutoField(primary_key=True)
     date = models.DateField()  # Date of the bilan
     result = models.TextField(default='')  # Results of the biological exam
@@ -180,6 +402,15 @@ class BilanBiologique(models.Model):
         related_name='bilans'
     )  # Laborantin who worked on this bilan
 
+    champs_recherche = ('description', 'result')
+    chemin_hopital = 'dpi__hopital'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    @property
+    def dossier_suivi_id(self):
+        return self.dpi_id
+
     def __str__(self):
         return f'Bilan {self.id_bilan} - {self.date}'
 
@@ -196,7 +427,7 @@ class BilanBiologique(models.Model):
 
 
 # Modèle pour représenter les dossiers médicaux liés à un patient
-class DossierMedical(models.Model):
+class DossierMedical(VersionedModel):
     # Référence au modèle Patient
     patient = models.OneToOneField(
         Patient,
@@ -204,12 +435,40 @@ class DossierMedical(models.Model):
         related_name="dossier_medical",
         default=1  # ID du patient par défaut
     )
+    # Copie de patient.hopital, pour filtrer les dossiers sans jointure
+    hopital = models.ForeignKey(Hopital, on_delete=models.PROTECT, null=True, blank=True, related_name='dossiers')
+    # Décès ou sortie définitive, le dossier devient archivable (manage.py archiver_dossiers)
+    date_cloture = models.DateField(null=True, blank=True)
+    # Contenu clinique déplacé dans ArchiveDossier, voir archivage.py
+    archive = models.BooleanField(default=False)
 
     # Champ pour le QR Code, facultatif
     qr_code = models.ImageField(upload_to='qr_codes/', blank=True, null=True)
 
+    chemin_hopital = 'hopital'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['hopital', 'patient'], name='dossier_hopital_patient_idx'),
+        ]
+
     # Méthode pour sauvegarder le modèle
     def save(self, *args, **kwargs):
+        creating = self._state.adding
+        if self.hopital_id is None:
+            self.hopital_id = self.patient.hopital_id
+        super().save(*args, **kwargs)  # Appeler la méthode save() originale
+        if creating:
+            DossierSummary.tous.get_or_create(dossier=self)
+        # Le QR Code est généré par le worker (manage.py runworker), pas pendant la requête.
+        # La tâche est insérée dans la même transaction que le dossier.
+        if not self.qr_code or not self.qr_code.name.startswith(f'qr_codes/{self.patient.nss}_qr'):
+            from .tasks import enqueue
+            enqueue('generer_qr_code', self.pk)
+
+    def generer_qr_code(self):
         # Générer un QR Code basé sur le NSS
         qr_img = qrcode.make(self.patient.nss)
         buffer = BytesIO()
@@ -217,8 +476,654 @@ class DossierMedical(models.Model):
         buffer.seek(0)  # Réinitialiser le pointeur du buffer
         self.qr_code.save(f'{self.patient.nss}_qr.png', File(buffer),
                           save=False)  # Associer le fichier au champ qr_code
-        super().save(*args, **kwargs)  # Appeler la méthode save() originale
+        # update() plutôt que save() pour ne pas ré-enfiler la tâche
+        DossierMedical.tous.filter(pk=self.pk).update(qr_code=self.qr_code.name)
 
     # Méthode pour afficher le modèle comme une chaîne lisible
     def __str__(self):
         return f"{self.patient.nom} {self.patient.prenom} - {self.patient.nss}"
+
+
+# Résumé dénormalisé d'un dossier (compteurs et dernières dates) pour les tableaux de bord.
+# Mis à jour à chaque écriture d'un Resume / Ordonnance / Traitement / BilanBiologique,
+# reconstruit par manage.py rebuild_dossier_summary.
+class DossierSummary(models.Model):
+    dossier = models.OneToOneField(
+        DossierMedical,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='summary'
+    )
+    nb_consultations = models.PositiveIntegerField(default=0)
+    derniere_consultation = models.DateField(null=True, blank=True)
+    nb_ordonnances = models.PositiveIntegerField(default=0)
+    derniere_ordonnance = models.DateField(null=True, blank=True)
+    fin_traitements = models.DateField(null=True, blank=True)  # Sous traitement tant que >= aujourd'hui
+    nb_bilans = models.PositiveIntegerField(default=0)
+    dernier_bilan = models.DateField(null=True, blank=True)
+    date_maj = models.DateTimeField(auto_now=True)
+
+    chemin_hopital = 'dossier__hopital'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    # modèle -> (compteur, date la plus récente, champ date du modèle). Pas de compteur des
+    # traitements : ceux en cours changent sans écriture, /api/dossiers les compte à la lecture
+    CHAMPS = {
+        'Resume': ('nb_consultations', 'derniere_consultation', 'date'),
+        'Ordonnance': ('nb_ordonnances', 'derniere_ordonnance', 'date'),
+        'Traitement': (None, 'fin_traitements', 'date_fin'),
+        'BilanBiologique': ('nb_bilans', 'dernier_bilan', 'date'),
+    }
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-derniere_consultation'], name='summary_derniere_consult_idx'),
+        ]
+
+    @classmethod
+    def enregistrer(cls, instance):
+        # Incrément en un seul UPDATE, sans relire la ligne
+        compteur, champ_date, source = cls.CHAMPS[type(instance).__name__]
+        updates = {'date_maj': timezone.now()}
+        if compteur is not None:
+            updates[compteur] = F(compteur) + 1
+        if getattr(instance, source) is not None:
+            date = Value(getattr(instance, source), output_field=models.DateField())
+            updates[champ_date] = Greatest(Coalesce(F(champ_date), date), date)
+        if not cls.tous.filter(dossier_id=instance.dossier_suivi_id).update(**updates):
+            cls.recalculer([instance.dossier_suivi_id])
+
+    @classmethod
+    def recalculer(cls, dossier_ids, creer=True):
+        # Recalcule les résumés des dossiers donnés avec une requête agrégée par table source
+        dossier_ids = list(dossier_ids)
+        existing = set(cls.tous.filter(dossier_id__in=dossier_ids).values_list('dossier_id', flat=True))
+        if creer:
+            dossier_ids = list(DossierMedical.tous.filter(id__in=dossier_ids).values_list('id', flat=True))
+        else:
+            dossier_ids = [dossier_id for dossier_id in dossier_ids if dossier_id in existing]
+        summaries = {dossier_id: cls(dossier_id=dossier_id) for dossier_id in dossier_ids}
+
+        sources = [
+            (Resume.tous, 'dpi', 'Resume'),
+            (Ordonnance.tous, 'dpi_patient', 'Ordonnance'),
+            (Traitement.tous, 'ordonnance__dpi_patient', 'Traitement'),
+            (BilanBiologique.tous, 'dpi', 'BilanBiologique'),
+        ]
+        for queryset, fk, model in sources:
+            compteur, champ_date, source = cls.CHAMPS[model]
+            rows = (queryset.filter(**{f'{fk}__in': dossier_ids})
+                    .values(fk).annotate(n=Count('pk'), last=Max(source)).order_by())
+            for row in rows:
+                if compteur is not None:
+                    setattr(summaries[row[fk]], compteur, row['n'])
+                setattr(summaries[row[fk]], champ_date, row['last'])
+
+        now = timezone.now()
+        for summary in summaries.values():
+            summary.date_maj = now
+        fields = [field for compteur, champ_date, source in cls.CHAMPS.values()
+                  for field in (compteur, champ_date) if field is not None]
+        fields.append('date_maj')
+        cls.tous.bulk_update([s for s in summaries.values() if s.dossier_id in existing], fields)
+        cls.tous.bulk_create([s for s in summaries.values() if s.dossier_id not in existing])
+
+    def __str__(self):
+        return f'Summary {self.dossier_id}'
+
+
+# Cumuls des statistiques d'activité (statistiques.py) : un compteur par hôpital, indicateur,
+# période (mois ou semaine) et dimension (médicament, médecin, spécialité). Tenus à jour à
+# chaque écriture comme DossierSummary, reconstruits par manage.py recalculer_statistiques.
+class Cumul(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    hopital_id = models.IntegerField(default=0)  # 0 sans hôpital : l'unicité ne s'applique pas à NULL
+    indicateur = models.CharField(max_length=30)
+    periode = models.DateField()  # Premier jour du mois, ou lundi de la semaine
+    dimension = models.CharField(max_length=50, default='', blank=True)
+    valeur = models.IntegerField(default=0)
+
+    chemin_hopital = 'hopital_id'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hopital_id', 'indicateur', 'periode', 'dimension'], name='cumul_unique'),
+        ]
+        indexes = [
+            # Lecture tous hôpitaux confondus (hors requête)
+            models.Index(fields=['indicateur', 'periode'], name='cumul_indicateur_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.indicateur} {self.periode} {self.dimension}: {self.valeur}'
+
+
+# Index de blocage des doublons de patients (doublons.py) : quelques clés phonétiques par
+# patient (nom, prénom, date de naissance). Deux patients ne sont comparés que s'ils
+# partagent une clé. Tenu à jour à l'enregistrement du patient.
+class CleDoublon(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='+')
+    hopital_id = models.IntegerField(null=True)
+    cle = models.CharField(max_length=40)
+
+    chemin_hopital = 'hopital_id'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['hopital_id', 'cle'], name='cle_doublon_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.cle} -> {self.patient_id}'
+
+
+# Services d'hospitalisation, chambres et lits (hospitalisation.py). Lit.dossier est l'occupant
+# du lit, modifié seulement par UPDATE conditionnel ; MouvementLit est le journal des admissions,
+# transferts et sorties, rejoué par l'index d'occupation en mémoire de chaque worker.
+class Service(models.Model):
+    hopital = models.ForeignKey(Hopital, on_delete=models.PROTECT, related_name='services')
+    code = models.CharField(max_length=20)
+    nom = models.CharField(max_length=255)
+
+    chemin_hopital = 'hopital'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hopital', 'code'], name='service_unique_code'),
+        ]
+
+    def __str__(self):
+        return self.nom
+
+
+class Chambre(models.Model):
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='chambres')
+    numero = models.CharField(max_length=20)
+
+    chemin_hopital = 'service__hopital'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['service', 'numero'], name='chambre_unique_numero'),
+        ]
+
+    def __str__(self):
+        return f'{self.service} - {self.numero}'
+
+
+class Lit(models.Model):
+    chambre = models.ForeignKey(Chambre, on_delete=models.CASCADE, related_name='lits')
+    numero = models.CharField(max_length=10)
+    actif = models.BooleanField(default=True)  # Lit fermé (travaux, isolement) : aucune admission
+    # OneToOne : un patient n'occupe qu'un lit, même avec deux admissions concurrentes
+    dossier = models.OneToOneField(DossierMedical, on_delete=models.SET_NULL, null=True, blank=True, related_name='lit')
+    depuis = models.DateTimeField(null=True, blank=True)
+
+    chemin_hopital = 'chambre__service__hopital'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['chambre', 'numero'], name='lit_unique_numero'),
+        ]
+
+    def __str__(self):
+        return f'{self.chambre} - {self.numero}'
+
+
+class MouvementLit(models.Model):
+    ADMISSION = 'admission'
+    TRANSFERT = 'transfert'
+    SORTIE = 'sortie'
+    TYPES = [
+        (ADMISSION, 'Admission'),
+        (TRANSFERT, 'Transfert'),
+        (SORTIE, 'Sortie'),
+    ]
+
+    seq = models.BigAutoField(primary_key=True)
+    type = models.CharField(max_length=10, choices=TYPES)
+    dossier = models.ForeignKey(DossierMedical, on_delete=models.CASCADE, related_name='mouvements_lit')
+    # PROTECT : un lit qui a servi est fermé (actif=False), pas supprimé
+    lit_depart = models.ForeignKey(Lit, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    lit_arrivee = models.ForeignKey(Lit, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    hopital_id = models.IntegerField(null=True)
+    auteur_id = models.IntegerField(null=True)
+    date = models.DateTimeField(default=timezone.now)
+
+    chemin_hopital = 'hopital_id'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dossier', 'date'], name='mouvement_lit_dossier_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.seq} {self.type} {self.dossier_id}'
+
+
+# Contenu clinique d'un dossier archivé (Resume, Ordonnance, Traitement, BilanBiologique et
+# dispensations), en JSON compressé, retiré des tables courantes. Voir archivage.py.
+class ArchiveDossier(models.Model):
+    dossier = models.OneToOneField(
+        DossierMedical,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='archive_froide'
+    )
+    compression = models.CharField(max_length=10)  # zstd ou gzip
+    donnees = models.BinaryField()
+    taille = models.PositiveIntegerField()  # JSON non compressé, en octets
+    nb_lignes = models.PositiveIntegerField()
+    date_archivage = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Archive {self.dossier_id} ({self.nb_lignes} lignes)'
+
+
+# Stock de la pharmacie de chaque hôpital (SGPH), une ligne par hôpital et médicament.
+# Toujours modifié par UPDATE ... SET quantite = quantite +/- n, jamais lu puis réécrit.
+class Stock(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    medicament = models.ForeignKey(Medicament, on_delete=models.CASCADE, related_name='stocks')
+    hopital_id = models.IntegerField(default=0)  # 0 sans hôpital : l'unicité ne s'applique pas à NULL
+    quantite = models.IntegerField(default=0)  # En unités (comprimés, flacons...)
+    seuil_alerte = models.IntegerField(default=0)
+    date_maj = models.DateTimeField(auto_now=True)
+
+    chemin_hopital = 'hopital_id'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hopital_id', 'medicament'], name='stock_hopital_medicament_uniq'),
+            models.CheckConstraint(condition=models.Q(quantite__gte=0), name='stock_quantite_positive'),
+        ]
+        indexes = [
+            # Requête des stocks bas : quantite - seuil_alerte <= 0
+            models.Index(F('quantite') - F('seuil_alerte'), name='stock_marge_idx'),
+        ]
+
+    def __str__(self):
+        return f'Stock {self.medicament_id}: {self.quantite}'
+
+
+class Dispensation(models.Model):
+    id_dispensation = models.BigAutoField(primary_key=True)
+    # Une ordonnance n'est dispensée qu'une fois, même avec deux SGPH en même temps
+    ordonnance = models.OneToOneField(Ordonnance, on_delete=models.CASCADE, related_name='dispensation')
+    sgph = models.ForeignKey(SGPH, on_delete=models.SET_NULL, null=True, related_name='dispensations')
+    date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Dispensation {self.id_dispensation} - Ordonnance {self.ordonnance_id}'
+
+
+class LigneDispensation(models.Model):
+    dispensation = models.ForeignKey(Dispensation, on_delete=models.CASCADE, related_name='lignes')
+    medicament = models.ForeignKey(Medicament, on_delete=models.PROTECT)
+    quantite = models.PositiveIntegerField()
+
+
+# Plages de consultation hebdomadaires d'un médecin, découpées en créneaux de duree_creneau minutes
+class Disponibilite(models.Model):
+    JOURS = [(0, 'Lundi'), (1, 'Mardi'), (2, 'Mercredi'), (3, 'Jeudi'), (4, 'Vendredi'), (5, 'Samedi'), (6, 'Dimanche')]
+
+    medecin = models.ForeignKey(Medecin, on_delete=models.CASCADE, related_name='disponibilites')
+    jour_semaine = models.PositiveSmallIntegerField(choices=JOURS)
+    heure_debut = models.TimeField()
+    heure_fin = models.TimeField()
+    duree_creneau = models.PositiveIntegerField(default=20)  # En minutes
+
+    chemin_hopital = 'medecin__hopital'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['medecin', 'jour_semaine'], name='disponibilite_medecin_idx'),
+        ]
+
+    def clean(self):
+        # Deux plages du même jour qui se chevauchent donnent des créneaux qui se chevauchent avec des
+        # débuts différents, que la contrainte unique (medecin, debut) des rendez-vous ne voit pas
+        if self.heure_debut is None or self.heure_fin is None or self.medecin_id is None:
+            return
+        if self.heure_fin <= self.heure_debut:
+            raise ValidationError({'heure_fin': "heure_fin must be after heure_debut"})
+        chevauchements = Disponibilite.tous.filter(
+            medecin_id=self.medecin_id, jour_semaine=self.jour_semaine,
+            heure_debut__lt=self.heure_fin, heure_fin__gt=self.heure_debut,
+        ).exclude(pk=self.pk)
+        if chevauchements.exists():
+            raise ValidationError("This medecin already has an overlapping plage on this day")
+
+    def __str__(self):
+        return f'{self.medecin} - {self.get_jour_semaine_display()} {self.heure_debut}-{self.heure_fin}'
+
+
+class RendezVous(models.Model):
+    id_rendez_vous = models.BigAutoField(primary_key=True)
+    medecin = models.ForeignKey(Medecin, on_delete=models.CASCADE, related_name='rendez_vous')
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='rendez_vous')
+    debut = models.DateTimeField()
+    fin = models.DateTimeField()
+    motif = models.CharField(max_length=255, blank=True, default='')
+    date_creation = models.DateTimeField(auto_now_add=True)
+
+    chemin_hopital = 'patient__hopital'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        constraints = [
+            # La réservation est atomique grâce à cette contrainte : deux INSERT
+            # concurrents sur le même créneau, un seul passe
+            models.UniqueConstraint(fields=['medecin', 'debut'], name='rendez_vous_unique_creneau'),
+        ]
+        indexes = [
+            models.Index(fields=['patient', 'debut'], name='rendez_vous_patient_idx'),
+        ]
+
+    def __str__(self):
+        return f'Rendez-vous {self.id_rendez_vous} - {self.medecin} - {self.debut}'
+
+
+# Index inversé de la recherche plein texte (recherche.py) sur Resume et BilanBiologique,
+# mis à jour dans la transaction de chaque écriture.
+# Terme : nombre de documents contenant le terme (pour l'idf).
+class Terme(models.Model):
+    terme = models.CharField(max_length=40, primary_key=True)
+    nb_documents = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.terme} ({self.nb_documents})'
+
+
+class Occurrence(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    terme = models.CharField(max_length=40)
+    ressource = models.CharField(max_length=10)  # resume, bilan
+    objet_id = models.IntegerField()
+    dossier = models.ForeignKey(DossierMedical, on_delete=models.CASCADE, related_name='+')
+    date = models.DateField()
+    poids = models.FloatField()  # Fréquence du terme normalisée par la longueur du document
+
+    chemin_hopital = 'dossier__hopital'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ressource', 'objet_id', 'terme'], name='occurrence_unique'),
+        ]
+        indexes = [
+            # Listes d'occurrences d'un terme, restreintes à un dossier et une période
+            models.Index(fields=['terme', 'dossier', 'date'], name='occurrence_terme_idx'),
+        ]
+
+
+# Outbox des écritures cliniques (Resume, Ordonnance, Traitement, BilanBiologique) :
+# une ligne par écriture, dans la même transaction, lue dans l'ordre de seq par /api/events
+class EvenementClinique(models.Model):
+    CREE = 'cree'
+    MODIFIE = 'modifie'
+    SUPPRIME = 'supprime'
+
+    seq = models.BigAutoField(primary_key=True)
+    type = models.CharField(max_length=50)  # "ordonnance.cree", "bilanbiologique.modifie"...
+    objet_id = models.BigIntegerField()
+    dossier_id = models.BigIntegerField(null=True)
+    hopital_id = models.IntegerField(null=True)  # Hôpital du dossier : /api/events ne lit que celui de l'administratif
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    date = models.DateTimeField(default=timezone.now)
+
+    chemin_hopital = 'hopital_id'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['hopital_id', 'seq'], name='evenement_hopital_seq_idx'),
+        ]
+
+    @classmethod
+    def enregistrer(cls, instance, action, dossier_id=None, hopital_id=None):
+        payload = {field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields}
+        dossier_id = dossier_id if dossier_id is not None else instance.dossier_suivi_id
+        if hopital_id is None:
+            hopital_id = DossierMedical.tous.filter(pk=dossier_id).values_list('hopital_id', flat=True).first()
+        evenement = cls.tous.create(
+            type=f'{instance._meta.model_name}.{action}',
+            objet_id=instance.pk,
+            dossier_id=dossier_id,
+            hopital_id=hopital_id,
+            payload=payload,
+        )
+        # Réveille les lecteurs de /api/events de ce processus dès le commit
+        from .outbox import notifier
+        transaction.on_commit(notifier)
+        return evenement
+
+    def __str__(self):
+        return f'{self.seq} {self.type} {self.objet_id}'
+
+
+# Position de chaque consommateur du flux dans son hôpital, pour compacter les événements
+# de cet hôpital déjà lus par tous ses consommateurs
+class CurseurConsommateur(models.Model):
+    id_curseur = models.AutoField(primary_key=True)
+    hopital_id = models.IntegerField(null=True)  # Hôpital de l'administratif qui acquitte
+    nom = models.CharField(max_length=100)
+    seq = models.BigIntegerField(default=0)
+    date_maj = models.DateTimeField(auto_now=True)
+
+    chemin_hopital = 'hopital_id'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hopital_id', 'nom'], name='curseur_hopital_nom_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.nom}: {self.seq}'
+
+
+# Tombstones des lignes synchronisées par /api/sync (sync.py) : une ligne par suppression,
+# gardée SYNC['RETENTION_JOURS'] jours. Pas de clés étrangères, l'objet n'existe plus.
+class Suppression(models.Model):
+    id_suppression = models.BigAutoField(primary_key=True)
+    ressource = models.CharField(max_length=20)  # patient, dossier, resume, ordonnance, traitement, bilan
+    objet_id = models.BigIntegerField()
+    hopital_id = models.IntegerField(null=True)
+    date = models.DateTimeField(default=timezone.now)
+
+    chemin_hopital = 'hopital_id'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    RESSOURCES = {
+        'Patient': 'patient', 'DossierMedical': 'dossier', 'Resume': 'resume',
+        'Ordonnance': 'ordonnance', 'Traitement': 'traitement', 'BilanBiologique': 'bilan',
+    }
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['hopital_id', 'date'], name='suppression_hopital_date_idx'),
+            models.Index(fields=['date'], name='suppression_date_idx'),
+        ]
+
+    @classmethod
+    def enregistrer(cls, instance, hopital_id):
+        return cls.tous.create(ressource=cls.RESSOURCES[type(instance).__name__], objet_id=instance.pk,
+                               hopital_id=hopital_id)
+
+    def __str__(self):
+        return f'{self.ressource} {self.objet_id} ({self.date})'
+
+
+# Écritures hors ligne déjà appliquées par POST /api/sync : un lot renvoyé après une
+# coupure réseau reçoit le même résultat au lieu de créer les notes une seconde fois
+class OperationSync(models.Model):
+    utilisateur_id = models.IntegerField()
+    hopital_id = models.IntegerField(null=True)
+    operation = models.CharField(max_length=64)  # Identifiant choisi par la tablette (UUID)
+    resultat = models.JSONField(encoder=DjangoJSONEncoder)
+    date = models.DateTimeField(default=timezone.now, db_index=True)
+
+    chemin_hopital = 'hopital_id'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['utilisateur_id', 'operation'], name='operation_sync_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.utilisateur_id} {self.operation}'
+
+
+# Journal des accès aux dossiers (qui a lu / modifié quoi), écrit par lots par audit.py.
+# Pas de clés étrangères : le journal doit survivre à la suppression des lignes auditées.
+class AuditAcces(models.Model):
+    LECTURE = 'lecture'
+    ECRITURE = 'ecriture'
+    ACTIONS = [
+        (LECTURE, 'Lecture'),
+        (ECRITURE, 'Écriture'),
+    ]
+
+    id_audit = models.BigAutoField(primary_key=True)
+    date = models.DateTimeField()
+    utilisateur_id = models.IntegerField(null=True)
+    hopital_id = models.IntegerField(null=True)  # Hôpital de l'utilisateur, /api/audit ne lit que le sien
+    dossier_id = models.BigIntegerField(null=True)
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    ressource = models.CharField(max_length=50)  # ordonnance, resume, bilan, dossier, traitement
+    objet_id = models.BigIntegerField(null=True)
+    adresse_ip = models.GenericIPAddressField(null=True)
+
+    chemin_hopital = 'hopital_id'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['hopital_id', 'date'], name='audit_hopital_date_idx'),
+            models.Index(fields=['dossier_id', 'date'], name='audit_dossier_date_idx'),
+            models.Index(fields=['utilisateur_id', 'date'], name='audit_utilisateur_date_idx'),
+            models.Index(fields=['date'], name='audit_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.date} {self.utilisateur_id} {self.action} {self.ressource} {self.objet_id}'
+
+
+# File de tâches en base de données pour les traitements lents (exécutés par manage.py runworker)
+class Tache(models.Model):
+    EN_ATTENTE = 'en_attente'
+    EN_COURS = 'en_cours'
+    TERMINEE = 'terminee'
+    ECHOUEE = 'echouee'
+    STATUTS = [
+        (EN_ATTENTE, 'En attente'),
+        (EN_COURS, 'En cours'),
+        (TERMINEE, 'Terminée'),
+        (ECHOUEE, 'Échouée'),
+    ]
+
+    id_tache = models.BigAutoField(primary_key=True)
+    nom = models.CharField(max_length=100)  # Nom de la fonction enregistrée dans tasks.py
+    arguments = models.JSONField(default=list)
+    statut = models.CharField(max_length=20, choices=STATUTS, default=EN_ATTENTE)
+    tentatives = models.PositiveIntegerField(default=0)
+    max_tentatives = models.PositiveIntegerField(default=5)
+    executer_apres = models.DateTimeField(default=timezone.now)  # Reporté à chaque nouvel essai (backoff)
+    resultat = models.JSONField(null=True, blank=True)
+    erreur = models.TextField(blank=True, default='')
+    date_creation = models.DateTimeField(auto_now_add=True)
+    date_debut = models.DateTimeField(null=True, blank=True)
+    date_fin = models.DateTimeField(null=True, blank=True)
+    hopital_id = models.IntegerField(null=True)  # Hôpital actif à l'enfilement, réactivé par le worker
+
+    chemin_hopital = 'hopital_id'
+    objects = TenantManager()
+    tous = models.Manager()
+
+    class Meta:
+        indexes = [
+            # Le worker ne lit que les tâches prêtes, dans l'ordre
+            models.Index(fields=['statut', 'executer_apres'], name='tache_prete_idx'),
+        ]
+
+    def __str__(self):
+        return f'Tache {self.id_tache} - {self.nom} ({self.statut})'
+
+
+# Faux pendant l'archivage et le déplacement d'un hôpital (exporter_hopital --supprimer) : les
+# lignes déplacées ne sont pas des suppressions cliniques (ni événement, ni changement des
+# compteurs du dossier, ni pierre tombale pour la synchronisation)
+suivi_suppressions = contextvars.ContextVar('suivi_suppressions', default=True)
+
+
+@receiver(post_delete, sender=Resume)
+@receiver(post_delete, sender=Ordonnance)
+@receiver(post_delete, sender=Traitement)
+@receiver(post_delete, sender=BilanBiologique)
+def apres_suppression(sender, instance, **kwargs):
+    if sender.champs_recherche:
+        # Aussi pendant l'archivage : l'index ne couvre que les tables courantes
+        from .recherche import desindexer
+        desindexer(instance)
+    if not suivi_suppressions.get():
+        return
+    # Les dernières dates ne peuvent pas être décrémentées : on recalcule ce dossier.
+    # creer=False : si le dossier lui-même est en cours de suppression, on n'y touche pas.
+    if sender is Traitement:
+        dossier_id = Ordonnance.tous.filter(pk=instance.ordonnance_id).values_list('dpi_patient_id', flat=True).first()
+    else:
+        dossier_id = instance.dossier_suivi_id
+    if dossier_id is not None:
+        DossierSummary.recalculer([dossier_id], creer=False)
+    from .statistiques import retirer
+    retirer(instance)
+    # Dans une cascade, le dossier est supprimé après son contenu : il existe encore ici
+    hopital_id = DossierMedical.tous.filter(pk=dossier_id).values_list('hopital_id', flat=True).first()
+    if hopital_id is None:
+        hopital_id = hopital_courant()
+    EvenementClinique.enregistrer(instance, EvenementClinique.SUPPRIME, dossier_id, hopital_id)
+    Suppression.enregistrer(instance, hopital_id)
+
+
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=DossierMedical)
+def suppression_synchronisee(sender, instance, **kwargs):
+    if not suivi_suppressions.get():
+        return
+    Suppression.enregistrer(instance, instance.hopital_id)
+
+
+@receiver(post_save, sender=Patient)
+def indexer_doublons(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Pas pour un save(update_fields=[...]) qui ne touche pas aux clés (last_login...)
+    if raw or (update_fields is not None and not {'nom', 'prenom', 'date_naissance', 'hopital'} & set(update_fields)):
+        return
+    from .doublons import indexer
+    indexer(instance)
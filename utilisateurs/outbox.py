@@ -0,0 +1,190 @@
+import asyncio
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .asynchrone import base
+from .models import EvenementClinique
+from .tenancy import activer
+
+# Lecture du flux d'événements cliniques (outbox EvenementClinique) dans l'ordre de seq.
+# Une lecture est un parcours de la clé primaire à partir de `after`.
+#
+# Un seq peut être attribué par une transaction qui n'a pas encore commité : tant qu'un
+# trou récent existe dans la séquence, le lot s'arrête avant lui pour ne jamais livrer
+# un événement plus récent qu'un autre encore invisible. Un trou vu depuis GAP_TIMEOUT
+# secondes par ce processus est considéré comme une transaction annulée. L'âge compte à
+# partir de la première observation et pas de la date de l'événement suivant, prise avant
+# son INSERT : une transaction longue le rend visible déjà « vieux ». Un trou suivi d'un
+# événement de plus de GAP_MAX_AGE secondes est clos d'office (rattrapage d'un vieil
+# historique, processus redémarré, événements compactés).
+
+EVENTS = {
+    'BATCH_SIZE': 500,
+    'POLL_INTERVAL': 0.2,    # secondes entre deux lectures quand rien n'est arrivé
+    'MAX_WAIT': 25,          # durée maximale d'un long-poll
+    'GAP_TIMEOUT': 5,        # secondes
+    'GAP_MAX_AGE': 3600,     # secondes, plus long que toute transaction
+    **getattr(settings, 'EVENTS', {}),
+}
+
+_nouveaux = threading.Condition()
+# Fonctions appelées à chaque commit d'événements (ex. réveil de la boucle asyncio de realtime.py)
+abonnes = []
+
+
+def notifier():
+    with _nouveaux:
+        _nouveaux.notify_all()
+    for abonne in abonnes:
+        abonne()
+
+
+def attendre(timeout):
+    with _nouveaux:
+        _nouveaux.wait(timeout)
+
+
+class Trous:
+    # Première observation de chaque trou par ce processus, clé : premier seq manquant
+
+    def __init__(self, taille=10000):
+        self.vus = OrderedDict()
+        self.taille = taille
+        self.lock = threading.Lock()
+
+    def ouvert(self, manquant, date_suivant, timeout, age_max):
+        # True tant que le trou peut encore se remplir
+        if date_suivant < timezone.now() - timedelta(seconds=age_max):
+            return False
+        maintenant = time.monotonic()
+        with self.lock:
+            vu = self.vus.setdefault(manquant, maintenant)
+            if len(self.vus) > self.taille:
+                self.vus.popitem(last=False)
+        return maintenant - vu < timeout
+
+
+trous = Trous()
+
+
+def horizon(after, limit):
+    # Dernier seq livrable après `after`. Les trous sont cherchés dans la séquence de tous les
+    # hôpitaux : les événements des autres hôpitaux ne sont pas des trous.
+    seqs = list(EvenementClinique.tous.filter(seq__gt=after).order_by('seq').values_list('seq', 'date')[:limit])
+    dernier = after
+    for seq, date in seqs:
+        if seq != dernier + 1 and trous.ouvert(dernier + 1, date, EVENTS['GAP_TIMEOUT'], EVENTS['GAP_MAX_AGE']):
+            break
+        dernier = seq
+    return dernier
+
+
+def lire(after, limit=None):
+    # (événements de l'hôpital actif, curseur) ; le curseur avance aussi sur les événements
+    # des autres hôpitaux, à renvoyer comme `after` à la lecture suivante
+    limit = min(limit or EVENTS['BATCH_SIZE'], EVENTS['BATCH_SIZE'])
+    curseur = horizon(after, limit)
+    if curseur == after:
+        return [], after
+    return list(EvenementClinique.objects.filter(seq__gt=after, seq__lte=curseur).order_by('seq')), curseur
+
+
+def long_poll(after, limit=None, wait=0):
+    # (événements, curseur) dès qu'il y a au moins un événement, ou après `wait` secondes
+    fin = time.monotonic() + min(wait, EVENTS['MAX_WAIT'])
+    while True:
+        evenements, curseur = lire(after, limit)
+        restant = fin - time.monotonic()
+        if evenements or restant <= 0:
+            return evenements, curseur
+        if curseur == after:
+            attendre(min(EVENTS['POLL_INTERVAL'], restant))
+        after = curseur
+
+
+async def long_poll_async(after, hopital_id=None, limit=None, wait=0):
+    # long_poll pour les serveurs ASGI : lectures dans un thread, attente sur la boucle
+    boucle = asyncio.get_running_loop()
+    reveil = asyncio.Event()
+
+    def notifier():
+        # Appelé depuis le thread qui a commité
+        try:
+            boucle.call_soon_threadsafe(reveil.set)
+        except RuntimeError:
+            pass  # Boucle fermée
+
+    fin = time.monotonic() + min(wait, EVENTS['MAX_WAIT'])
+    abonnes.append(notifier)
+    try:
+        while True:
+            reveil.clear()
+            evenements, curseur = await base(functools.partial(lire_hopital, hopital_id, after, limit))()
+            restant = fin - time.monotonic()
+            if evenements or restant <= 0:
+                return evenements, curseur
+            if curseur == after:
+                try:
+                    await asyncio.wait_for(reveil.wait(), min(EVENTS['POLL_INTERVAL'], restant))
+                except asyncio.TimeoutError:
+                    pass
+            after = curseur
+    finally:
+        abonnes.remove(notifier)
+
+
+def lire_hopital(hopital_id, after, limit=None):
+    with activer(hopital_id):
+        return lire(after, limit)
+
+
+def en_dict(evenement):
+    return {
+        "seq": evenement.seq,
+        "type": evenement.type,
+        "objet_id": evenement.objet_id,
+        "dossier_id": evenement.dossier_id,
+        "payload": evenement.payload,
+        "date": evenement.date.isoformat(),
+    }
+
+
+def trames(evenements, after, curseur):
+    for evenement in evenements:
+        yield f'id: {evenement.seq}\nevent: {evenement.type}\ndata: {json.dumps(en_dict(evenement))}\n\n'
+    if not evenements:
+        # Sans données, l'id met quand même à jour le Last-Event-ID du client
+        yield f'id: {curseur}\n: keep-alive\n\n' if curseur != after else ': keep-alive\n\n'
+
+
+def sse(after, hopital_id=None, duree=None):
+    # Flux Server-Sent Events : "id: <seq>" permet au client de reprendre avec Last-Event-ID.
+    # Consommé après la sortie de HopitalMiddleware : l'hôpital est réactivé à chaque lecture.
+    fin = time.monotonic() + (duree or EVENTS['MAX_WAIT'])
+    yield 'retry: 1000\n\n'
+    while time.monotonic() < fin:
+        close_old_connections()
+        with activer(hopital_id):
+            evenements, curseur = long_poll(after, wait=min(EVENTS['MAX_WAIT'], fin - time.monotonic()))
+        yield from trames(evenements, after, curseur)
+        after = curseur
+
+
+async def sse_async(after, hopital_id=None, duree=None):
+    # Même flux sous ASGI, où StreamingHttpResponse lirait un itérateur synchrone en entier
+    # avant d'envoyer le premier octet
+    fin = time.monotonic() + (duree or EVENTS['MAX_WAIT'])
+    yield 'retry: 1000\n\n'
+    while time.monotonic() < fin:
+        evenements, curseur = await long_poll_async(after, hopital_id, wait=min(EVENTS['MAX_WAIT'], fin - time.monotonic()))
+        for trame in trames(evenements, after, curseur):
+            yield trame
+        after = curseur
@@ -0,0 +1,404 @@
+import functools
+import unicodedata
+import zlib
+
+import qrcode
+
+# Rendu PDF des ordonnances et des comptes rendus de dossier, sans bibliothèque PDF :
+# PDF 1.4, polices standard Helvetica (WinAnsi, donc les accents français), QR code du
+# patient en image 1 bit. Ce module ne touche pas à la base (voir impression.py) pour
+# pouvoir tourner dans les processus du pool d'impression.
+#
+# Chaque mise en page (GABARITS) est compilée une fois par processus : bandeaux, filets
+# et libellés fixes sont encodés en octets de flux de contenu, seuls les champs variables
+# et le corps sont produits pour chaque document.
+
+A4 = (595, 842)
+MARGE = 50
+BAS = 60  # Le corps s'arrête au-dessus du pied de page
+
+POLICES = {'F1': 'Helvetica', 'F2': 'Helvetica-Bold'}
+
+# Chasses Helvetica (AFM, millièmes d'em) des caractères 32 à 126
+LARGEURS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+
+# Mises en page : éléments fixes, emplacement des champs (police, taille, x, y),
+# QR code (x, y, côté) et haut du corps
+GABARITS = {
+    'ordonnance': {
+        'fixe': [
+            ('bande', 0, 762, 595, 80),
+            ('texte', 'F2', 22, MARGE, 800, 'ORDONNANCE'),
+            ('texte', 'F1', 8, MARGE, 728, 'PRESCRIPTEUR'),
+            ('texte', 'F1', 8, 300, 728, 'PATIENT'),
+            ('filet', MARGE, 650, 545, 650),
+            ('texte', 'F2', 9, MARGE, 632, 'Médicament'),
+            ('texte', 'F2', 9, 300, 632, 'Posologie'),
+            ('texte', 'F2', 9, 430, 632, 'Durée'),
+            ('filet', MARGE, 624, 545, 624),
+            ('filet', 350, 110, 545, 110),
+            ('texte', 'F1', 8, 350, 98, 'Signature du prescripteur'),
+        ],
+        'champs': {
+            'hopital': ('F1', 10, MARGE, 778),
+            'reference': ('F1', 10, 350, 800),
+            'medecin': ('F2', 11, MARGE, 712),
+            'specialite': ('F1', 10, MARGE, 698),
+            'date': ('F1', 10, MARGE, 684),
+            'patient': ('F2', 11, 300, 712),
+            'naissance': ('F1', 10, 300, 698),
+            'nss': ('F1', 10, 300, 684),
+        },
+        'qr': (475, 665, 70),
+        'corps': 606,
+    },
+    'dossier': {
+        'fixe': [
+            ('bande', 0, 762, 595, 80),
+            ('texte', 'F2', 20, MARGE, 800, 'COMPTE RENDU DE DOSSIER'),
+            ('texte', 'F1', 8, MARGE, 728, 'PATIENT'),
+            ('filet', MARGE, 650, 545, 650),
+        ],
+        'champs': {
+            'hopital': ('F1', 10, MARGE, 778),
+            'reference': ('F1', 10, 400, 778),
+            'patient': ('F2', 12, MARGE, 712),
+            'naissance': ('F1', 10, MARGE, 698),
+            'nss': ('F1', 10, MARGE, 684),
+            'cloture': ('F1', 10, MARGE, 670),
+        },
+        'qr': (475, 665, 70),
+        'corps': 628,
+    },
+    # Pages suivantes d'un document trop long pour une page
+    'suite': {
+        'fixe': [
+            ('filet', MARGE, 790, 545, 790),
+        ],
+        'champs': {
+            'titre': ('F2', 9, MARGE, 800),
+            'reference': ('F1', 9, 400, 800),
+        },
+        'qr': None,
+        'corps': 770,
+    },
+}
+
+
+@functools.lru_cache(maxsize=None)
+def chasse(caractere):
+    code = ord(caractere)
+    if not 32 <= code < 127:
+        base = unicodedata.normalize('NFKD', caractere)[:1]  # é -> e
+        code = ord(base) if base else 0
+    return LARGEURS[code - 32] if 32 <= code < 127 else 556
+
+
+def largeur(texte, taille):
+    return sum(map(chasse, texte)) * taille / 1000
+
+
+def couper(texte, taille, largeur_max):
+    # Découpe en lignes qui tiennent dans largeur_max, aux espaces (ou au milieu d'un mot trop long)
+    espace = largeur(' ', taille)
+    lignes = []
+    for paragraphe in str(texte or '').splitlines() or ['']:
+        courante, occupe = '', 0
+        for mot in paragraphe.split(' '):
+            taille_mot = largeur(mot, taille)
+            if courante and occupe + espace + taille_mot <= largeur_max:
+                courante, occupe = f'{courante} {mot}', occupe + espace + taille_mot
+                continue
+            if courante:
+                lignes.append(courante)
+            while taille_mot > largeur_max:
+                coupe = len(mot) - 1
+                while coupe > 1 and largeur(mot[:coupe], taille) > largeur_max:
+                    coupe -= 1
+                lignes.append(mot[:coupe])
+                mot = mot[coupe:]
+                taille_mot = largeur(mot, taille)
+            courante, occupe = mot, taille_mot
+        lignes.append(courante)
+    return lignes
+
+
+def chaine(texte):
+    octets = str(texte).encode('cp1252', errors='replace')
+    return b'(' + octets.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def op_texte(police, taille, x, y, texte):
+    return b'BT /%s %d Tf %.2f %.2f Td %s Tj ET\n' % (police.encode(), taille, x, y, chaine(texte))
+
+
+def op_filet(x1, y1, x2, y2):
+    return b'0.6 G 0.5 w %.2f %.2f m %.2f %.2f l S 0 G\n' % (x1, y1, x2, y2)
+
+
+def op_bande(x, y, l, h):
+    return b'0.92 g %.2f %.2f %.2f %.2f re f 0 g\n' % (x, y, l, h)
+
+
+class Gabarit:
+    """A compiled layout: the fixed drawing as content-stream bytes, and the slots of the variable fields."""
+
+    def __init__(self, definition):
+        fixe = []
+        for element in definition['fixe']:
+            if element[0] == 'texte':
+                fixe.append(op_texte(*element[1:]))
+            elif element[0] == 'filet':
+                fixe.append(op_filet(*element[1:]))
+            else:
+                fixe.append(op_bande(*element[1:]))
+        self.fixe = b''.join(fixe)
+        self.champs = definition['champs']
+        self.qr = definition['qr']
+        self.corps = definition['corps']
+
+    def remplir(self, valeurs):
+        contenu = [self.fixe]
+        for nom, valeur in valeurs.items():
+            if valeur:
+                contenu.append(op_texte(*self.champs[nom], valeur))
+        return contenu
+
+
+@functools.lru_cache(maxsize=None)
+def gabarit(nom):
+    return Gabarit(GABARITS[nom])
+
+
+def precompiler():
+    # Initialisation des processus du pool : les gabarits sont prêts avant le premier document
+    for nom in GABARITS:
+        gabarit(nom)
+
+
+@functools.lru_cache(maxsize=4096)
+def image_qr(texte):
+    # (côté en modules, pixels 1 bit compressés), un module sombre = bit à 1
+    code = qrcode.QRCode(border=1)
+    code.add_data(texte)
+    code.make(fit=True)
+    matrice = code.get_matrix()
+    lignes = bytearray()
+    for rangee in matrice:
+        for debut in range(0, len(rangee), 8):
+            octet = 0
+            for i, sombre in enumerate(rangee[debut:debut + 8]):
+                if sombre:
+                    octet |= 0x80 >> i
+            lignes.append(octet)
+    return len(matrice), zlib.compress(bytes(lignes))
+
+
+class Mise:
+    """Lays a document out page by page: fixed layout, fields, then flowing body lines."""
+
+    def __init__(self, nom, valeurs, qr=None, titre=''):
+        self.titre = titre
+        self.reference = valeurs.get('reference', '')
+        self.pages = []
+        self.nouvelle_page(nom, valeurs, qr)
+
+    def nouvelle_page(self, nom, valeurs, qr=None):
+        modele = gabarit(nom)
+        self.contenu = modele.remplir(valeurs)
+        self.images = []
+        if qr and modele.qr:
+            x, y, cote = modele.qr
+            self.images.append(image_qr(qr))
+            self.contenu.append(b'q %d 0 0 %d %d %d cm /Im0 Do Q\n' % (cote, cote, x, y))
+        self.y = modele.corps
+        self.pages.append((self.contenu, self.images))
+
+    def place(self, hauteur):
+        if self.y - hauteur < BAS:
+            self.nouvelle_page('suite', {'titre': self.titre, 'reference': self.reference})
+
+    def ligne(self, texte, police='F1', taille=10, x=MARGE, interligne=None):
+        interligne = interligne or taille * 1.35
+        self.place(interligne)
+        self.y -= interligne
+        self.contenu.append(op_texte(police, taille, x, self.y, texte))
+
+    def colonnes(self, cellules, taille=10, police='F1'):
+        # cellules : [(x, largeur, texte)], la rangée prend la hauteur de sa plus longue cellule
+        coupees = [(x, couper(texte, taille, l)) for x, l, texte in cellules]
+        hauteur = max(len(lignes) for x, lignes in coupees)
+        interligne = taille * 1.35
+        self.place(hauteur * interligne)
+        for x, lignes in coupees:
+            for i, texte in enumerate(lignes):
+                self.contenu.append(op_texte(police, taille, x, self.y - (i + 1) * interligne, texte))
+        self.y -= hauteur * interligne
+
+    def paragraphe(self, texte, taille=10, x=MARGE + 10):
+        for ligne in couper(texte, taille, A4[0] - MARGE - x):
+            self.ligne(ligne, taille=taille, x=x)
+
+    def titre_section(self, texte):
+        self.place(40)
+        self.y -= 14
+        self.ligne(texte, police='F2', taille=12)
+        self.contenu.append(op_filet(MARGE, self.y - 4, A4[0] - MARGE, self.y - 4))
+        self.y -= 6
+
+    def terminer(self):
+        # Pied de page et compression des flux : fait dans le processus qui rend le document
+        total = len(self.pages)
+        pages = []
+        for numero, (contenu, images) in enumerate(self.pages, 1):
+            contenu.append(op_texte('F1', 8, A4[0] - MARGE - 40, 30, f'Page {numero} / {total}'))
+            pages.append((zlib.compress(b''.join(contenu), 6), tuple(images)))
+        return pages
+
+
+def lignes_traitement(mise, lignes):
+    for ligne in lignes:
+        medicament = ' '.join(filter(None, [ligne['medicament'], ligne['dosage'], ligne['forme']]))
+        mise.colonnes([
+            (MARGE, 240, medicament),
+            (300, 120, f"{ligne['quantite']} / jour"),
+            (430, 115, ligne['duree']),
+        ])
+        if ligne['description']:
+            mise.ligne(ligne['description'], taille=9, x=MARGE + 10)
+        mise.y -= 4
+
+
+def rendre_ordonnance(document):
+    mise = Mise('ordonnance', {
+        'hopital': document['hopital'],
+        'reference': f"Ordonnance n° {document['id']}",
+        'medecin': document['medecin'],
+        'specialite': document['specialite'],
+        'date': f"Le {document['date']}",
+        'patient': document['patient'],
+        'naissance': f"Né(e) le {document['naissance']}",
+        'nss': f"NSS {document['nss']}",
+    }, qr=document['nss'], titre=f"Ordonnance - {document['patient']}")
+    lignes_traitement(mise, document['lignes'])
+    return mise.terminer()
+
+
+def rendre_dossier(document):
+    mise = Mise('dossier', {
+        'hopital': document['hopital'],
+        'reference': f"Dossier n° {document['id']} - {document['edition']}",
+        'patient': document['patient'],
+        'naissance': f"Né(e) le {document['naissance']}",
+        'nss': f"NSS {document['nss']}",
+        'cloture': f"Clôturé le {document['cloture']}" if document['cloture'] else '',
+    }, qr=document['nss'], titre=f"Compte rendu - {document['patient']}")
+
+    mise.titre_section(f"Consultations ({len(document['consultations'])})")
+    for consultation in document['consultations']:
+        mise.ligne(f"{consultation['date']} - {consultation['medecin']}", police='F2', taille=10)
+        mise.paragraphe(consultation['description'])
+    mise.titre_section(f"Ordonnances ({len(document['ordonnances'])})")
+    for ordonnance in document['ordonnances']:
+        mise.ligne(f"{ordonnance['date']} - {ordonnance['medecin']}", police='F2', taille=10)
+        lignes_traitement(mise, ordonnance['lignes'])
+    mise.titre_section(f"Bilans biologiques ({len(document['bilans'])})")
+    for bilan in document['bilans']:
+        mise.ligne(str(bilan['date']), police='F2', taille=10)
+        mise.paragraphe(bilan['result'])
+        if bilan['description']:
+            mise.paragraphe(bilan['description'], taille=9)
+    return mise.terminer()
+
+
+RENDUS = {'ordonnance': rendre_ordonnance, 'dossier': rendre_dossier}
+
+
+def rendre(document):
+    # Pages d'un document : [(flux compressé, images QR)], à assembler par EcriturePDF
+    return RENDUS[document['type']](document)
+
+
+def assembler(pages):
+    # PDF complet d'un seul document
+    ecriture = EcriturePDF()
+    return b''.join([ecriture.entete(), *(ecriture.page(*page) for page in pages), ecriture.fin()])
+
+
+class EcriturePDF:
+    """
+    Writes a PDF incrementally, so a batch can be streamed as its documents are
+    rendered: catalog and fonts first, then each page with its own objects, and
+    the page tree, cross-reference table and trailer at the end.
+    """
+    CATALOGUE, PAGES = 1, 2
+
+    def __init__(self):
+        self.position = 0
+        self.offsets = {}
+        self.kids = []
+        self.suivant = 3 + len(POLICES)
+
+    def objet(self, numero, corps, flux=None):
+        self.offsets[numero] = self.position
+        octets = b'%d 0 obj\n' % numero + corps
+        if flux is not None:
+            octets += b'\nstream\n' + flux + b'\nendstream'
+        octets += b'\nendobj\n'
+        self.position += len(octets)
+        return octets
+
+    def allouer(self):
+        numero = self.suivant
+        self.suivant += 1
+        return numero
+
+    def entete(self):
+        octets = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        self.position = len(octets)
+        polices = b''.join(b'/%s %d 0 R ' % (nom.encode(), 3 + i) for i, nom in enumerate(POLICES))
+        self.ressources = b'/Font << ' + polices + b'>>'
+        morceaux = [octets, self.objet(self.CATALOGUE, b'<< /Type /Catalog /Pages 2 0 R >>')]
+        for i, police in enumerate(POLICES.values()):
+            morceaux.append(self.objet(3 + i, b'<< /Type /Font /Subtype /Type1 /BaseFont /%s '
+                                              b'/Encoding /WinAnsiEncoding >>' % police.encode()))
+        return b''.join(morceaux)
+
+    def page(self, flux, images=()):
+        morceaux = []
+        xobjets = b''
+        if images:
+            references = []
+            for i, (cote, pixels) in enumerate(images):
+                numero = self.allouer()
+                morceaux.append(self.objet(numero, b'<< /Type /XObject /Subtype /Image /Width %d /Height %d '
+                                                   b'/ColorSpace /DeviceGray /BitsPerComponent 1 /Decode [1 0] '
+                                                   b'/Filter /FlateDecode /Length %d >>' % (cote, cote, len(pixels)),
+                                           pixels))
+                references.append(b'/Im%d %d 0 R' % (i, numero))
+            xobjets = b' /XObject << ' + b' '.join(references) + b' >>'
+        contenu = self.allouer()
+        morceaux.append(self.objet(contenu, b'<< /Length %d /Filter /FlateDecode >>' % len(flux), flux))
+        page = self.allouer()
+        morceaux.append(self.objet(page, b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R '
+                                         b'/Resources << %s%s >> >>' % (A4[0], A4[1], contenu, self.ressources, xobjets)))
+        self.kids.append(page)
+        return b''.join(morceaux)
+
+    def fin(self):
+        kids = b' '.join(b'%d 0 R' % kid for kid in self.kids)
+        octets = self.objet(self.PAGES, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self.kids)))
+        xref = self.position
+        taille = self.suivant
+        lignes = [b'xref\n0 %d\n' % taille, b'0000000000 65535 f\r\n']
+        for numero in range(1, taille):
+            lignes.append(b'%010d 00000 n\r\n' % self.offsets[numero])
+        lignes.append(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (taille, xref))
+        return octets + b''.join(lignes)
@@ -0,0 +1,100 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Q, Value, When
+
+from .durees import duree_en_jours
+from .models import Dispensation, LigneDispensation, Stock
+from .tenancy import hopital_courant
+
+# Dispensation des ordonnances par la pharmacie (SGPH).
+# Tout le stock d'une ordonnance est décrémenté en un seul UPDATE conditionnel :
+#   UPDATE stock SET quantite = quantite - CASE medicament WHEN .. THEN .. END
+#   WHERE (medicament = a AND quantite >= qa) OR (medicament = b AND quantite >= qb) ...
+# Si une ligne manque de stock, l'UPDATE touche moins de lignes que prévu et la
+# transaction est annulée. Deux dispensations concurrentes du même médicament
+# se sérialisent sur la ligne le temps de l'UPDATE, sans lecture préalable.
+
+
+class DispensationImpossible(Exception):
+    def __init__(self, message, manquants=None):
+        super().__init__(message)
+        self.manquants = manquants or []
+
+
+def besoins_ordonnance(ordonnance):
+    # Unités à délivrer par médicament : quantité par jour x nombre de jours
+    besoins = defaultdict(int)
+    for medicament_id, quantite, duree in ordonnance.medicaments.values_list('medicament_id', 'quantite', 'duree'):
+        besoins[medicament_id] += quantite * (duree_en_jours(duree) or 1)
+    return dict(besoins)
+
+
+def stocks():
+    # Stock de la pharmacie de l'hôpital actif, explicitement : sans hôpital actif TenantManager
+    # ne filtrerait pas et un médicament aurait une ligne par hôpital
+    return Stock.tous.filter(hopital_id=hopital_courant() or 0)
+
+
+def decrementer(besoins):
+    # True si toutes les lignes ont été décrémentées
+    if not besoins:
+        return True
+    condition = Q()
+    for medicament_id, quantite in besoins.items():
+        condition |= Q(medicament_id=medicament_id, quantite__gte=quantite)
+    retrait = Case(*(When(medicament_id=medicament_id, then=Value(quantite)) for medicament_id, quantite in besoins.items()))
+    return stocks().filter(condition).update(quantite=F('quantite') - retrait) == len(besoins)
+
+
+def manquants(besoins):
+    disponibles = dict(stocks().filter(medicament__in=besoins).values_list('medicament_id', 'quantite'))
+    return [
+        {"medicament": medicament_id, "demande": quantite, "disponible": disponibles.get(medicament_id, 0)}
+        for medicament_id, quantite in besoins.items()
+        if disponibles.get(medicament_id, 0) < quantite
+    ]
+
+
+class StockInsuffisant(Exception):
+    pass
+
+
+def creer_dispensation(ordonnance, sgph):
+    try:
+        with transaction.atomic():
+            return Dispensation.objects.create(ordonnance=ordonnance, sgph=sgph)
+    except IntegrityError:
+        # Dispensation.ordonnance est unique : déjà dispensée, éventuellement par un SGPH en même temps
+        if not Dispensation.objects.filter(ordonnance_id=ordonnance.pk).exists():
+            raise
+        raise DispensationImpossible('This ordonnance was already dispensed')
+
+
+def dispenser(ordonnance, sgph, besoins=None):
+    besoins = besoins if besoins is not None else besoins_ordonnance(ordonnance)
+    try:
+        with transaction.atomic():
+            dispensation = creer_dispensation(ordonnance, sgph)
+            if not decrementer(besoins):
+                raise StockInsuffisant
+            LigneDispensation.objects.bulk_create(
+                LigneDispensation(dispensation=dispensation, medicament_id=medicament_id, quantite=quantite)
+                for medicament_id, quantite in besoins.items()
+            )
+    except StockInsuffisant:
+        # Lu après l'annulation de la transaction, donc sur le stock réel
+        raise DispensationImpossible('Insufficient stock', manquants(besoins))
+    return dispensation
+
+
+def reapprovisionner(medicament_id, quantite):
+    Stock.tous.get_or_create(hopital_id=hopital_courant() or 0, medicament_id=medicament_id)
+    stocks().filter(medicament_id=medicament_id).update(quantite=F('quantite') + quantite)
+
+
+def stocks_bas():
+    # Même expression que l'index stock_marge_idx
+    return (stocks().alias(marge=F('quantite') - F('seuil_alerte'))
+            .filter(marge__lte=0)
+            .select_related('medicament'))
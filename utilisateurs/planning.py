@@ -0,0 +1,115 @@
+import bisect
+from datetime import datetime, timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Disponibilite, Medecin, RendezVous
+
+# Prise de rendez-vous. Pour chaque médecin, les rendez-vous d'une période sont
+# chargés par une requête sur l'index (medecin, debut) et rangés dans deux tableaux
+# triés (débuts, fins) : un test de chevauchement est une recherche dichotomique.
+# La réservation verrouille la ligne du médecin (SELECT ... FOR UPDATE) le temps de la
+# vérification et de l'insertion : deux réservations du même médecin se sérialisent, même
+# pour des créneaux qui se chevauchent sans commencer à la même heure. La contrainte
+# unique (medecin, debut) reste le dernier garde-fou.
+
+
+class CreneauIndisponible(Exception):
+    pass
+
+
+class Agenda:
+    # Intervalles [debut, fin) sans chevauchement, triés par début
+    def __init__(self, intervalles=()):
+        self.debuts = []
+        self.fins = []
+        for debut, fin in sorted(intervalles):
+            self.debuts.append(debut)
+            self.fins.append(fin)
+
+    def est_libre(self, debut, fin):
+        i = bisect.bisect_right(self.debuts, debut)
+        if i > 0 and self.fins[i - 1] > debut:
+            return False
+        if i < len(self.debuts) and self.debuts[i] < fin:
+            return False
+        return True
+
+    def ajouter(self, debut, fin):
+        i = bisect.bisect_right(self.debuts, debut)
+        self.debuts.insert(i, debut)
+        self.fins.insert(i, fin)
+
+    def __len__(self):
+        return len(self.debuts)
+
+
+def creneaux(disponibilite, jour):
+    # Créneaux (debut, fin) d'une plage de disponibilité pour une date donnée
+    pas = timedelta(minutes=disponibilite.duree_creneau)
+    debut = timezone.make_aware(datetime.combine(jour, disponibilite.heure_debut))
+    limite = timezone.make_aware(datetime.combine(jour, disponibilite.heure_fin))
+    while debut + pas <= limite:
+        yield debut, debut + pas
+        debut += pas
+
+
+def journee(jour):
+    debut = timezone.make_aware(datetime.combine(jour, datetime.min.time()))
+    return debut, debut + timedelta(days=1)
+
+
+def agendas(medecin_ids, debut, fin):
+    # Un Agenda par médecin, en une requête
+    par_medecin = {medecin_id: [] for medecin_id in medecin_ids}
+    rendez_vous = (RendezVous.objects
+                   .filter(medecin__in=medecin_ids, debut__lt=fin, fin__gt=debut)
+                   .values_list('medecin_id', 'debut', 'fin'))
+    for medecin_id, rdv_debut, rdv_fin in rendez_vous:
+        par_medecin[medecin_id].append((rdv_debut, rdv_fin))
+    return {medecin_id: Agenda(intervalles) for medecin_id, intervalles in par_medecin.items()}
+
+
+def creneaux_libres(specialite, jour, limite=None):
+    # Créneaux libres d'une journée pour tous les médecins d'une spécialité
+    medecins = dict(Medecin.objects.filter(specialite=specialite).values_list('id_utilisateur', 'nom'))
+    disponibilites = Disponibilite.objects.filter(medecin__in=medecins, jour_semaine=jour.weekday())
+    occupes = agendas(medecins, *journee(jour))
+    maintenant = timezone.now()
+
+    libres = []
+    for disponibilite in disponibilites:
+        agenda = occupes[disponibilite.medecin_id]
+        for debut, fin in creneaux(disponibilite, jour):
+            if debut >= maintenant and agenda.est_libre(debut, fin):
+                libres.append({
+                    "medecin": disponibilite.medecin_id,
+                    "nom": medecins[disponibilite.medecin_id],
+                    "debut": debut,
+                    "fin": fin,
+                })
+    libres.sort(key=lambda creneau: (creneau['debut'], creneau['medecin']))
+    return libres[:limite] if limite else libres
+
+
+def reserver(medecin_id, patient_id, debut, motif=''):
+    debut = timezone.localtime(debut)
+    try:
+        with transaction.atomic():
+            if Medecin.tous.select_for_update().filter(pk=medecin_id).values_list('pk', flat=True).first() is None:
+                raise CreneauIndisponible('Medecin not found')
+            # Le créneau doit appartenir à une plage du médecin
+            for disponibilite in Disponibilite.objects.filter(medecin=medecin_id, jour_semaine=debut.weekday()):
+                fin = next((fin for creneau_debut, fin in creneaux(disponibilite, debut.date()) if creneau_debut == debut), None)
+                if fin is not None:
+                    break
+            else:
+                raise CreneauIndisponible("This slot is not in the medecin's availability")
+
+            if not agendas([medecin_id], debut, fin)[medecin_id].est_libre(debut, fin):
+                raise CreneauIndisponible('This slot is already booked')
+            return RendezVous.objects.create(medecin_id=medecin_id, patient_id=patient_id, debut=debut, fin=fin, motif=motif)
+    except IntegrityError:
+        # Réservé entre-temps par une autre requête
+        raise CreneauIndisponible('This slot is already booked')
@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+
+from .models import Administratif, Hopital, Infirmier, Laborantin, Medecin, Radiologue, Utilisateur
+from .tenancy import hopital_courant
+
+# Création du personnel par lots (POST /api/personnel, manage.py provisionner_personnel).
+#
+# Les emails du lot sont vérifiés en une requête IN, les mots de passe hachés dans un pool de
+# processus (PBKDF2 : plusieurs centaines de ms par mot de passe, un cœur chacun), puis les
+# lignes insérées par table : bulk_create des lignes utilisateur, relecture de leurs clés
+# par email (MySQL ne les renvoie pas), executemany dans la table de chaque type. Le lot est
+# créé entièrement ou pas du tout.
+
+PROVISIONNEMENT = {
+    'MAX_COMPTES': 2000,
+    'SEUIL_POOL': 8,      # en dessous, hachage dans le processus de la requête
+    'PROCESSUS': 0,       # 0 : un par cœur
+    **getattr(settings, 'PROVISIONNEMENT', {}),
+}
+
+# Types de RegisterView : 0 admin / 1 medecin / 2 radiologue / 3 laborantin / 4 infirmier
+TYPES = {0: Administratif, 1: Medecin, 2: Radiologue, 3: Laborantin, 4: Infirmier}
+
+
+def erreurs_par_index(erreurs):
+    # serializer.errors avec many=True : liste alignée sur les entrées, ou dict {index: erreurs} (DRF >= 3.15)
+    paires = erreurs.items() if isinstance(erreurs, dict) else enumerate(erreurs)
+    return {int(i): e for i, e in paires if e}
+
+
+def verifier_emails(comptes):
+    # {index: message} des emails répétés dans le lot ou déjà utilisés (une requête)
+    erreurs = {}
+    vus = {}
+    for i, compte in enumerate(comptes):
+        email = compte['email'].lower()
+        if email in vus:
+            erreurs[i] = f"Duplicate of entry {vus[email]} in this batch"
+        vus.setdefault(email, i)
+    existants = {email.lower() for email in
+                 Utilisateur.tous.filter(email__in=[compte['email'] for compte in comptes]).values_list('email', flat=True)}
+    for i, compte in enumerate(comptes):
+        if compte['email'].lower() in existants:
+            erreurs[i] = 'A user with this email already exists'
+    return erreurs
+
+
+def hopitaux(comptes):
+    # code -> id, une requête ; KeyError sur le code inconnu
+    codes = {compte['hopital'] for compte in comptes if compte.get('hopital')}
+    trouves = dict(Hopital.objects.filter(code__in=codes).values_list('code', 'pk'))
+    inconnus = codes - set(trouves)
+    if inconnus:
+        raise KeyError(', '.join(sorted(inconnus)))
+    return trouves
+
+
+def hors_perimetre(comptes, hopital_id):
+    # {index: message} des comptes d'un autre hôpital que hopital_id (None : administratif sans hôpital, tout permis)
+    if hopital_id is None:
+        return {}
+    par_code = hopitaux(comptes)
+    return {i: 'Accounts can only be created in your own hopital' for i, compte in enumerate(comptes)
+            if compte.get('hopital') and par_code[compte['hopital']] != hopital_id}
+
+
+def hacher(mots_de_passe, processus=None):
+    # make_password de chaque mot de passe, dans l'ordre ; '' (connexion impossible) si absent
+    a_hacher = [mot for mot in mots_de_passe if mot]
+    processus = processus or PROVISIONNEMENT['PROCESSUS'] or os.cpu_count()
+    if len(a_hacher) < PROVISIONNEMENT['SEUIL_POOL'] or processus == 1:
+        hashes = [make_password(mot) for mot in a_hacher]
+    else:
+        executeur = ProcessPoolExecutor(max_workers=min(processus, len(a_hacher)),
+                                        mp_context=multiprocessing.get_context('forkserver'),
+                                        initializer=django.setup)
+        with executeur:
+            hashes = list(executeur.map(make_password, a_hacher, chunksize=max(1, len(a_hacher) // (processus * 4))))
+    hashes = iter(hashes)
+    return [next(hashes) if mot else '' for mot in mots_de_passe]
+
+
+def inserer_enfants(modele, lignes):
+    # bulk_create refuse les modèles hérités : lignes de la table du type insérées directement
+    champs = modele._meta.local_concrete_fields
+    table = connection.ops.quote_name(modele._meta.db_table)
+    colonnes = ', '.join(connection.ops.quote_name(champ.column) for champ in champs)
+    valeurs = [[champ.get_db_prep_save(getattr(objet, champ.attname), connection) for champ in champs] for objet in lignes]
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {table} ({colonnes}) VALUES ({", ".join(["%s"] * len(champs))})', valeurs)
+
+
+def creer(comptes, hopital_id=None, processus=None):
+    # comptes : données validées (ProvisionnementSerializer) ; retourne [(id, email, type)]
+    par_code = hopitaux(comptes)
+    hashes = hacher([compte.get('password') for compte in comptes], processus)
+    objets = []
+    for compte, mot_de_passe in zip(comptes, hashes):
+        modele = TYPES[compte['type']]
+        champs = {'nom': compte['nom'], 'prenom': compte['prenom'], 'email': compte['email'], 'password': mot_de_passe,
+                  'hopital_id': par_code.get(compte.get('hopital'), hopital_id or hopital_courant())}
+        if modele is Medecin and compte.get('specialite'):
+            champs['specialite'] = compte['specialite']
+        objets.append(modele(**champs))
+
+    parents = Utilisateur._meta.concrete_fields
+    with transaction.atomic():
+        Utilisateur.tous.bulk_create([
+            Utilisateur(**{champ.attname: getattr(objet, champ.attname) for champ in parents if not champ.primary_key})
+            for objet in objets
+        ], batch_size=500)
+        ids = dict(Utilisateur.tous.filter(email__in=[objet.email for objet in objets]).values_list('email', 'pk'))
+        for objet in objets:
+            objet.pk = objet.id_utilisateur = ids[objet.email]
+            objet.utilisateur_ptr_id = objet.pk
+        for modele in TYPES.values():
+            lignes = [objet for objet in objets if type(objet) is modele]
+            if lignes:
+                inserer_enfants(modele, lignes)
+    return [(objet.pk, objet.email, compte['type']) for objet, compte in zip(objets, comptes)]
@@ -0,0 +1,264 @@
+import csv
+import datetime
+import hashlib
+import hmac
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+
+from .models import BilanBiologique, Patient, Resume, Traitement
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow est optionnel, CSV reste disponible
+    pyarrow = None
+
+# Extraction pseudonymisée pour la recherche (manage.py exporter_recherche).
+#
+# Chaque table est lue par plages de clé primaire, une requête par plage, et transformée en
+# colonnes NumPy : nss, noms, email et téléphone remplacés par des HMAC à clé (calculés une
+# fois par valeur distincte de la plage), date de naissance réduite à une tranche d'âge,
+# dates décalées d'un nombre de jours propre au patient (dérivé de la même clé, donc
+# identique d'une table et d'une extraction à l'autre). Une plage = un fichier part-NNNNN,
+# écrit par un processus du pool : l'extraction est un répertoire par table.
+#
+# Le texte libre (résumés, résultat et description des bilans) n'est exporté qu'à la demande, avec le
+# nom, le prénom et le nss du patient masqués. Le contenu des dossiers archivés
+# (archivage.py) n'est plus dans les tables et n'est pas exporté.
+
+PSEUDONYMISATION = {
+    'CLE': '',                  # Secret, obligatoire ; une clé par étude pour des pseudonymes non reliables
+    'DECALAGE_MAX_JOURS': 180,  # Décalage des dates dans [-max, +max], jamais nul
+    'TRANCHE_AGE': 5,
+    'AGE_MAX': 90,              # Tranche ouverte au-delà ("90+")
+    'CHUNK_SIZE': 100000,       # Clés primaires par fichier
+    'PROCESSUS': 0,             # 0 : un par cœur
+    **getattr(settings, 'PSEUDONYMISATION', {}),
+}
+
+FORMATS = ('csv', 'parquet')
+
+MASQUE = '[PATIENT]'
+
+# Colonnes de texte libre : seulement avec --texte, passées par masquer()
+TEXTE_LIBRE = ('result', 'description')
+
+
+class CleManquante(Exception):
+    pass
+
+
+# table -> (modèle, chemin vers le patient, colonnes lues en plus du patient)
+TABLES = {
+    'patients': (Patient, '', ['nom', 'prenom', 'email', 'telephone', 'hopital_id']),
+    'traitements': (Traitement, 'ordonnance__dpi_patient__patient__', [
+        'ordonnance_id', 'ordonnance__date', 'ordonnance__medecin__specialite', 'medicament__nom',
+        'medicament__dosage', 'medicament__forme', 'quantite', 'duree', 'date_debut', 'date_fin',
+    ]),
+    'bilans': (BilanBiologique, 'dpi__patient__', ['date', 'result', 'description']),
+    'resumes': (Resume, 'dpi__patient__', ['date', 'medecin__specialite', 'description']),
+}
+
+
+def cle(etude=''):
+    if not PSEUDONYMISATION['CLE']:
+        raise CleManquante('PSEUDONYMISATION["CLE"] is not set')
+    # Une étude donnée : pseudonymes et décalages propres, non reliables à ceux d'une autre
+    return hmac.new(PSEUDONYMISATION['CLE'].encode(), etude.encode(), hashlib.sha256).digest()
+
+
+def texte(valeurs):
+    # None -> '' sans boucle Python
+    valeurs = np.asarray(valeurs, dtype=object)
+    return np.where(valeurs == None, '', valeurs).astype(str)  # noqa: E711 (comparaison élément par élément)
+
+
+def codes(valeurs, domaine, secret):
+    # Un HMAC par valeur distincte, redistribué sur la colonne par l'index inverse de np.unique
+    uniques, inverse = np.unique(texte(valeurs), return_inverse=True)
+    base = hmac.new(secret, domaine.encode() + b'\0', hashlib.sha256)
+    resultats = []
+    for valeur in uniques.tolist():
+        mac = base.copy()
+        mac.update(valeur.encode())
+        resultats.append(mac.digest())
+    return uniques, inverse, resultats
+
+
+def pseudonymes(valeurs, domaine, secret):
+    uniques, inverse, macs = codes(valeurs, domaine, secret)
+    pseudos = np.array([mac.hex()[:20] for mac in macs], dtype='<U20')
+    pseudos[uniques == ''] = ''
+    return pseudos[inverse]
+
+
+def decalages(nss, secret):
+    # En jours, le même pour toutes les dates d'un patient
+    maximum = PSEUDONYMISATION['DECALAGE_MAX_JOURS']
+    uniques, inverse, macs = codes(nss, 'decalage', secret)
+    jours = np.array([int.from_bytes(mac[:4], 'big') for mac in macs], dtype=np.int64) % (2 * maximum + 1) - maximum
+    jours[jours == 0] = maximum
+    return jours[inverse].astype('timedelta64[D]')
+
+
+def dates(valeurs):
+    return np.array(valeurs, dtype='datetime64[D]')  # None -> NaT
+
+
+def annee_mois_jour(valeurs):
+    annees = valeurs.astype('datetime64[Y]').astype(np.int64) + 1970
+    mois = valeurs.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    jours = (valeurs - valeurs.astype('datetime64[M]')).astype(np.int64) + 1
+    return annees, mois, jours
+
+
+def tranches_age(naissances, references):
+    # Âge exact (anniversaire passé ou non) puis tranche ; '' si une des dates manque
+    tranche, age_max = PSEUDONYMISATION['TRANCHE_AGE'], PSEUDONYMISATION['AGE_MAX']
+    a_n, m_n, j_n = annee_mois_jour(naissances)
+    a_r, m_r, j_r = annee_mois_jour(references)
+    ages = a_r - a_n - ((m_r * 100 + j_r) < (m_n * 100 + j_n))
+    libelles = np.array([f'{debut}-{debut + tranche - 1}' for debut in range(0, age_max, tranche)] + [f'{age_max}+', ''])
+    indices = np.minimum(np.maximum(ages, 0), age_max) // tranche
+    indices = np.minimum(indices, len(libelles) - 2)
+    inconnus = np.isnat(naissances) | np.isnat(references) | (ages < 0)
+    indices[inconnus] = len(libelles) - 1
+    return libelles[indices]
+
+
+def masquer(descriptions, noms, prenoms, nss):
+    # Identifiants du patient retirés de son propre texte (pas de vectorisation possible)
+    resultats = []
+    for description, *identifiants in zip(texte(descriptions).tolist(), noms, prenoms, nss):
+        termes = [re.escape(terme) for terme in identifiants if terme and len(terme) > 1]
+        resultats.append(re.sub('|'.join(termes), MASQUE, description, flags=re.IGNORECASE) if termes else description)
+    return np.array(resultats, dtype=object)
+
+
+def transformer(table, colonnes, secret, reference, avec_texte):
+    # colonnes : tableaux NumPy (objets) par nom de colonne lue ; retourne les colonnes exportées
+    nss = colonnes['nss']
+    naissances = dates(colonnes['date_naissance'])
+    sortie = {'patient': pseudonymes(nss, 'patient', secret)}
+    if table == 'patients':
+        for champ in ('nom', 'prenom', 'email', 'telephone'):
+            sortie[champ] = pseudonymes(colonnes[champ], champ, secret)
+        sortie['tranche_age'] = tranches_age(naissances, np.full(len(nss), reference, dtype='datetime64[D]'))
+        sortie['hopital'] = colonnes['hopital_id']
+        return sortie
+
+    decalage = decalages(nss, secret)
+    champ_date = 'ordonnance__date' if table == 'traitements' else 'date'
+    date = dates(colonnes[champ_date])
+    if table == 'traitements':
+        sortie['ordonnance'] = pseudonymes(colonnes['ordonnance_id'], 'ordonnance', secret)
+    sortie['date'] = date + decalage
+    sortie['tranche_age'] = tranches_age(naissances, date)  # Âge au moment de l'acte
+    if table == 'traitements':
+        sortie['specialite'] = colonnes['ordonnance__medecin__specialite']
+        sortie['medicament'] = colonnes['medicament__nom']
+        sortie['dosage'] = colonnes['medicament__dosage']
+        sortie['forme'] = colonnes['medicament__forme']
+        sortie['quantite'] = colonnes['quantite']
+        sortie['duree'] = colonnes['duree']
+        sortie['date_debut'] = dates(colonnes['date_debut']) + decalage
+        sortie['date_fin'] = dates(colonnes['date_fin']) + decalage
+    elif table == 'resumes':
+        sortie['specialite'] = colonnes['medecin__specialite']
+    if avec_texte:
+        for champ in TEXTE_LIBRE:
+            if champ in colonnes:
+                sortie[champ] = masquer(colonnes[champ], colonnes['nom'], colonnes['prenom'], nss)
+    return sortie
+
+
+def ecrire_csv(chemin, sortie):
+    valeurs = []
+    for colonne in sortie.values():
+        if colonne.dtype.kind == 'M':
+            colonne = np.where(np.isnat(colonne), '', np.datetime_as_string(colonne))
+        valeurs.append(colonne.tolist())
+    with open(chemin, 'w', newline='', encoding='utf-8') as fichier:
+        ecriture = csv.writer(fichier)
+        ecriture.writerow(sortie)
+        ecriture.writerows(zip(*valeurs))
+
+
+def ecrire_parquet(chemin, sortie):
+    # from_pandas : NaT et None deviennent des valeurs nulles
+    table = pyarrow.table({nom: pyarrow.array(colonne, from_pandas=True) for nom, colonne in sortie.items()})
+    pyarrow.parquet.write_table(table, chemin, compression='zstd')
+
+
+ECRITURES = {'csv': ecrire_csv, 'parquet': ecrire_parquet}
+
+
+def queryset(table, hopital=None):
+    modele, chemin, _ = TABLES[table]
+    queryset = modele.tous.all()
+    if hopital is not None:
+        queryset = queryset.filter(**{f'{chemin}hopital__code': hopital})
+    return queryset
+
+
+def colonnes_lues(table, avec_texte):
+    _, chemin, colonnes = TABLES[table]
+    patient = ['nss', 'date_naissance'] + (['nom', 'prenom'] if avec_texte and table != 'patients' else [])
+    colonnes = [colonne for colonne in colonnes if avec_texte or colonne not in TEXTE_LIBRE]
+    return [chemin + colonne for colonne in patient] + colonnes, patient + colonnes
+
+
+def exporter_plage(table, debut, fin, chemin_fichier, format_, options):
+    # Tâche d'un processus du pool : une plage de clés primaires -> un fichier. Retourne le nombre de lignes.
+    lues, noms = colonnes_lues(table, options['texte'])
+    lignes = list(queryset(table, options['hopital']).filter(pk__gt=debut, pk__lte=fin).order_by('pk').values_list(*lues))
+    if not lignes:
+        return 0
+    colonnes = dict(zip(noms, (np.array(colonne, dtype=object) for colonne in zip(*lignes))))
+    sortie = transformer(table, colonnes, cle(options['etude']), options['reference'], options['texte'])
+    ECRITURES[format_](chemin_fichier, sortie)
+    return len(lignes)
+
+
+def plages(table, hopital, chunk_size):
+    dernier = queryset(table, hopital).aggregate(m=Max('pk'))['m'] or 0
+    return [(debut, debut + chunk_size) for debut in range(0, dernier, chunk_size)]
+
+
+def exporter(repertoire, tables, format_='csv', hopital=None, etude='', avec_texte=False, processus=None, chunk_size=None):
+    # Retourne {table: nombre de lignes}
+    if format_ == 'parquet' and pyarrow is None:
+        raise ImportError('pyarrow is required for the parquet format')
+    cle(etude)  # Clé absente : erreur avant de lancer les processus
+    chunk_size = chunk_size or PSEUDONYMISATION['CHUNK_SIZE']
+    processus = processus or PSEUDONYMISATION['PROCESSUS'] or os.cpu_count()
+    options = {'hopital': hopital, 'etude': etude, 'texte': avec_texte, 'reference': datetime.date.today()}
+
+    taches = []
+    for table in tables:
+        os.makedirs(os.path.join(repertoire, table), exist_ok=True)
+        if os.listdir(os.path.join(repertoire, table)):
+            raise FileExistsError(f'{os.path.join(repertoire, table)} is not empty')  # Pas de mélange avec des parts plus anciennes
+        for numero, (debut, fin) in enumerate(plages(table, hopital, chunk_size)):
+            fichier = os.path.join(repertoire, table, f'part-{numero:05d}.{format_}')
+            taches.append((table, debut, fin, fichier, format_, options))
+
+    totaux = dict.fromkeys(tables, 0)
+    if processus == 1 or len(taches) < 2:
+        resultats = (exporter_plage(*tache) for tache in taches)
+    else:
+        executeur = ProcessPoolExecutor(max_workers=min(processus, len(taches)),
+                                        mp_context=multiprocessing.get_context('forkserver'),
+                                        initializer=django.setup)  # Avant d'importer ce module et les modèles
+        with executeur:
+            resultats = list(executeur.map(exporter_plage, *zip(*taches)))
+    for tache, lignes in zip(taches, resultats):
+        totaux[tache[0]] += lignes
+    return totaux
@@ -0,0 +1,254 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs
+
+import jwt
+from django.conf import settings
+from django.db.models import Max
+
+from . import outbox
+from .asynchrone import base
+from .models import DossierMedical, EvenementClinique, Ordonnance, Resume, Utilisateur
+
+# Notifications poussées aux utilisateurs connectés, servies directement par l'application
+# ASGI (monprojet/asgi.py) en SSE ou WebSocket, sans passer par les vues Django.
+#
+# Chaque worker garde en mémoire les connexions ouvertes par utilisateur et une seule tâche
+# asyncio qui suit l'outbox EvenementClinique : réveillée au commit dans le même processus,
+# elle relit la table toutes les POLL_INTERVAL secondes pour les écritures faites par les
+# autres workers. Une connexion inactive ne coûte qu'une file et une coroutine.
+
+logger = logging.getLogger(__name__)
+
+REALTIME = {
+    'SSE_PATH': '/api/notifications',
+    'WEBSOCKET_PATH': '/ws/notifications',
+    'TYPES': ('bilanbiologique', 'ordonnance', 'traitement'),  # préfixes de EvenementClinique.type
+    'QUEUE_SIZE': 100,      # messages en attente par connexion, les plus anciens sont perdus au-delà
+    'KEEPALIVE': 15,        # secondes entre deux commentaires SSE sur une connexion inactive
+    'POLL_INTERVAL': 1,
+    'TICKET_TTL': 30,       # secondes de validité d'un ticket ?ticket=
+    **getattr(settings, 'REALTIME', {}),
+}
+
+
+class Connexions:
+    def __init__(self):
+        self.par_utilisateur = defaultdict(set)
+
+    def ouvrir(self, utilisateur_id):
+        file = asyncio.Queue(REALTIME['QUEUE_SIZE'])
+        self.par_utilisateur[utilisateur_id].add(file)
+        return file
+
+    def fermer(self, utilisateur_id, file):
+        files = self.par_utilisateur.get(utilisateur_id)
+        if files is not None:
+            files.discard(file)
+            if not files:
+                del self.par_utilisateur[utilisateur_id]
+
+    def publier(self, utilisateurs, message):
+        for utilisateur_id in utilisateurs:
+            for file in self.par_utilisateur.get(utilisateur_id, ()):
+                if file.full():
+                    file.get_nowait()  # Client trop lent : on perd le plus ancien
+                file.put_nowait(message)
+
+    def __len__(self):
+        return sum(len(files) for files in self.par_utilisateur.values())
+
+
+def destinataires(evenements):
+    # Médecins ayant rédigé un résumé ou une ordonnance dans le dossier, et le patient lui-même
+    dossiers = {evenement.dossier_id for evenement in evenements if evenement.dossier_id is not None}
+    par_dossier = defaultdict(set)
+    for dossier, patient in DossierMedical.objects.filter(id__in=dossiers).values_list('id', 'patient_id'):
+        par_dossier[dossier].add(patient)
+    for dossier, medecin in (Resume.objects.filter(dpi_id__in=dossiers, medecin__isnull=False)
+                             .values_list('dpi_id', 'medecin_id').distinct()):
+        par_dossier[dossier].add(medecin)
+    for dossier, medecin in (Ordonnance.objects.filter(dpi_patient_id__in=dossiers)
+                             .values_list('dpi_patient_id', 'medecin_id').distinct()):
+        par_dossier[dossier].add(medecin)
+
+    messages = []
+    for evenement in evenements:
+        utilisateurs = set(par_dossier.get(evenement.dossier_id, ()))
+        if evenement.type.startswith('ordonnance.'):
+            utilisateurs.add(evenement.payload.get('medecin_id'))  # Encore connu après suppression
+        # Sérialisé une fois pour toutes les connexions
+        messages.append((utilisateurs, (evenement.seq, evenement.type, json.dumps(outbox.en_dict(evenement)))))
+    return messages
+
+
+def lire_notifications(after):
+    evenements, curseur = outbox.lire(after)
+    notifies = [evenement for evenement in evenements if evenement.type.split('.')[0] in REALTIME['TYPES']]
+    return curseur, destinataires(notifies) if notifies else []
+
+
+def dernier_seq():
+    return EvenementClinique.tous.aggregate(seq=Max('seq'))['seq'] or 0
+
+
+class Diffuseur:
+    # Une tâche par worker, démarrée à la première connexion et arrêtée quand il n'y en a plus
+
+    def __init__(self, connexions):
+        self.connexions = connexions
+        self.tache = None
+        self.reveil = None
+        self.boucle = None
+        outbox.abonnes.append(self.notifier)
+
+    def notifier(self):
+        # Appelé depuis le thread qui a commité
+        if self.boucle is not None and self.reveil is not None:
+            try:
+                self.boucle.call_soon_threadsafe(self.reveil.set)
+            except RuntimeError:
+                pass  # Boucle fermée
+
+    def demarrer(self):
+        if self.tache is None or self.tache.done():
+            self.boucle = asyncio.get_running_loop()
+            self.reveil = asyncio.Event()
+            self.tache = self.boucle.create_task(self.suivre())
+
+    async def suivre(self):
+        # Les événements antérieurs à la première connexion n'intéressent personne
+        after = await base(dernier_seq)()
+        while len(self.connexions):
+            self.reveil.clear()
+            try:
+                suivant, messages = await base(lire_notifications)(after)
+            except Exception:
+                logger.exception("Lecture de l'outbox impossible")
+                suivant, messages = after, []
+            for utilisateurs, message in messages:
+                self.connexions.publier(utilisateurs, message)
+            if suivant == after:
+                try:
+                    await asyncio.wait_for(self.reveil.wait(), REALTIME['POLL_INTERVAL'])
+                except asyncio.TimeoutError:
+                    pass
+            after = suivant
+
+
+connexions = Connexions()
+diffuseur = Diffuseur(connexions)
+
+
+def ticket(utilisateur_id):
+    # Jeton de TICKET_TTL secondes réservé aux notifications (aud) : refusé par l'API, et le
+    # jeton de l'API est refusé en ?ticket=
+    return jwt.encode({
+        'id': utilisateur_id,
+        'aud': 'notifications',
+        'exp': datetime.now(timezone.utc) + timedelta(seconds=REALTIME['TICKET_TTL']),
+    }, 'secret', algorithm='HS256')
+
+
+def utilisateur_du_token(token, audience=None):
+    try:
+        payload = jwt.decode(token, 'secret', algorithms=['HS256'], audience=audience)
+    except jwt.InvalidTokenError:
+        return None
+    return Utilisateur.objects.filter(id_utilisateur=payload.get('id')).values_list('id_utilisateur', flat=True).first()
+
+
+async def authentifier(scope):
+    # En-tête Authorization comme l'API, ou ?ticket= (EventSource et WebSocket ne peuvent pas
+    # fixer d'en-tête) obtenu par POST /api/notifications/ticket : l'URL finit dans les journaux
+    # d'accès, on n'y met pas le jeton de l'API
+    token = dict(scope.get('headers', ())).get(b'authorization', b'').decode()
+    if token:
+        return await base(utilisateur_du_token)(token)
+    billet = parse_qs(scope.get('query_string', b'').decode()).get('ticket', [''])[0]
+    if billet:
+        return await base(utilisateur_du_token)(billet, 'notifications')
+    return None
+
+
+async def emettre(file, envoyer, keepalive=None):
+    while True:
+        try:
+            message = await asyncio.wait_for(file.get(), keepalive)
+        except asyncio.TimeoutError:
+            message = None
+        await envoyer(message)
+
+
+async def sse(scope, receive, send):
+    utilisateur_id = await authentifier(scope)
+    if utilisateur_id is None:
+        await send({'type': 'http.response.start', 'status': 401,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': json.dumps({"message": "Unauthenticated"}).encode()})
+        return
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ]})
+    await send({'type': 'http.response.body', 'body': b'retry: 1000\n\n', 'more_body': True})
+
+    async def envoyer(message):
+        if message is None:
+            chunk = ': keep-alive\n\n'
+        else:
+            seq, type, texte = message
+            chunk = f'id: {seq}\nevent: {type}\ndata: {texte}\n\n'
+        await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+
+    file = connexions.ouvrir(utilisateur_id)
+    diffuseur.demarrer()
+    emetteur = asyncio.ensure_future(emettre(file, envoyer, REALTIME['KEEPALIVE']))
+    try:
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+    finally:
+        emetteur.cancel()
+        connexions.fermer(utilisateur_id, file)
+
+
+async def websocket(scope, receive, send):
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    utilisateur_id = await authentifier(scope)
+    if utilisateur_id is None:
+        await send({'type': 'websocket.close', 'code': 4401})
+        return
+    await send({'type': 'websocket.accept'})
+
+    async def envoyer(message):
+        await send({'type': 'websocket.send', 'text': message[2]})
+
+    file = connexions.ouvrir(utilisateur_id)
+    diffuseur.demarrer()
+    emetteur = asyncio.ensure_future(emettre(file, envoyer))
+    try:
+        # Les messages du client sont ignorés, le canal ne sert qu'à pousser
+        while (await receive())['type'] != 'websocket.disconnect':
+            pass
+    finally:
+        emetteur.cancel()
+        connexions.fermer(utilisateur_id, file)
+
+
+def router(django_application):
+    async def application(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == REALTIME['SSE_PATH']:
+            return await sse(scope, receive, send)
+        if scope['type'] == 'websocket':
+            if scope['path'] == REALTIME['WEBSOCKET_PATH']:
+                return await websocket(scope, receive, send)
+            await send({'type': 'websocket.close', 'code': 4404})
+            return
+        return await django_application(scope, receive, send)
+    return application
@@ -0,0 +1,247 @@
+import math
+import re
+import time
+import unicodedata
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+
+from .models import BilanBiologique, DossierSummary, Occurrence, Resume, Terme
+
+# Recherche plein texte sur les notes cliniques (Resume.description, BilanBiologique.description
+# et result) avec un index inversé tenu à jour à chaque écriture (SuiviDossierMixin).
+#
+# Analyse : minuscules, sans accents, mots vides retirés, puis racinisation légère du français
+# (pluriels et suffixes courants) pour que "douleurs abdominales" trouve "douleur abdominale".
+# Une requête est un ET de ses termes, classé par somme des idf x poids du terme dans la note.
+# Le coût d'une requête suit les listes d'occurrences de ses termes, pas le nombre de notes.
+#
+# Les compteurs de Terme sont mis à jour dans l'ordre alphabétique des termes : deux écritures
+# concurrentes verrouillent leurs lignes communes dans le même ordre. Le nombre total de notes
+# (le N de l'idf) n'a pas de ligne à lui, qui sérialiserait toutes les écritures : il est lu
+# dans DossierSummary au plus toutes les TTL_DOCUMENTS secondes, une approximation suffit.
+
+RECHERCHE = {
+    'TTL_DOCUMENTS': 300,  # secondes
+    **getattr(settings, 'RECHERCHE', {}),
+}
+
+RESSOURCES = {'Resume': 'resume', 'BilanBiologique': 'bilan'}
+MODELES = {'resume': Resume, 'bilan': BilanBiologique}
+
+MOTS_VIDES = frozenset('''
+a au aux avec ce ces cet cette dans de des du elle en et eu il ils je la le les leur leurs lui ma mais
+me meme mes moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sur ta te tes toi
+ton tu un une vos votre vous c d j l m n s t y ete etre avoir est sont etait ont a fait plus tres
+sans sous chez entre vers aussi donc alors comme si tout tous toute toutes
+'''.split())
+
+MOT_RE = re.compile(r'[a-z0-9]+')
+
+# Suffixes retirés (le plus long d'abord) si la racine garde au moins 3 lettres
+SUFFIXES = sorted([
+    'issements', 'issement', 'ements', 'ement', 'ations', 'ation', 'atrices', 'atrice', 'ateurs', 'ateur',
+    'iques', 'ique', 'ismes', 'isme', 'istes', 'iste', 'euses', 'euse', 'eux', 'ites', 'ite',
+    'ives', 'ive', 'ifs', 'if', 'ees', 'ee', 'es', 'er', 'e',
+], key=len, reverse=True)
+
+LONGUEUR_TERME = 40
+
+
+def normaliser(texte):
+    texte = texte.lower().replace('œ', 'oe').replace('æ', 'ae')
+    return ''.join(c for c in unicodedata.normalize('NFKD', texte) if not unicodedata.combining(c))
+
+
+def raciniser(mot):
+    if mot.isdigit():
+        return mot
+    if mot.endswith('eaux') and len(mot) > 5:
+        mot = mot[:-1]
+    elif mot.endswith('aux') and len(mot) > 4:
+        mot = mot[:-3] + 'al'  # chevaux -> cheval
+    elif mot.endswith('s') and len(mot) > 3:
+        mot = mot[:-1]
+    for suffixe in SUFFIXES:
+        if mot.endswith(suffixe) and len(mot) - len(suffixe) >= 3:
+            mot = mot[:-len(suffixe)]
+            break
+    if mot[-2:] in ('ll', 'nn', 'tt', 'ss'):
+        mot = mot[:-1]  # artérielle -> arteriel, comme artériel
+    return mot
+
+
+def termes(texte):
+    return [
+        raciniser(mot)[:LONGUEUR_TERME]
+        for mot in MOT_RE.findall(normaliser(texte or ''))
+        if len(mot) > 1 and mot not in MOTS_VIDES
+    ]
+
+
+def poids_termes(texte):
+    # (1 + log tf) / sqrt(nombre de termes) : une note courte qui cite le terme passe devant
+    liste = termes(texte)
+    if not liste:
+        return {}
+    norme = math.sqrt(len(liste))
+    return {terme: (1 + math.log(n)) / norme for terme, n in Counter(liste).items()}
+
+
+def texte_de(instance):
+    return ' '.join(getattr(instance, champ) or '' for champ in instance.champs_recherche)
+
+
+def ajuster(liste, delta):
+    # Nombre de documents par terme, en UPDATE relatifs comme DossierSummary
+    if not liste:
+        return
+    liste = sorted(liste)
+    if delta > 0:
+        Terme.objects.bulk_create([Terme(terme=terme) for terme in liste], ignore_conflicts=True)
+    Terme.objects.filter(terme__in=liste).update(nb_documents=F('nb_documents') + delta)
+
+
+def indexer(instance, creation=False):
+    ressource = RESSOURCES[type(instance).__name__]
+    poids = poids_termes(texte_de(instance))
+    anciens = set()
+    if not creation:
+        occurrences = Occurrence.tous.filter(ressource=ressource, objet_id=instance.pk)
+        anciens = set(occurrences.values_list('terme', flat=True))
+        occurrences.delete()
+    Occurrence.tous.bulk_create([
+        Occurrence(terme=terme, ressource=ressource, objet_id=instance.pk,
+                   dossier_id=instance.dossier_suivi_id, date=instance.date, poids=valeur)
+        for terme, valeur in sorted(poids.items())
+    ])
+    ajuster(set(poids) - anciens, 1)
+    ajuster(anciens - set(poids), -1)
+
+
+def desindexer(instance):
+    occurrences = Occurrence.tous.filter(ressource=RESSOURCES[type(instance).__name__], objet_id=instance.pk)
+    anciens = list(occurrences.values_list('terme', flat=True))
+    if anciens:
+        occurrences.delete()
+        ajuster(anciens, -1)
+
+
+_documents = {'nombre': 0, 'lu': None}
+
+
+def nombre_documents():
+    # Notes des dossiers non archivés, relu au plus toutes les TTL_DOCUMENTS secondes
+    maintenant = time.monotonic()
+    if _documents['lu'] is None or maintenant - _documents['lu'] > RECHERCHE['TTL_DOCUMENTS']:
+        total = (DossierSummary.tous.filter(dossier__archive=False)
+                 .aggregate(n=Sum(F('nb_consultations') + F('nb_bilans')))['n'])
+        _documents.update(nombre=total or 0, lu=maintenant)
+    return _documents['nombre']
+
+
+def reconstruire(chunk_size=2000):
+    # Reconstruction complète (premier remplissage, changement de l'analyseur), hors trafic
+    with transaction.atomic():
+        Occurrence.tous.all().delete()
+        Terme.objects.all().delete()
+    frequences = Counter()
+    documents = 0
+    for ressource, modele in MODELES.items():
+        colonnes = ('pk', 'dpi_id', 'date', *modele.champs_recherche)
+        last_id = 0
+        while True:
+            lignes = list(modele.tous.filter(pk__gt=last_id).order_by('pk').values_list(*colonnes)[:chunk_size])
+            if not lignes:
+                break
+            occurrences = []
+            for pk, dossier_id, date, *textes in lignes:
+                poids = poids_termes(' '.join(texte or '' for texte in textes))
+                if poids:
+                    documents += 1
+                    frequences.update(poids.keys())
+                occurrences.extend(
+                    Occurrence(terme=terme, ressource=ressource, objet_id=pk, dossier_id=dossier_id, date=date, poids=valeur)
+                    for terme, valeur in poids.items()
+                )
+            Occurrence.tous.bulk_create(occurrences, batch_size=5000)
+            last_id = lignes[-1][0]
+    Terme.objects.bulk_create(
+        [Terme(terme=terme, nb_documents=n) for terme, n in sorted(frequences.items())],
+        batch_size=5000,
+    )
+    _documents['lu'] = None
+    return documents
+
+
+def rechercher(requete, dossier=None, debut=None, fin=None, ressource=None, limit=20, offset=0):
+    # Retourne (résultats de la page, il y a une page suivante)
+    liste = list(dict.fromkeys(termes(requete)))
+    if not liste:
+        return [], False
+    df = dict(Terme.objects.filter(terme__in=liste).values_list('terme', 'nb_documents'))
+    total = max(nombre_documents(), *df.values(), 1)
+    if any(df.get(terme, 0) <= 0 for terme in liste):
+        return [], False  # Un terme absent de l'index : aucune note ne contient tous les termes
+    idf = {terme: math.log(1 + (total - df[terme] + 0.5) / (df[terme] + 0.5)) for terme in liste}
+
+    occurrences = Occurrence.objects.all()
+    if dossier is not None:
+        occurrences = occurrences.filter(dossier_id=dossier)
+    if debut is not None:
+        occurrences = occurrences.filter(date__gte=debut)
+    if fin is not None:
+        occurrences = occurrences.filter(date__lt=fin)
+    if ressource is not None:
+        occurrences = occurrences.filter(ressource=ressource)
+    colonnes = ('ressource', 'objet_id', 'dossier_id', 'date', 'poids')
+
+    if len(liste) == 1:
+        # Un seul terme : la base trie et pagine
+        terme = liste[0]
+        lignes = occurrences.filter(terme=terme).order_by('-poids', '-date', 'objet_id').values_list(*colonnes)
+        page = [(r, o, d, dt, p * idf[terme]) for r, o, d, dt, p in lignes[offset:offset + limit + 1]]
+    else:
+        # Plusieurs termes : une passe groupée sur les occurrences des termes cherchés,
+        # ne garde que les notes qui les contiennent tous
+        score = Sum(Case(*[When(terme=terme, then=F('poids') * Value(idf[terme])) for terme in liste],
+                         output_field=FloatField()))
+        lignes = (occurrences.filter(terme__in=liste)
+                  .values('ressource', 'objet_id', 'dossier_id', 'date')
+                  .annotate(score=score, n=Count('id'))
+                  .filter(n=len(liste))
+                  .order_by('-score', '-date', 'objet_id')
+                  .values_list('ressource', 'objet_id', 'dossier_id', 'date', 'score'))
+        page = list(lignes[offset:offset + limit + 1])
+
+    suivante = len(page) > limit
+    page = page[:limit]
+    textes = {}
+    for nom, modele in MODELES.items():
+        ids = [o for r, o, d, dt, score in page if r == nom]
+        if ids:
+            for instance in modele.tous.filter(pk__in=ids):
+                textes[(nom, instance.pk)] = texte_de(instance)
+    return [
+        {
+            'type': r,
+            'id': o,
+            'dossier': d,
+            'date': dt,
+            'score': round(score, 4),
+            'extrait': extrait(textes.get((r, o), ''), set(liste)),
+        }
+        for r, o, d, dt, score in page
+    ], suivante
+
+
+def extrait(texte, cherches, largeur=80):
+    # Passage autour du premier mot de la note qui correspond à un terme cherché
+    for match in re.finditer(r'\w+', texte):
+        if raciniser(normaliser(match.group())) in cherches:
+            debut = max(0, match.start() - largeur // 2)
+            fin = min(len(texte), match.end() + largeur // 2)
+            return ('…' if debut else '') + texte[debut:fin].strip() + ('…' if fin < len(texte) else '')
+    return texte[:largeur]
@@ -1,6 +1,71 @@
 from rest_framework import serializers
+from django.db import transaction
 from .models import *
 
+
+class VersionedUpdateMixin:
+    # The version the client read (from If-Match) is passed in the serializer context,
+    # the write only goes through if nobody bumped it in the meantime
+    def update(self, instance, validated_data):
+        return instance.update_if_version(self.context['version'], **validated_data)
+
+def parse_field_paths(value):
+    # "date,medicaments.duree,medicaments.medicament.nom" -> {'date': {}, 'medicaments': {'duree': {}, 'medicament': {'nom': {}}}}
+    tree = {}
+    for path in filter(None, (part.strip() for part in (value or '').split(','))):
+        node = tree
+        for name in path.split('.'):
+            node = node.setdefault(name, {})
+    return tree
+
+
+class SparseFieldsMixin:
+    """
+    ?fields=date,medicaments.duree keeps only the listed fields, dotted paths reach
+    into nested serializers. A nested relation that is not kept is never accessed,
+    so it is never queried.
+    ?expand=medecin replaces a foreign key id by the object declared in expandable_fields.
+    """
+    expandable_fields = {}
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if fields is None and expand is None and request is not None:
+            fields = parse_field_paths(request.query_params.get('fields'))
+            expand = parse_field_paths(request.query_params.get('expand'))
+        if fields or expand:
+            self.sparse(fields or {}, expand or {})
+
+    def sparse(self, fields, expand):
+        for name in expand:
+            if name in self.expandable_fields:
+                self.fields[name] = self.expandable_fields[name]()
+        if fields:
+            for name in list(self.fields):
+                if name not in fields and name not in expand:
+                    self.fields.pop(name)
+        for name in set(fields) | set(expand):
+            nested = self.fields.get(name)
+            nested = getattr(nested, 'child', nested)
+            if isinstance(nested, SparseFieldsMixin) and (fields.get(name) or expand.get(name)):
+                nested.sparse(fields.get(name, {}), expand.get(name, {}))
+
+
+class StaffPublicSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Utilisateur
+        fields = ['id_utilisateur', 'nom', 'prenom']
+        read_only_fields = fields
+
+
+class MedecinPublicSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Medecin
+        fields = ['id_utilisateur', 'nom', 'prenom', 'specialite']
+        read_only_fields = fields
+
+
 class UtilisateurSerializer(serializers.ModelSerializer):
     class Meta:
         model = Utilisateur
@@ -41,6 +106,38 @@ class AdministratifSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
+# Une entrée de POST /api/personnel (et de manage.py provisionner_personnel), voir provisionnement.py
+class ProvisionnementSerializer(serializers.Serializer):
+    type = serializers.ChoiceField(choices=[(0, 'Administratif'), (1, 'Medecin'), (2, 'Radiologue'),
+                                            (3, 'Laborantin'), (4, 'Infirmier')])
+    nom = serializers.CharField(max_length=255)
+    prenom = serializers.CharField(max_length=255)
+    email = serializers.EmailField(max_length=254)
+    password = serializers.CharField(write_only=True, required=False, allow_blank=True)  # Absent : connexion impossible
+    specialite = serializers.CharField(max_length=50, required=False)  # Medecin seulement
+    hopital = serializers.CharField(max_length=20, required=False)  # Hopital.code, celui de l'administratif par défaut
+
+# Corps de POST /api/ordonnance/<id>/dispenser, voir pharmacie.py
+class DispensationSerializer(serializers.Serializer):
+    # {"<id_medicament>": n}, absent : quantités calculées depuis les traitements
+    quantites = serializers.DictField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False)
+
+    def validate_quantites(self, quantites):
+        # Seulement les médicaments de l'ordonnance : context['besoins'] (pharmacie.besoins_ordonnance)
+        try:
+            besoins = {int(medicament): quantite for medicament, quantite in quantites.items()}
+        except ValueError:
+            raise serializers.ValidationError("Keys must be medicament ids")
+        hors_ordonnance = sorted(set(besoins) - set(self.context['besoins']))
+        if hors_ordonnance:
+            raise serializers.ValidationError(f"Medicaments not on this ordonnance: {hors_ordonnance}")
+        return besoins
+
+class ReapprovisionnementSerializer(serializers.Serializer):
+    # {"medicament": id, "quantite": n}
+    medicament = serializers.PrimaryKeyRelatedField(queryset=Medicament.objects.all())
+    quantite = serializers.IntegerField(min_value=1)
+
 class MedecinSerializer(serializers.ModelSerializer):
     class Meta:
         model = Medecin
@@ -58,10 +155,13 @@ class MedecinSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
-class PatientSerializer(serializers.ModelSerializer):
+class PatientSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Patient
         fields = ['nom', 'prenom', 'date_naissance', 'telephone', 'adresse', 'mutuelle', 'password', 'email']
+        extra_kwargs = {
+            'password': {'write_only': True}
+        }
 
     def create(self, validated_data):
         password = validated_data.pop('password', None)
@@ -77,12 +177,12 @@ class PatientSerializer(serializers.ModelSerializer):
 
 
 
-class MedicamentSerializer(serializers.ModelSerializer):
+class MedicamentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Medicament
         fields = ['id_medicament', 'nom', 'dosage', 'forme']
 
-class TraitementSerializer(serializers.ModelSerializer):
+class TraitementSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     medicament = MedicamentSerializer()  # Nested serializer for medicament details
 
     class Meta:
@@ -95,12 +195,26 @@ class TraitementSerializer(serializers.ModelSerializer):
         traitement = Traitement.objects.create(medicament=medicament, **validated_data)
         return traitement
 
-class OrdonnanceSerializer(serializers.ModelSerializer):
+class TraitementActifSerializer(serializers.ModelSerializer):
+    medicament = MedicamentSerializer(read_only=True)
+    dossier = serializers.IntegerField(source='ordonnance.dpi_patient_id')
+    nss = serializers.CharField(source='ordonnance.dpi_patient.patient.nss')
+    nom = serializers.CharField(source='ordonnance.dpi_patient.patient.nom')
+    prenom = serializers.CharField(source='ordonnance.dpi_patient.patient.prenom')
+
+    class Meta:
+        model = Traitement
+        fields = ['id_traitement', 'medicament', 'quantite', 'description', 'duree',
+                  'date_debut', 'date_fin', 'ordonnance', 'dossier', 'nss', 'nom', 'prenom']
+
+class OrdonnanceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     medicaments = TraitementSerializer(many=True)  # Nested serializer for related treatments (medicaments)
+    expandable_fields = {'medecin': lambda: MedecinPublicSerializer(read_only=True)}
 
     class Meta:
         model = Ordonnance
-        fields = ['id_ordonnance', 'date', 'medecin', 'dpi_patient', 'medicaments']
+        fields = ['id_ordonnance', 'date', 'medecin', 'dpi_patient', 'medicaments', 'version']
+        read_only_fields = ['version']
 
     def create(self, validated_data):
         # Extract nested medicaments data
@@ -121,20 +235,80 @@ class OrdonnanceSerializer(serializers.ModelSerializer):
 
         return ordonnance
 
+    def update(self, instance, validated_data):
+        medicaments_data = validated_data.pop('medicaments')
+
+        with transaction.atomic():
+            # Conditional UPDATE first: if it matches no row, nothing else is touched
+            instance.update_if_version(self.context['version'], **validated_data)
+
+            # The prescription lines are replaced as a whole
+            instance.medicaments.all().delete()
+            for traitement_data in medicaments_data:
+                traitement_data.pop('ordonnance', None)
+                medicament_data = traitement_data.pop('medicament')
+                medicament, created = Medicament.objects.get_or_create(**medicament_data)
+                Traitement.objects.create(ordonnance=instance, medicament=medicament, **traitement_data)
+
+        return instance
+
+
+class BilanBiologiqueSerializer(SparseFieldsMixin, VersionedUpdateMixin, serializers.ModelSerializer):
+    expandable_fields = {'laborantin': lambda: StaffPublicSerializer(read_only=True)}
 
-class BilanBiologiqueSerializer(serializers.ModelSerializer):
     class Meta:
         model = BilanBiologique
-        fields = ['id_bilan', 'date', 'result', 'description', 'dpi', 'laborantin']
+        fields = ['id_bilan', 'date', 'result', 'description', 'dpi', 'laborantin', 'version']
+        read_only_fields = ['version']
+
 
+class ResumeSerializer(SparseFieldsMixin, VersionedUpdateMixin, serializers.ModelSerializer):
+    expandable_fields = {'medecin': lambda: MedecinPublicSerializer(read_only=True)}
 
-class ResumeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Resume
-        fields = ['id_resume', 'date', 'description', 'dpi', 'medecin']
+        fields = ['id_resume', 'date', 'description', 'dpi', 'medecin', 'version']
+        read_only_fields = ['version']
+
 
+class DossierMedicalSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    patient = PatientSerializer(read_only=True)
+    consultations = ResumeSerializer(many=True, read_only=True)
+    ordonnances = OrdonnanceSerializer(many=True, read_only=True)
+    bilans = BilanBiologiqueSerializer(many=True, read_only=True)
 
-class DossierMedicalSerializer(serializers.ModelSerializer):
     class Meta:
         model = DossierMedical
-        fields = ['id_dpi', 'patient', 'consultations', 'soins', 'images', 'bilans']
\ No newline at end of file
+        fields = ['id', 'patient', 'consultations', 'ordonnances', 'bilans', 'date_cloture', 'archive', 'version']
+        read_only_fields = ['archive']
+
+
+class DossierSummarySerializer(serializers.ModelSerializer):
+    nom = serializers.CharField(source='dossier.patient.nom')
+    nb_traitements = serializers.IntegerField(read_only=True)  # En cours, compté par la vue
+    prenom = serializers.CharField(source='dossier.patient.prenom')
+    nss = serializers.CharField(source='dossier.patient.nss')
+
+    class Meta:
+        model = DossierSummary
+        fields = ['dossier', 'nom', 'prenom', 'nss',
+                  'nb_consultations', 'derniere_consultation',
+                  'nb_ordonnances', 'derniere_ordonnance', 'nb_traitements', 'fin_traitements',
+                  'nb_bilans', 'dernier_bilan']
+
+
+class RendezVousSerializer(serializers.ModelSerializer):
+    medecin = MedecinPublicSerializer(read_only=True)
+    nss = serializers.CharField(source='patient.nss', read_only=True)
+
+    class Meta:
+        model = RendezVous
+        fields = ['id_rendez_vous', 'medecin', 'nss', 'debut', 'fin', 'motif']
+
+
+class StockSerializer(serializers.ModelSerializer):
+    medicament = MedicamentSerializer(read_only=True)
+
+    class Meta:
+        model = Stock
+        fields = ['medicament', 'quantite', 'seuil_alerte', 'date_maj']
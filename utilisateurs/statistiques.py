@@ -0,0 +1,283 @@
+import datetime
+from collections import Counter
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+
+from .models import BilanBiologique, Cumul, DossierMedical, Medecin, Medicament, Ordonnance, Resume, Traitement
+
+# Statistiques d'activité lues uniquement dans les cumuls (Cumul), jamais sur les tables cliniques.
+#
+# Chaque écriture de Resume / Ordonnance / Traitement / BilanBiologique ajuste ses compteurs
+# dans la même transaction (SuiviDossierMixin et le receiver de suppression) : un INSERT
+# ignoré si la ligne existe, puis un UPDATE relatif par compteur. Les dossiers archivés
+# gardent leurs compteurs, l'activité passée ne disparaît pas des statistiques.
+#
+# Les comparaisons (période précédente, même période un an plus tôt, moyenne mobile,
+# tendance) sont calculées avec NumPy sur la matrice dimensions x périodes.
+
+# indicateur -> (granularité, dimension)
+INDICATEURS = {
+    'prescriptions': ('mois', 'medicament'),        # lignes d'ordonnance par médicament
+    'ordonnances': ('mois', 'medecin'),
+    'consultations': ('mois', 'medecin'),
+    'consultations_specialite': ('mois', 'specialite'),
+    'bilans': ('semaine', ''),
+}
+
+# Périodes entre une valeur et la même période un an plus tôt
+UN_AN = {'mois': 12, 'semaine': 52}
+
+
+def jour(valeur):
+    if isinstance(valeur, str):
+        return datetime.date.fromisoformat(valeur)
+    if isinstance(valeur, datetime.datetime):
+        return valeur.date()
+    return valeur
+
+
+def mois(date):
+    return date.replace(day=1)
+
+
+def semaine(date):
+    return date - datetime.timedelta(days=date.weekday())
+
+
+DEBUT_PERIODE = {'mois': mois, 'semaine': semaine}
+
+
+def dimension(valeur):
+    return '' if valeur is None else str(valeur)
+
+
+def cles(instance, lignes=False):
+    # (hôpital, {(indicateur, période, dimension): n}) des compteurs auxquels la ligne contribue.
+    # lignes=True : pour une ordonnance, ses lignes de traitement aussi (comptées à sa date).
+    compteurs = Counter()
+    if instance is None:
+        return 0, compteurs
+    nom = type(instance).__name__
+    if nom == 'Traitement':
+        ordonnance = Ordonnance.tous.filter(pk=instance.ordonnance_id).values_list('date', 'dpi_patient__hopital_id').first()
+        if ordonnance is None:
+            return 0, compteurs
+        date, hopital_id = ordonnance
+        compteurs[('prescriptions', mois(jour(date)), dimension(instance.medicament_id))] += 1
+        return hopital_id or 0, compteurs
+
+    hopital_id = DossierMedical.tous.filter(pk=instance.dossier_suivi_id).values_list('hopital_id', flat=True).first()
+    date = jour(instance.date)
+    if nom == 'Resume':
+        specialite = Medecin.tous.filter(pk=instance.medecin_id).values_list('specialite', flat=True).first()
+        compteurs[('consultations', mois(date), dimension(instance.medecin_id))] += 1
+        compteurs[('consultations_specialite', mois(date), dimension(specialite))] += 1
+    elif nom == 'Ordonnance':
+        compteurs[('ordonnances', mois(date), dimension(instance.medecin_id))] += 1
+        if lignes:
+            for medicament_id in Traitement.tous.filter(ordonnance_id=instance.pk).values_list('medicament_id', flat=True):
+                compteurs[('prescriptions', mois(date), dimension(medicament_id))] += 1
+    elif nom == 'BilanBiologique':
+        compteurs[('bilans', semaine(date), '')] += 1
+    return hopital_id or 0, compteurs
+
+
+def appliquer(hopital_id, deltas):
+    deltas = {cle: n for cle, n in deltas.items() if n}
+    if not deltas:
+        return
+    Cumul.tous.bulk_create([
+        Cumul(hopital_id=hopital_id, indicateur=indicateur, periode=periode, dimension=valeur)
+        for (indicateur, periode, valeur), n in deltas.items() if n > 0
+    ], ignore_conflicts=True)
+    for (indicateur, periode, valeur), n in deltas.items():
+        Cumul.tous.filter(hopital_id=hopital_id, indicateur=indicateur, periode=periode, dimension=valeur).update(
+            valeur=F('valeur') + n
+        )
+
+
+def ajouter(instance):
+    hopital_id, compteurs = cles(instance)
+    appliquer(hopital_id, compteurs)
+
+
+def retirer(instance):
+    hopital_id, compteurs = cles(instance)
+    appliquer(hopital_id, {cle: -n for cle, n in compteurs.items()})
+
+
+def deplacer(instance, avant):
+    # Après une modification (date, médecin...) : les compteurs passent de l'ancienne clé à la nouvelle
+    hopital_id, apres = cles(instance, lignes=True)
+    anciens = avant[1] if avant else Counter()
+    appliquer(hopital_id, {cle: apres[cle] - anciens[cle] for cle in anciens.keys() | apres.keys()})
+
+
+# Recalcul complet : (queryset, date, (indicateur, troncature, dimension)...) par table source
+SOURCES = [
+    (Resume.tous, 'dpi__hopital_id', 'date', [
+        ('consultations', TruncMonth, 'medecin_id'),
+        ('consultations_specialite', TruncMonth, 'medecin__specialite'),
+    ]),
+    (Ordonnance.tous, 'dpi_patient__hopital_id', 'date', [('ordonnances', TruncMonth, 'medecin_id')]),
+    (Traitement.tous, 'ordonnance__dpi_patient__hopital_id', 'ordonnance__date', [
+        ('prescriptions', TruncMonth, 'medicament_id'),
+    ]),
+    (BilanBiologique.tous, 'dpi__hopital_id', 'date', [('bilans', TruncWeek, None)]),
+]
+
+
+def reconstruire(depuis=None, chunk_size=10000):
+    # GROUP BY par plages de clé primaire (requêtes courtes), totaux additionnés en mémoire.
+    # depuis : seules les périodes qui commencent à partir du 1er de son mois sont recalculées,
+    # lues depuis le lundi précédent pour que la première semaine soit complète.
+    lecture = None
+    if depuis is not None:
+        depuis = mois(depuis)
+        lecture = semaine(depuis)
+    totaux = Counter()
+    for queryset, chemin_hopital, champ_date, indicateurs in SOURCES:
+        if depuis is not None:
+            queryset = queryset.filter(**{f'{champ_date}__gte': lecture})
+        dernier = queryset.aggregate(m=Max('pk'))['m'] or 0
+        for debut in range(0, dernier, chunk_size):
+            tranche = queryset.filter(pk__gt=debut, pk__lte=debut + chunk_size)
+            for indicateur, troncature, champ in indicateurs:
+                colonnes = {'h': F(chemin_hopital), 'p': troncature(champ_date)}
+                if champ:
+                    colonnes['d'] = F(champ)
+                for ligne in tranche.values(**colonnes).annotate(n=Count('pk')).order_by():
+                    totaux[(ligne['h'] or 0, indicateur, jour(ligne['p']), dimension(ligne.get('d')))] += ligne['n']
+
+    with transaction.atomic():
+        cumuls = Cumul.tous.all()
+        if depuis is not None:
+            cumuls = cumuls.filter(periode__gte=depuis)
+        cumuls.delete()
+        Cumul.tous.bulk_create([
+            Cumul(hopital_id=hopital_id, indicateur=indicateur, periode=periode, dimension=valeur, valeur=n)
+            for (hopital_id, indicateur, periode, valeur), n in totaux.items()
+            if depuis is None or periode >= depuis  # La semaine à cheval sur le mois précédent est partielle
+        ], batch_size=5000)
+    return len(totaux)
+
+
+def periodes(granularite, debut, fin):
+    suivante = {
+        'mois': lambda date: (date + datetime.timedelta(days=32)).replace(day=1),
+        'semaine': lambda date: date + datetime.timedelta(days=7),
+    }[granularite]
+    date = DEBUT_PERIODE[granularite](debut)
+    liste = []
+    while date <= fin:
+        liste.append(date)
+        date = suivante(date)
+    return liste
+
+
+def libelles(type_dimension, valeurs):
+    ids = [int(valeur) for valeur in valeurs if valeur.isdigit()]
+    if type_dimension == 'medicament':
+        return {str(pk): f'{m.nom} {m.dosage}'.strip() for pk, m in Medicament.objects.in_bulk(ids).items()}
+    if type_dimension == 'medecin':
+        return {str(pk): f'Dr {m.prenom} {m.nom}' for pk, m in Medecin.tous.in_bulk(ids).items()}
+    return {}
+
+
+def en_liste(tableau, decimales=2):
+    return [None if np.isnan(valeur) else round(float(valeur), decimales) for valeur in tableau]
+
+
+def pourcentage(courant, reference):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(reference != 0, (courant - reference) / reference * 100, np.nan)
+
+
+def analyser(indicateur, debut, fin, top=10):
+    granularite, type_dimension = INDICATEURS[indicateur]
+    liste = periodes(granularite, debut, fin)
+    if not liste:
+        return None
+    decalage = UN_AN[granularite]
+    # Un an de plus en arrière pour les comparaisons, lu dans la même requête
+    toutes = periodes(granularite, liste[0] - datetime.timedelta(days=366 if granularite == 'mois' else 364), fin)
+    toutes = toutes[len(toutes) - len(liste) - decalage:]
+    colonne = {periode: i for i, periode in enumerate(toutes)}
+
+    lignes = (Cumul.objects.filter(indicateur=indicateur, periode__gte=toutes[0], periode__lte=toutes[-1])
+              .values('periode', 'dimension').annotate(valeur=Sum('valeur')).order_by())
+    dimensions = {}
+    matrice = []
+    for ligne in lignes:
+        if ligne['periode'] not in colonne:
+            continue
+        if ligne['dimension'] not in dimensions:
+            dimensions[ligne['dimension']] = len(dimensions)
+            matrice.append(np.zeros(len(toutes)))
+        matrice[dimensions[ligne['dimension']]][colonne[ligne['periode']]] += ligne['valeur']
+    matrice = np.array(matrice).reshape(len(dimensions), len(toutes))
+    noms = list(dimensions)
+
+    courant = matrice[:, decalage:]
+    totaux = courant.sum(axis=1)
+    # Les `top` premières dimensions sur la période, le reste regroupé dans "autres"
+    ordre = np.argsort(-totaux, kind='stable')
+    gardees, reste = ordre[:top], ordre[top:]
+    series_matrice = matrice[gardees]
+    series_noms = [noms[i] for i in gardees]
+    if len(reste):
+        series_matrice = np.vstack([series_matrice, matrice[reste].sum(axis=0)])
+        series_noms.append(None)
+
+    def comparaisons(lignes_matrice):
+        # lignes_matrice : dimensions x (un an + période demandée)
+        actuel = lignes_matrice[:, decalage:]
+        precedent = lignes_matrice[:, decalage - 1:-1]
+        an_passe = lignes_matrice[:, :len(liste)]
+        cumul = np.cumsum(lignes_matrice, axis=1)
+        moyenne = (cumul[:, decalage:] - cumul[:, decalage - 3:-3]) / 3  # Sur trois périodes, celle-ci comprise
+        return actuel, pourcentage(actuel, precedent), an_passe, pourcentage(actuel, an_passe), moyenne
+
+    total_matrice = matrice.sum(axis=0, keepdims=True) if len(noms) else np.zeros((1, len(toutes)))
+    actuel, variation, an_passe, glissement, moyenne = comparaisons(total_matrice)
+    grand_total = float(actuel.sum())
+    etiquettes = libelles(type_dimension, [nom for nom in series_noms if nom is not None])
+
+    series = []
+    if len(series_noms):
+        s_actuel, s_variation, s_an_passe, s_glissement, s_moyenne = comparaisons(series_matrice)
+        # Tendance : pente de la droite des moindres carrés, en unités par période
+        x = np.arange(len(liste))
+        pentes = np.polyfit(x, s_actuel.T, 1)[0] if len(liste) > 1 else np.zeros(len(series_noms))
+        for i, nom in enumerate(series_noms):
+            total = float(s_actuel[i].sum())
+            series.append({
+                "dimension": nom if nom is not None else 'autres',
+                "libelle": 'Autres' if nom is None else etiquettes.get(nom, nom or ('Non renseigné' if type_dimension else 'Total')),
+                "valeurs": s_actuel[i].astype(int).tolist(),
+                "total": int(total),
+                "part": round(total / grand_total * 100, 2) if grand_total else None,
+                "variation_pct": en_liste(s_variation[i]),
+                "annee_precedente": s_an_passe[i].astype(int).tolist(),
+                "glissement_annuel_pct": en_liste(s_glissement[i]),
+                "moyenne_mobile": en_liste(s_moyenne[i]),
+                "tendance": round(float(pentes[i]), 3),
+            })
+
+    return {
+        "indicateur": indicateur,
+        "granularite": granularite,
+        "periodes": [periode.isoformat() for periode in liste],
+        "total": {
+            "valeurs": actuel[0].astype(int).tolist(),
+            "total": int(grand_total),
+            "variation_pct": en_liste(variation[0]),
+            "annee_precedente": an_passe[0].astype(int).tolist(),
+            "glissement_annuel_pct": en_liste(glissement[0]),
+            "moyenne_mobile": en_liste(moyenne[0]),
+        },
+        "series": series,
+    }
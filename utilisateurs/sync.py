@@ -0,0 +1,231 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import archivage, audit
+from .interactions import get_index as get_interactions
+from .models import (
+    BilanBiologique, DossierMedical, Laborantin, Medecin, OperationSync, Ordonnance, Patient, Resume,
+    Suppression, Traitement, VersionConflict,
+)
+from .serializers import BilanBiologiqueSerializer, OrdonnanceSerializer, ResumeSerializer
+
+# Synchronisation des tablettes de service (hors ligne d'abord).
+#
+# Lecture : chaque ligne synchronisée porte date_maj (indexée), le jeton de la tablette est
+# une date en microsecondes. Une reconnexion ne lit que les lignes modifiées depuis le jeton,
+# plus les tombstones de Suppression. Une transaction longue peut commiter une ligne dont
+# date_maj est antérieure au dernier jeton rendu : le jeton recule donc de MARGE secondes,
+# les quelques lignes relues sont réappliquées à l'identique par la tablette (même version).
+#
+# Écriture : la tablette renvoie sa file d'écritures hors ligne en un lot. Chaque opération
+# est appliquée dans sa propre transaction avec le contrôle de version habituel, et son
+# résultat est gardé dans OperationSync pour qu'un lot renvoyé ne soit pas appliqué deux fois.
+#
+# Le contenu des dossiers archivés (archivage.py) n'est pas envoyé : il a quitté les tables
+# sans tombstone, une tablette qui l'avait déjà le garde.
+
+SYNC = {
+    'LIMIT': 1000,           # lignes par ressource et par page
+    'MARGE': 30,             # secondes relues à chaque synchronisation
+    'RETENTION_JOURS': 90,   # au-delà, les tombstones sont purgés et la tablette repart de zéro
+    'MAX_OPERATIONS': 500,
+    **getattr(settings, 'SYNC', {}),
+}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECONDE = timedelta(microseconds=1)
+
+# (clé de la réponse, modèle, colonnes envoyées), dans l'ordre des clés étrangères
+RESSOURCES = [
+    ('patients', Patient, ['id_utilisateur', 'nom', 'prenom', 'email', 'nss', 'date_naissance', 'adresse',
+                           'telephone', 'mutuelle', 'date_maj']),
+    ('dossiers', DossierMedical, ['id', 'patient_id', 'date_cloture', 'archive', 'version', 'date_maj']),
+    ('resumes', Resume, ['id_resume', 'dpi_id', 'medecin_id', 'date', 'description', 'version', 'date_maj']),
+    ('ordonnances', Ordonnance, ['id_ordonnance', 'dpi_patient_id', 'medecin_id', 'date', 'version', 'date_maj']),
+    ('traitements', Traitement, ['id_traitement', 'ordonnance_id', 'medicament_id', 'medicament__nom',
+                                 'medicament__dosage', 'medicament__forme', 'quantite', 'description', 'duree',
+                                 'date_debut', 'date_fin', 'date_maj']),
+    ('bilans', BilanBiologique, ['id_bilan', 'dpi_id', 'laborantin_id', 'date', 'result', 'description',
+                                 'version', 'date_maj']),
+]
+
+# type d'opération -> (serializer, modèle, champ du dossier, champ et modèle de l'auteur)
+ECRITURES = {
+    'resume': (ResumeSerializer, Resume, 'dpi', 'medecin', Medecin),
+    'ordonnance': (OrdonnanceSerializer, Ordonnance, 'dpi_patient', 'medecin', Medecin),
+    'bilan': (BilanBiologiqueSerializer, BilanBiologique, 'dpi', 'laborantin', Laborantin),
+}
+
+
+class JetonInvalide(Exception):
+    pass
+
+
+class JetonExpire(Exception):
+    pass
+
+
+def en_jeton(moment):
+    return str((moment - EPOCH) // MICROSECONDE)
+
+
+def depuis_jeton(jeton):
+    try:
+        return EPOCH + int(jeton) * MICROSECONDE
+    except (TypeError, ValueError, OverflowError):
+        raise JetonInvalide(jeton)
+
+
+def page(queryset, champ, cle, limit):
+    # Retourne (lignes, date de la dernière ligne si la page est pleine)
+    lignes = list(queryset[:limit])
+    if len(lignes) < limit:
+        return lignes, None
+    derniere = lignes[-1][champ]
+    # Toutes les lignes du même instant, pour que la page suivante commence strictement après
+    lignes += queryset.filter(**{champ: derniere, f'{cle}__gt': lignes[-1][cle]})
+    return lignes, derniere
+
+
+def lire(jeton=None, limit=None):
+    # Retourne (modifications par ressource, tombstones, jeton suivant, il reste des pages)
+    limit = min(limit or SYNC['LIMIT'], SYNC['LIMIT'])
+    debut = timezone.now()
+    borne = depuis_jeton(jeton) if jeton else None
+    if borne is not None and borne < debut - timedelta(days=SYNC['RETENTION_JOURS']):
+        raise JetonExpire(jeton)
+
+    modifications = {}
+    tronquees = []
+    for nom, modele, colonnes in RESSOURCES:
+        cle = colonnes[0]
+        queryset = modele.objects.order_by('date_maj', cle).values(*colonnes)
+        if borne is not None:
+            queryset = queryset.filter(date_maj__gte=borne)
+        modifications[nom], derniere = page(queryset, 'date_maj', cle, limit)
+        if derniere is not None:
+            tronquees.append(derniere)
+
+    suppressions = []
+    if borne is not None:
+        # Une synchronisation complète n'a rien à supprimer
+        queryset = (Suppression.objects.filter(date__gte=borne).order_by('date', 'id_suppression')
+                    .values('id_suppression', 'ressource', 'objet_id', 'date'))
+        suppressions, derniere = page(queryset, 'date', 'id_suppression', limit)
+        if derniere is not None:
+            tronquees.append(derniere)
+        suppressions = [{'type': s['ressource'], 'id': s['objet_id'], 'date': s['date']} for s in suppressions]
+
+    if tronquees:
+        # Les ressources non tronquées seront en partie relues, sans conséquence
+        suivant = min(tronquees) + MICROSECONDE
+    else:
+        suivant = debut - timedelta(seconds=SYNC['MARGE'])
+    return modifications, suppressions, en_jeton(suivant), bool(tronquees)
+
+
+def appliquer(request, user, operations):
+    # Les opérations d'un lot sont appliquées dans l'ordre de la file de la tablette
+    auteurs = {modele: modele.objects.filter(pk=user.pk).first() for modele in (Medecin, Laborantin)}
+    return [appliquer_operation(request, user, auteurs, operation) for operation in operations]
+
+
+def appliquer_operation(request, user, auteurs, operation):
+    if not isinstance(operation, dict):
+        return {'operation': None, 'statut': 'erreur', 'message': 'Each operation must be an object'}
+    cle = str(operation.get('operation') or '')
+    if not cle or len(cle) > 64:
+        return {'operation': cle, 'statut': 'erreur', 'message': 'operation (1 to 64 characters) is required'}
+    resultat = OperationSync.objects.filter(utilisateur_id=user.pk, operation=cle).values_list('resultat', flat=True).first()
+    if resultat is not None:
+        return resultat
+    try:
+        with transaction.atomic():
+            resultat = {'operation': cle, **executer(request, auteurs, operation)}
+            if resultat['statut'] == 'ok':
+                OperationSync.objects.create(utilisateur_id=user.pk, hopital_id=user.hopital_id, operation=cle, resultat=resultat)
+    except IntegrityError:
+        # Le même lot appliqué en parallèle : l'autre requête a gagné, son résultat fait foi
+        resultat = OperationSync.objects.filter(utilisateur_id=user.pk, operation=cle).values_list('resultat', flat=True).first()
+        if resultat is None:
+            raise
+    return resultat
+
+
+def executer(request, auteurs, operation):
+    type_ = operation.get('type')
+    if type_ not in ECRITURES:
+        return {'statut': 'erreur', 'message': f"type must be one of {', '.join(ECRITURES)}"}
+    serializer_class, modele, champ_dossier, champ_auteur, modele_auteur = ECRITURES[type_]
+    auteur = auteurs[modele_auteur]
+    if auteur is None:
+        return {'statut': 'interdit', 'message': f'Only a {modele_auteur.__name__} can write a {type_}'}
+
+    donnees = dict(operation.get('donnees') or {})
+    objet_id = operation.get('id')
+    try:
+        version = int(operation['version']) if operation.get('version') is not None else None
+    except (TypeError, ValueError):
+        return {'statut': 'erreur', 'message': 'version must be a number'}
+    if objet_id is None:
+        instance = None
+        dossier = DossierMedical.objects.filter(pk=donnees.pop('dossier', None)).first()
+        if dossier is None:
+            return {'statut': 'introuvable', 'message': 'Dossier not found'}
+        dossier_id = dossier.pk
+    else:
+        instance = modele.objects.filter(pk=objet_id).first()
+        if instance is None:
+            return {'statut': 'introuvable', 'message': f'{modele.__name__} not found'}
+        dossier_id = instance.dossier_suivi_id
+        if version != instance.version:
+            return conflit(instance, serializer_class)
+        if type_ == 'ordonnance' and 'medicaments' not in donnees:
+            return {'statut': 'erreur', 'message': 'medicaments is required'}
+        donnees.pop('dossier', None)
+
+    donnees[champ_dossier] = dossier_id
+    donnees[champ_auteur] = auteur.pk
+    serializer = serializer_class(instance, data=donnees, partial=instance is not None,
+                                  context={'version': version})
+    if not serializer.is_valid():
+        return {'statut': 'erreur', 'erreurs': serializer.errors}
+    if instance is None:
+        # Dossier archivé : contenu remis en place avant l'écriture, seulement pour une opération valide
+        archivage.rehydrater(dossier)
+
+    interactions = None
+    if type_ == 'ordonnance':
+        # Comme rediger_ordonnance : interactions avec les traitements en cours du patient
+        nouveaux = [traitement['medicament']['nom'] for traitement in serializer.validated_data['medicaments']]
+        actifs = Traitement.objects.actifs().filter(ordonnance__dpi_patient=dossier_id)
+        if instance is not None:
+            actifs = actifs.exclude(ordonnance=instance)
+        interactions = get_interactions().verifier(nouveaux, actifs.values_list('medicament__nom', flat=True))
+    try:
+        instance = serializer.save()
+    except VersionConflict:
+        instance.refresh_from_db()
+        return conflit(instance, serializer_class)
+    audit.ecriture(request, auteur, type_, instance.pk, dossier_id)
+
+    resultat = {'statut': 'ok', 'type': type_, 'id': instance.pk, 'version': instance.version}
+    if interactions is not None:
+        resultat['interactions'] = interactions
+    return resultat
+
+
+def conflit(instance, serializer_class):
+    # La tablette reçoit la version du serveur pour fusionner puis renvoyer l'opération
+    return {'statut': 'conflit', 'id': instance.pk, 'version': instance.version,
+            'serveur': serializer_class(instance).data}
+
+
+def purger(avant=None):
+    avant = avant or timezone.now() - timedelta(days=SYNC['RETENTION_JOURS'])
+    suppressions, _ = Suppression.tous.filter(date__lt=avant).delete()
+    operations, _ = OperationSync.objects.filter(date__lt=avant).delete()
+    return suppressions, operations
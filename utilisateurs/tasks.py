@@ -0,0 +1,118 @@
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Tache, DossierMedical
+from .tenancy import activer, hopital_courant
+
+# File de tâches sans broker externe : les tâches sont des lignes de la table Tache,
+# insérées par les vues et exécutées par les processus de manage.py runworker.
+
+TASK_QUEUE = {
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_BASE': 2,      # secondes, doublé à chaque nouvel essai
+    'BACKOFF_MAX': 600,
+    'POLL_INTERVAL': 1,     # secondes entre deux lectures quand la file est vide
+    'CLAIM_BATCH': 10,
+    **getattr(settings, 'TASK_QUEUE', {}),
+}
+
+registry = {}
+
+
+def task(func):
+    # Enregistre une fonction pour qu'elle puisse être exécutée par le worker
+    registry[func.__name__] = func
+    return func
+
+
+def enqueue(nom, *args, delay=0, max_tentatives=None):
+    if nom not in registry:
+        raise KeyError(f'Unknown task {nom}')
+    return Tache.objects.create(
+        nom=nom,
+        arguments=list(args),
+        max_tentatives=max_tentatives or TASK_QUEUE['MAX_ATTEMPTS'],
+        executer_apres=timezone.now() + timedelta(seconds=delay),
+        hopital_id=hopital_courant(),
+    )
+
+
+def backoff(tentatives):
+    return min(TASK_QUEUE['BACKOFF_BASE'] * 2 ** (tentatives - 1), TASK_QUEUE['BACKOFF_MAX'])
+
+
+def claim_next():
+    # Plusieurs workers lisent la même file : une tâche est réservée par un UPDATE
+    # conditionnel sur son statut, sans verrou, seul le premier UPDATE la prend.
+    now = timezone.now()
+    ready = (Tache.objects
+             .filter(statut=Tache.EN_ATTENTE, executer_apres__lte=now)
+             .order_by('executer_apres', 'id_tache')
+             .values_list('id_tache', flat=True)[:TASK_QUEUE['CLAIM_BATCH']])
+    for id_tache in ready:
+        claimed = Tache.objects.filter(id_tache=id_tache, statut=Tache.EN_ATTENTE).update(
+            statut=Tache.EN_COURS, tentatives=F('tentatives') + 1, date_debut=now
+        )
+        if claimed:
+            return Tache.objects.get(id_tache=id_tache)
+    return None
+
+
+def execute(tache):
+    try:
+        # Dans l'hôpital de la requête qui a enfilé la tâche, comme la vue
+        with activer(tache.hopital_id):
+            resultat = registry[tache.nom](*tache.arguments)
+    except Exception:
+        erreur = traceback.format_exc()
+        if tache.tentatives < tache.max_tentatives:
+            Tache.objects.filter(id_tache=tache.id_tache).update(
+                statut=Tache.EN_ATTENTE,
+                erreur=erreur,
+                executer_apres=timezone.now() + timedelta(seconds=backoff(tache.tentatives)),
+            )
+        else:
+            Tache.objects.filter(id_tache=tache.id_tache).update(
+                statut=Tache.ECHOUEE, erreur=erreur, date_fin=timezone.now()
+            )
+        return False
+
+    Tache.objects.filter(id_tache=tache.id_tache).update(
+        statut=Tache.TERMINEE, resultat=resultat, erreur='', date_fin=timezone.now()
+    )
+    return True
+
+
+def run_worker(stop=None, once=False):
+    # Boucle d'un processus worker, stop est un multiprocessing.Event optionnel
+    while stop is None or not stop.is_set():
+        close_old_connections()
+        tache = claim_next()
+        if tache is None:
+            if once:
+                return
+            time.sleep(TASK_QUEUE['POLL_INTERVAL'])
+            continue
+        execute(tache)
+
+
+def requeue_stale(older_than):
+    # Tâches restées "en cours" après l'arrêt brutal d'un worker
+    return Tache.objects.filter(
+        statut=Tache.EN_COURS, date_debut__lt=timezone.now() - older_than
+    ).update(statut=Tache.EN_ATTENTE)
+
+
+# Tâches
+
+@task
+def generer_qr_code(dossier_id):
+    dossier = DossierMedical.objects.select_related('patient').get(pk=dossier_id)
+    dossier.generer_qr_code()
+    return dossier.qr_code.name
@@ -0,0 +1,40 @@
+import contextlib
+import contextvars
+
+from django.db import models
+
+# Un déploiement sert plusieurs hôpitaux. L'hôpital de la requête (celui de l'utilisateur du
+# token, voir middleware.HopitalMiddleware) est gardé dans une ContextVar et TenantManager
+# ajoute le filtre sur l'hôpital à toutes les requêtes des modèles concernés.
+# Hors requête (worker, commandes, admin), aucun hôpital n'est actif : pas de filtre.
+
+_hopital = contextvars.ContextVar('hopital', default=None)
+
+
+def hopital_courant():
+    return _hopital.get()
+
+
+@contextlib.contextmanager
+def activer(hopital_id):
+    token = _hopital.set(hopital_id)
+    try:
+        yield
+    finally:
+        _hopital.reset(token)
+
+
+class TenantManager(models.Manager):
+    """
+    Default manager of tenant-scoped models. The model gives the lookup path to
+    its Hopital in `chemin_hopital` ('hopital', 'dpi__hopital'...), read from the
+    model rather than passed to __init__ so that related managers keep it.
+    Use the unscoped `tous` manager for cross-hospital work.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        hopital_id = hopital_courant()
+        if hopital_id is None:
+            return queryset
+        return queryset.filter(**{self.model.chemin_hopital: hopital_id})
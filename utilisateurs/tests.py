@@ -1,3 +1,720 @@
-from django.test import TestCase
+import datetime
+import threading
+import time
+from unittest import mock
+
+import jwt
+from django.core.exceptions import ValidationError
+from django.contrib.auth.hashers import check_password
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import archivage, audit, coalescence, doublons, hospitalisation, planning, views
+from .fastpath import ordonnances_data, prefetch_ordonnances
+from .models import *
+from .serializers import OrdonnanceSerializer
 
 # Create your tests here.
+
+# Les événements d'audit des tests partent avec la base de test : rien à écrire à la sortie
+audit.AUDIT['FLUSH_AT_EXIT'] = False
+
+
+class OrdonnancesFastPathTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        medecin = Medecin.objects.create(nom='Benali', prenom='Amine', email='medecin@example.com')
+        medicaments = [
+            Medicament.objects.create(nom='Doliprane', dosage='500mg', forme='Comprimé'),
+            Medicament.objects.create(nom='Amoxicilline', dosage='1g', forme='Sachet'),
+            Medicament.objects.create(nom='Sirop "toux"', dosage='5ml', forme='Sirop'),
+        ]
+        for i in range(3):
+            patient = Patient.objects.create(
+                nom=f'Patient{i}', prenom='Test', email=f'patient{i}@example.com',
+                nss=f'00000000000{i}', date_naissance='1990-01-01'
+            )
+            dossier = DossierMedical.objects.create(patient=patient)
+            for j in range(3):
+                ordonnance = Ordonnance.objects.create(date=f'2024-0{j + 1}-1{i}', medecin=medecin, dpi_patient=dossier)
+                for k in range(j):  # Une ordonnance sans traitement, puis 1, puis 2
+                    Traitement.objects.create(
+                        ordonnance=ordonnance, medicament=medicaments[(i + k) % 3],
+                        quantite=k + 1, duree=f'{k + 7} jours', description='Avant repas, éviter l\'alcool'
+                    )
+        Ordonnance.objects.first().update_if_version(0, date='2024-12-31')
+
+    def test_output_identical_to_serializer(self):
+        queryset = Ordonnance.objects.order_by('-date', '-id_ordonnance')
+        expected = JSONRenderer().render(OrdonnanceSerializer(prefetch_ordonnances(queryset), many=True).data)
+        self.assertEqual(JSONRenderer().render(ordonnances_data(queryset)), expected)
+
+    def test_filtered_and_empty_querysets(self):
+        queryset = Ordonnance.objects.filter(dpi_patient__patient__nss='000000000001').order_by('id_ordonnance')
+        self.assertEqual(
+            JSONRenderer().render(ordonnances_data(queryset)),
+            JSONRenderer().render(OrdonnanceSerializer(prefetch_ordonnances(queryset), many=True).data),
+        )
+        self.assertEqual(ordonnances_data(Ordonnance.objects.none()), [])
+
+    def test_two_queries(self):
+        with self.assertNumQueries(2):
+            ordonnances_data(Ordonnance.objects.all())
+
+
+class DossierVersionTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.medecin = Medecin.objects.create(nom='Benali', prenom='Amine', email='medecin@example.com')
+        cls.patient = Patient.objects.create(nom='Patient', prenom='Un', email='patient@example.com',
+                                             nss='000000000001', date_naissance='1980-01-01')
+        cls.dossier = DossierMedical.objects.create(patient=cls.patient)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=jwt.encode({'id': self.medecin.id_utilisateur}, 'secret', algorithm='HS256'))
+        self.url = f'/api/dossier/{self.dossier.pk}'
+
+    def test_update_requires_current_version(self):
+        etag = self.client.get(self.url)['ETag']
+        reponse = self.client.put(self.url, {'telephone': '0600000000'}, format='json')
+        self.assertEqual(reponse.status_code, 428)
+        reponse = self.client.put(self.url, {'telephone': '0600000000'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(reponse.status_code, 200)
+        self.assertNotEqual(reponse['ETag'], etag)
+
+        # Version périmée : rien n'est écrit, la version courante est renvoyée
+        reponse = self.client.put(self.url, {'telephone': '0700000000', 'date_cloture': '2024-06-01'},
+                                  format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(reponse.status_code, 412)
+        self.assertEqual(reponse.data['version'], self.dossier.version + 1)
+        self.patient.refresh_from_db()
+        self.dossier.refresh_from_db()
+        self.assertEqual((self.patient.telephone, self.dossier.date_cloture), ('0600000000', None))
+
+    def test_patient_fields_are_validated(self):
+        etag = self.client.get(self.url)['ETag']
+        reponse = self.client.put(self.url, {'telephone': '0' * 20, 'mutuelle': 'CNAS'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(reponse.status_code, 400)
+        self.assertIn('telephone', reponse.data)
+        self.patient.refresh_from_db()
+        self.dossier.refresh_from_db()
+        self.assertEqual((self.patient.mutuelle, f'"{self.dossier.version}"'), (None, etag))
+
+    def test_patients_read_only_their_own_records(self):
+        autre = Patient.objects.create(nom='Patient', prenom='Deux', email='autre@example.com',
+                                       nss='000000000002', date_naissance='1980-01-01')
+        autre_dossier = DossierMedical.objects.create(patient=autre)
+        ordonnance = Ordonnance.objects.create(date='2024-01-10', medecin=self.medecin, dpi_patient=self.dossier)
+        resume = Resume.objects.create(date='2024-01-10', description='Contrôle', dpi=self.dossier, medecin=self.medecin)
+        bilan = BilanBiologique.objects.create(date='2024-01-10', result='Normal', dpi=self.dossier)
+        urls = [self.url, f'/api/ordonnance/{ordonnance.pk}', f'/api/resume/{resume.pk}', f'/api/bilan/{bilan.pk}']
+        for patient, attendu in ((self.patient, 200), (autre, 403)):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=jwt.encode({'id': patient.id_utilisateur}, 'secret', algorithm='HS256'))
+            self.assertEqual([client.get(url).status_code for url in urls], [attendu] * len(urls))
+        self.assertEqual(self.client.get(f'/api/dossier/{autre_dossier.pk}').status_code, 200)
+
+    def test_ordonnance_update_requires_medicaments(self):
+        ordonnance = Ordonnance.objects.create(date='2024-01-10', medecin=self.medecin, dpi_patient=self.dossier)
+        reponse = self.client.put(f'/api/ordonnance/{ordonnance.pk}', {'date': '2024-01-11'}, format='json', HTTP_IF_MATCH='"0"')
+        self.assertEqual(reponse.status_code, 400)
+
+
+class AuditBufferTest(TestCase):
+
+    def test_failed_flush_keeps_newest_events(self):
+        buffer = audit.AuditBuffer(buffer_size=4, batch_size=2, flush_interval=60)
+        buffer.demarrer = lambda: None
+        for i in range(3):
+            buffer.ajouter(AuditAcces(date=timezone.now(), ressource='dossier', objet_id=i, action=AuditAcces.LECTURE))
+
+        def echec(batch):
+            # Arrivés pendant l'écriture, hors du verrou
+            for i in range(3, 6):
+                buffer.ajouter(AuditAcces(date=timezone.now(), ressource='dossier', objet_id=i, action=AuditAcces.LECTURE))
+            raise ConnectionError('base indisponible')
+
+        with mock.patch.object(AuditAcces.tous, 'bulk_create', side_effect=echec):
+            with self.assertRaises(ConnectionError):
+                buffer.flush()
+        self.assertEqual([event.objet_id for event in buffer.events], [2, 3, 4, 5])
+        self.assertEqual(buffer.perdus, 2)
+
+        with self.assertLogs('utilisateurs.audit', 'WARNING'):
+            buffer.flush()
+        self.assertEqual(list(AuditAcces.tous.order_by('objet_id').values_list('objet_id', flat=True)), [2, 3, 4, 5])
+        self.assertEqual((len(buffer.events), buffer.perdus), (0, 0))
+
+
+class CoalescenceTest(TransactionTestCase):
+    # Les requêtes simultanées tournent dans des threads, chacun avec sa connexion : les
+    # données doivent être commitées (TransactionTestCase)
+    SIMULTANEES = 8
+    TABLES = ('dossiermedical', 'resume', 'ordonnance', 'traitement', 'bilanbiologique')
+
+    def setUp(self):
+        medecin = Medecin.objects.create(nom='Benali', prenom='Amine', email='medecin@example.com')
+        patient = Patient.objects.create(nom='Patient', prenom='Critique', email='patient@example.com',
+                                         nss='000000000001', date_naissance='1950-01-01')
+        self.dossier = DossierMedical.objects.create(patient=patient)
+        medicament = Medicament.objects.create(nom='Doliprane', dosage='500mg', forme='Comprimé')
+        for i in range(3):
+            Resume.objects.create(date=f'2024-01-1{i}', description='Douleur thoracique', dpi=self.dossier, medecin=medecin)
+            ordonnance = Ordonnance.objects.create(date=f'2024-01-1{i}', medecin=medecin, dpi_patient=self.dossier)
+            Traitement.objects.create(ordonnance=ordonnance, medicament=medicament, quantite=1, duree='7 jours')
+            BilanBiologique.objects.create(date=f'2024-01-1{i}', result='Troponine élevée', dpi=self.dossier)
+        self.token = jwt.encode({'id': medecin.id_utilisateur, 'hopital': None}, 'secret', algorithm='HS256')
+
+    def rafale(self):
+        # SIMULTANEES lectures du même dossier ; retourne (réponses, requêtes SQL sur les tables cliniques)
+        requetes = []
+        compteur_lock = threading.Lock()
+
+        def compter(execute, sql, params, many, context):
+            if any(f'utilisateurs_{table}' in sql for table in self.TABLES):
+                with compteur_lock:
+                    requetes.append(sql)
+            return execute(sql, params, many, context)
+
+        def installer(sender, connection, **kwargs):
+            connection.execute_wrappers.append(compter)
+
+        # Le calcul du premier arrivé ne commence qu'une fois toutes les requêtes en attente
+        charger = views.chargerDossier
+
+        def charger_apres_arrivees(request, id_dossier):
+            fin = time.monotonic() + 5
+            while time.monotonic() < fin and any(vol.suiveurs < self.SIMULTANEES - 1 for vol in coalescence.vols.en_cours.values()):
+                time.sleep(0.001)
+            return charger(request, id_dossier)
+
+        reponses = [None] * self.SIMULTANEES
+        depart = threading.Barrier(self.SIMULTANEES)
+
+        def lire(i):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=self.token)
+            try:
+                depart.wait()
+                reponses[i] = client.get(f'/api/dossier/{self.dossier.pk}')
+            finally:
+                connection.close()
+
+        connection_created.connect(installer)
+        try:
+            with mock.patch.object(views, 'chargerDossier', charger_apres_arrivees):
+                threads = [threading.Thread(target=lire, args=(i,)) for i in range(self.SIMULTANEES)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            connection_created.disconnect(installer)
+        return reponses, requetes
+
+    def test_burst_runs_dossier_queries_once(self):
+        with mock.patch.dict(coalescence.COALESCENCE, ACTIF=False):
+            reponses, sans_coalescence = self.rafale()
+        self.assertEqual({reponse.status_code for reponse in reponses}, {200})
+        par_lecture = len(sans_coalescence) // self.SIMULTANEES
+        self.assertGreater(par_lecture, 0)
+        self.assertEqual(len(sans_coalescence), par_lecture * self.SIMULTANEES)
+
+        partages = coalescence.vols.partages
+        reponses, avec_coalescence = self.rafale()
+        self.assertEqual({reponse.status_code for reponse in reponses}, {200})
+        self.assertEqual(len(avec_coalescence), par_lecture)
+        self.assertEqual(coalescence.vols.partages - partages, self.SIMULTANEES - 1)
+        self.assertEqual(len({reponse.content for reponse in reponses}), 1)
+        self.assertEqual(reponses[0].json()['id'], self.dossier.pk)
+        self.assertEqual(len(reponses[0].json()['consultations']), 3)
+        self.assertEqual(coalescence.vols.en_cours, {})
+
+    def test_error_is_shared_and_not_kept(self):
+        libere = threading.Event()
+
+        def calcul():
+            libere.wait(5)
+            raise ValueError('base indisponible')
+
+        erreurs = []
+
+        def lire():
+            try:
+                coalescence.partager('erreur', calcul)
+            except ValueError as erreur:
+                erreurs.append(str(erreur))
+
+        threads = [threading.Thread(target=lire) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while 'erreur' not in coalescence.vols.en_cours or coalescence.vols.en_cours['erreur'].suiveurs < 2:
+            time.sleep(0.001)
+        libere.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(erreurs, ['base indisponible'] * 3)
+        # Rien n'est gardé : l'appel suivant recalcule
+        self.assertEqual(coalescence.partager('erreur', lambda: 'ok'), 'ok')
+
+    def test_interrupted_leader_releases_the_key(self):
+        def calcul():
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            coalescence.partager('interrompu', calcul)
+        self.assertEqual(coalescence.vols.en_cours, {})
+        self.assertEqual(coalescence.partager('interrompu', lambda: 'ok'), 'ok')
+
+
+def prochain(jour_semaine):
+    # Prochaine date (après aujourd'hui) de ce jour de la semaine
+    jour = timezone.localdate() + datetime.timedelta(days=1)
+    return jour + datetime.timedelta(days=(jour_semaine - jour.weekday()) % 7)
+
+
+def horaire(jour, heure, minute=0):
+    return timezone.make_aware(datetime.datetime.combine(jour, datetime.time(heure, minute)))
+
+
+class PlanningTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.medecin = Medecin.objects.create(nom='Benali', prenom='Amine', email='medecin@example.com')
+        cls.patient = Patient.objects.create(nom='Patient', prenom='Un', email='patient@example.com',
+                                             nss='000000000001', date_naissance='1980-01-01')
+        cls.autre = Patient.objects.create(nom='Patient', prenom='Deux', email='autre@example.com',
+                                           nss='000000000002', date_naissance='1980-01-01')
+        cls.administratif = Administratif.objects.create(nom='Admin', prenom='Un', email='admin@example.com')
+        cls.jour = prochain(0)
+        Disponibilite.objects.create(medecin=cls.medecin, jour_semaine=0, heure_debut=datetime.time(8),
+                                     heure_fin=datetime.time(12), duree_creneau=20)
+
+    def client_de(self, utilisateur):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=jwt.encode({'id': utilisateur.id_utilisateur}, 'secret', algorithm='HS256'))
+        return client
+
+    def test_overlapping_plage_is_rejected(self):
+        plage = Disponibilite(medecin=self.medecin, jour_semaine=0, heure_debut=datetime.time(11),
+                              heure_fin=datetime.time(13), duree_creneau=15)
+        with self.assertRaises(ValidationError):
+            plage.full_clean()
+        plage.jour_semaine = 1
+        plage.full_clean()
+
+    def test_overlapping_slots_of_two_plages(self):
+        # Plages antérieures à la validation : créneaux de 8:00 et 8:10 qui se chevauchent
+        Disponibilite.objects.create(medecin=self.medecin, jour_semaine=0, heure_debut=datetime.time(8, 10),
+                                     heure_fin=datetime.time(12), duree_creneau=20)
+        planning.reserver(self.medecin.pk, self.patient.pk, horaire(self.jour, 8))
+        with self.assertRaises(planning.CreneauIndisponible):
+            planning.reserver(self.medecin.pk, self.autre.pk, horaire(self.jour, 8, 10))
+        self.assertEqual(RendezVous.objects.count(), 1)
+
+    def test_booking_requires_fields(self):
+        client = self.client_de(self.patient)
+        reponse = client.post('/api/rendezvous', {'nss': self.patient.nss}, format='json')
+        self.assertEqual(reponse.status_code, 400)
+        reponse = client.post('/api/rendezvous', {'nss': self.patient.nss, 'medecin': 'abc',
+                                                  'debut': horaire(self.jour, 8).isoformat()}, format='json')
+        self.assertEqual(reponse.status_code, 400)
+        reponse = client.post('/api/rendezvous', {'nss': self.patient.nss, 'medecin': self.medecin.pk,
+                                                  'debut': horaire(self.jour, 8).isoformat()}, format='json')
+        self.assertEqual(reponse.status_code, 201)
+
+    def test_cancel_is_reserved_to_participants_and_administratifs(self):
+        for utilisateur, attendu in ((self.autre, 403), (self.patient, 204), (self.medecin, 204), (self.administratif, 204)):
+            rendez_vous = planning.reserver(self.medecin.pk, self.patient.pk, horaire(self.jour, 9))
+            reponse = self.client_de(utilisateur).delete(f'/api/rendezvous/{rendez_vous.pk}')
+            self.assertEqual(reponse.status_code, attendu)
+            RendezVous.objects.filter(pk=rendez_vous.pk).delete()
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class PlanningConcurrenceTest(TransactionTestCase):
+    # Deux réservations simultanées de créneaux qui se chevauchent (8:00 et 8:10) : la seconde
+    # doit voir la première. Chaque réservation attend l'autre après sa vérification ; sans le
+    # verrou sur le médecin, les deux vérifications passent avant la première insertion.
+
+    def setUp(self):
+        self.medecin = Medecin.objects.create(nom='Benali', prenom='Amine', email='medecin@example.com')
+        self.patients = [
+            Patient.objects.create(nom='Patient', prenom=str(i), email=f'patient{i}@example.com',
+                                   nss=f'00000000000{i}', date_naissance='1980-01-01')
+            for i in range(2)
+        ]
+        self.jour = prochain(0)
+        for minute in (0, 10):
+            Disponibilite.objects.create(medecin=self.medecin, jour_semaine=0, heure_debut=datetime.time(8, minute),
+                                         heure_fin=datetime.time(12), duree_creneau=20)
+
+    def test_overlapping_bookings_are_serialized(self):
+        rencontre = threading.Barrier(2)
+        verifier = planning.agendas
+
+        def verifier_puis_attendre(*args):
+            resultat = verifier(*args)
+            try:
+                rencontre.wait(1)
+            except threading.BrokenBarrierError:
+                pass
+            return resultat
+
+        resultats = [None, None]
+
+        def reserver(i, minute):
+            try:
+                resultats[i] = planning.reserver(self.medecin.pk, self.patients[i].pk, horaire(self.jour, 8, minute))
+            except planning.CreneauIndisponible as e:
+                resultats[i] = e
+            finally:
+                connection.close()
+
+        with mock.patch.object(planning, 'agendas', verifier_puis_attendre):
+            threads = [threading.Thread(target=reserver, args=(i, minute)) for i, minute in enumerate((0, 10))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(sum(isinstance(resultat, RendezVous) for resultat in resultats), 1)
+        self.assertEqual(RendezVous.objects.count(), 1)
+
+
+class TenancyTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hopital = Hopital.objects.create(code='A', nom='Hôpital A')
+        autre = Hopital.objects.create(code='B', nom='Hôpital B')
+        cls.medecin = Medecin.objects.create(nom='Benali', prenom='Amine', email='medecin@example.com', hopital=cls.hopital)
+        cls.medecin_autre = Medecin.objects.create(nom='Haddad', prenom='Sara', email='autre@example.com', hopital=autre)
+        cls.patient = Patient.objects.create(nom='Patient', prenom='Un', email='patient@example.com',
+                                             nss='000000000001', date_naissance='1980-01-01', hopital=cls.hopital)
+        cls.dossier = DossierMedical.objects.create(patient=cls.patient, hopital=cls.hopital)
+        cls.ordonnance = Ordonnance.objects.create(date='2024-01-10', medecin=cls.medecin, dpi_patient=cls.dossier)
+        cls.tache = Tache.objects.create(nom='generer_qr_code', arguments=[cls.dossier.pk], hopital_id=cls.hopital.pk)
+
+    def client_de(self, utilisateur):
+        client = APIClient()
+        token = jwt.encode({'id': utilisateur.id_utilisateur, 'hopital': utilisateur.hopital_id}, 'secret', algorithm='HS256')
+        client.credentials(HTTP_AUTHORIZATION=token)
+        return client
+
+    def test_other_hospital_rows_are_invisible(self):
+        urls = [f'/api/dossier/{self.dossier.pk}', f'/api/ordonnance/{self.ordonnance.pk}', f'/api/tache/{self.tache.pk}']
+        listes = ['/api/patients', f'/api/ordonnances?dossier={self.dossier.pk}']
+        client = self.client_de(self.medecin)
+        self.assertEqual([client.get(url).status_code for url in urls], [200, 200, 200])
+        self.assertEqual([len(client.get(url).data) for url in listes], [1, 1])
+        client = self.client_de(self.medecin_autre)
+        self.assertEqual([client.get(url).status_code for url in urls], [404, 404, 404])
+        self.assertEqual([len(client.get(url).data) for url in listes], [0, 0])
+
+    def test_patient_token_is_refused_on_staff_reads(self):
+        client = self.client_de(self.patient)
+        urls = ['/api/patients', '/api/ordonnances', '/api/dossiers', '/api/traitements/actifs', f'/api/tache/{self.tache.pk}',
+                f'/api/ordonnance/{self.ordonnance.pk}/pdf', f'/api/dossier/{self.dossier.pk}/pdf']
+        self.assertEqual([client.get(url).status_code for url in urls], [403] * len(urls))
+        self.assertEqual(client.post('/api/impression', {'dossiers': [self.dossier.pk]}, format='json').status_code, 403)
+
+
+class ArchivageTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.medecin = Medecin.objects.create(nom='Benali', prenom='Amine', email='medecin@example.com')
+        patient = Patient.objects.create(nom='Patient', prenom='Un', email='patient@example.com',
+                                         nss='000000000001', date_naissance='1940-01-01')
+        cls.dossier = DossierMedical.objects.create(patient=patient)
+        medicament = Medicament.objects.create(nom='Doliprane', dosage='500mg', forme='Comprimé')
+        ordonnance = Ordonnance.objects.create(date='2015-01-10', medecin=cls.medecin, dpi_patient=cls.dossier)
+        Traitement.objects.create(ordonnance=ordonnance, medicament=medicament, quantite=2, duree='7 jours')
+        Resume.objects.create(date='2015-01-10', description='Contrôle annuel', dpi=cls.dossier, medecin=cls.medecin)
+        BilanBiologique.objects.create(date='2015-01-10', result='Normal', dpi=cls.dossier)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=jwt.encode({'id': self.medecin.id_utilisateur}, 'secret', algorithm='HS256'))
+        self.url = f'/api/dossier/{self.dossier.pk}'
+
+    def aller_retour(self):
+        avant = self.client.get(self.url).data
+        lignes = [list(queryset.values_list('pk', flat=True)) for queryset in archivage.contenu(self.dossier.pk)]
+        archive = archivage.archiver(self.dossier.pk)
+        self.assertEqual(archive.nb_lignes, sum(map(len, lignes)))
+        self.assertEqual([queryset.count() for queryset in archivage.contenu(self.dossier.pk)], [0] * len(lignes))
+
+        # Lu depuis l'archive, sans la rehydrater
+        self.assertEqual(self.client.get(self.url).data, {**avant, 'archive': True})
+        self.assertTrue(ArchiveDossier.objects.filter(dossier=self.dossier).exists())
+
+        self.dossier.refresh_from_db()
+        self.assertTrue(archivage.rehydrater(self.dossier))
+        self.assertEqual([list(queryset.values_list('pk', flat=True)) for queryset in archivage.contenu(self.dossier.pk)], lignes)
+        self.assertFalse(ArchiveDossier.objects.filter(dossier=self.dossier).exists())
+        self.assertEqual(self.client.get(self.url).data, avant)
+        return archive
+
+    def test_round_trip(self):
+        archive = self.aller_retour()
+        self.assertEqual(archive.compression, 'zstd' if archivage.zstandard is not None else 'gzip')
+
+    def test_round_trip_gzip(self):
+        with mock.patch.dict(archivage.ARCHIVAGE, COMPRESSION='gzip'):
+            self.assertEqual(self.aller_retour().compression, 'gzip')
+
+
+class RechercheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.medecin = Medecin.objects.create(nom='Benali', prenom='Amine', email='medecin@example.com')
+        cls.patient = Patient.objects.create(nom='Patient', prenom='Un', email='patient@example.com',
+                                             nss='000000000001', date_naissance='1980-01-01')
+        dossier = DossierMedical.objects.create(patient=cls.patient)
+        notes = [
+            'Douleur abdominale modérée après le repas, pas de fièvre, transit normal, bilan sanguin demandé.',
+            'Douleurs abdominales.',
+            'Douleur thoracique à l\'effort.',
+        ]
+        cls.resumes = [Resume.objects.create(date=f'2024-01-1{i}', description=note, dpi=dossier, medecin=cls.medecin)
+                       for i, note in enumerate(notes)]
+        cls.bilan = BilanBiologique.objects.create(date='2024-01-15', result='Fièvre, CRP élevée', dpi=dossier)
+
+    def chercher(self, utilisateur, requete):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=jwt.encode({'id': utilisateur.id_utilisateur}, 'secret', algorithm='HS256'))
+        return client.get('/api/recherche', {'q': requete})
+
+    def test_all_terms_are_required_and_short_notes_rank_first(self):
+        # Pluriels et accents ramenés à la même racine ; la note courte passe devant la longue
+        reponse = self.chercher(self.medecin, 'douleurs abdominales')
+        self.assertEqual([(r['type'], r['id']) for r in reponse.data['resultats']],
+                         [('resume', self.resumes[1].pk), ('resume', self.resumes[0].pk)])
+        self.assertFalse(reponse.data['suivante'])
+        self.assertEqual([r['id'] for r in self.chercher(self.medecin, 'fievre crp').data['resultats']], [self.bilan.pk])
+        self.assertEqual(self.chercher(self.medecin, 'douleur genou').data['resultats'], [])
+
+    def test_reserved_to_staff(self):
+        self.assertEqual(self.chercher(self.patient, 'douleur').status_code, 403)
+
+
+class SyncTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.medecin = Medecin.objects.create(nom='Benali', prenom='Amine', email='medecin@example.com')
+        patient = Patient.objects.create(nom='Patient', prenom='Un', email='patient@example.com',
+                                         nss='000000000001', date_naissance='1980-01-01')
+        cls.dossier = DossierMedical.objects.create(patient=patient)
+        cls.resume = Resume.objects.create(date='2024-01-10', description='Contrôle', dpi=cls.dossier, medecin=cls.medecin)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=jwt.encode({'id': self.medecin.id_utilisateur}, 'secret', algorithm='HS256'))
+
+    def operation(self, cle, **donnees):
+        return {'operation': cle, 'type': 'resume', 'id': None, 'version': None,
+                'donnees': {'dossier': self.dossier.pk, **donnees}}
+
+    def test_token_returns_changes_and_tombstones(self):
+        complet = self.client.get('/api/sync').data
+        self.assertEqual([r['id_resume'] for r in complet['modifications']['resumes']], [self.resume.pk])
+        self.assertEqual(complet['suppressions'], [])
+
+        nouveau = self.client.post('/api/sync', {'operations': [
+            self.operation('op-1', date='2024-01-11', description='Suivi')
+        ]}, format='json').data['resultats'][0]
+        self.assertEqual(nouveau['statut'], 'ok')
+        supprime = self.resume.pk
+        self.resume.delete()
+
+        reponse = self.client.get('/api/sync', {'since': complet['jeton']}).data
+        self.assertIn(nouveau['id'], [r['id_resume'] for r in reponse['modifications']['resumes']])
+        self.assertNotIn(supprime, [r['id_resume'] for r in reponse['modifications']['resumes']])
+        self.assertEqual([(s['type'], s['id']) for s in reponse['suppressions']], [('resume', supprime)])
+        self.assertEqual(self.client.get('/api/sync', {'since': 'x'}).status_code, 400)
+
+    def test_replayed_operation_is_applied_once(self):
+        lot = {'operations': [self.operation('op-1', date='2024-01-11', description='Suivi')]}
+        premier = self.client.post('/api/sync', lot, format='json').data['resultats']
+        self.assertEqual(self.client.post('/api/sync', lot, format='json').data['resultats'], premier)
+        self.assertEqual(Resume.objects.filter(dpi=self.dossier).count(), 2)
+
+    def test_invalid_operation_leaves_archived_dossier_alone(self):
+        archivage.archiver(self.dossier.pk)
+        resultat = self.client.post('/api/sync', {'operations': [self.operation('op-1', date='pas une date')]},
+                                    format='json').data['resultats'][0]
+        self.assertEqual(resultat['statut'], 'erreur')
+        self.dossier.refresh_from_db()
+        self.assertTrue(self.dossier.archive)
+        self.assertFalse(Resume.objects.filter(dpi=self.dossier).exists())
+
+
+class DoublonsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.administratif = Administratif.objects.create(nom='Admin', prenom='Un', email='admin@example.com')
+        cls.medecin = Medecin.objects.create(nom='Benali', prenom='Amine', email='medecin@example.com')
+        cls.survivant = Patient.objects.create(nom='Haddad', prenom='Karim', email='karim@example.com',
+                                               nss='180037512345', date_naissance='1980-03-04')
+        cls.doublon = Patient.objects.create(nom='Hadad', prenom='Karim', email='karim2@example.com',
+                                             nss='180037512354', date_naissance='1980-04-03')
+        Patient.objects.create(nom='Martin', prenom='Louise', email='louise@example.com',
+                               nss='290057512345', date_naissance='1990-05-01')
+        cls.dossier = DossierMedical.objects.create(patient=cls.survivant)
+        dossier_doublon = DossierMedical.objects.create(patient=cls.doublon)
+        Resume.objects.create(date='2024-01-10', description='Contrôle', dpi=cls.dossier, medecin=cls.medecin)
+        cls.resume = Resume.objects.create(date='2024-02-10', description='Suivi', dpi=dossier_doublon, medecin=cls.medecin)
+        cls.ordonnance = Ordonnance.objects.create(date='2024-02-10', medecin=cls.medecin, dpi_patient=dossier_doublon)
+
+    def test_candidates_share_a_key_and_pass_the_threshold(self):
+        # Orthographe du nom et jour / mois inversés : proposé ; un autre patient ne l'est pas
+        candidats = doublons.candidats('Hadad', 'Karim', datetime.date(1980, 4, 3), '180037512354', None,
+                                       exclure=self.doublon.pk)
+        self.assertEqual([candidat['id_utilisateur'] for candidat in candidats], [self.survivant.pk])
+        self.assertEqual(doublons.candidats('Durand', 'Paul', datetime.date(1970, 1, 1), '', None), [])
+
+    def test_merge_moves_clinical_content(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=jwt.encode({'id': self.administratif.id_utilisateur}, 'secret', algorithm='HS256'))
+        url = f'/api/patients/{self.survivant.pk}/fusionner'
+        self.assertEqual(client.post(url, {'doublon': self.survivant.pk}, format='json').status_code, 400)
+
+        reponse = client.post(url, {'doublon': self.doublon.pk}, format='json')
+        self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(reponse.data['dossier'], self.dossier.pk)
+        self.assertEqual((reponse.data['deplaces']['resumes'], reponse.data['deplaces']['ordonnances']), (1, 1))
+        self.assertFalse(Patient.tous.filter(pk=self.doublon.pk).exists())
+        self.resume.refresh_from_db()
+        self.ordonnance.refresh_from_db()
+        self.assertEqual((self.resume.dpi_id, self.ordonnance.dpi_patient_id), (self.dossier.pk, self.dossier.pk))
+        self.assertEqual(self.resume.version, 1)  # Les tablettes relisent la note déplacée
+        self.assertEqual(Resume.objects.filter(dpi=self.dossier).count(), 2)
+
+
+class ProvisionnementTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hopital = Hopital.objects.create(code='A', nom='Hôpital A')
+        Hopital.objects.create(code='B', nom='Hôpital B')
+        cls.administratif = Administratif.objects.create(nom='Admin', prenom='Un', email='admin@example.com', hopital=cls.hopital)
+        Medecin.objects.create(nom='Benali', prenom='Amine', email='medecin@example.com', hopital=cls.hopital)
+
+    def setUp(self):
+        self.client = APIClient()
+        token = jwt.encode({'id': self.administratif.id_utilisateur, 'hopital': self.hopital.pk}, 'secret', algorithm='HS256')
+        self.client.credentials(HTTP_AUTHORIZATION=token)
+
+    def provisionner(self, *comptes):
+        return self.client.post('/api/personnel', {'comptes': list(comptes)}, format='json')
+
+    def compte(self, type_, email, **champs):
+        return {'type': type_, 'nom': 'Nom', 'prenom': 'Prénom', 'email': email, **champs}
+
+    def test_batch_is_created_in_the_admin_hospital(self):
+        reponse = self.provisionner(
+            self.compte(1, 'cardio@example.com', password='s3cret!', specialite='cardiologie'),
+            self.compte(4, 'infirmier@example.com', password='s3cret!'),
+            self.compte(3, 'labo@example.com'),
+        )
+        self.assertEqual(reponse.status_code, 201)
+        self.assertEqual([compte['type'] for compte in reponse.data['crees']], [1, 4, 3])
+        medecin = Medecin.objects.get(email='cardio@example.com')
+        self.assertEqual((medecin.specialite, medecin.hopital_id), ('cardiologie', self.hopital.pk))
+        self.assertTrue(check_password('s3cret!', medecin.password))
+        self.assertTrue(Infirmier.objects.filter(email='infirmier@example.com', hopital=self.hopital).exists())
+        self.assertEqual(Laborantin.objects.get(email='labo@example.com').password, '')
+
+    def test_invalid_batch_creates_nothing(self):
+        reponse = self.provisionner(
+            self.compte(1, 'nouveau@example.com'),
+            self.compte(1, 'medecin@example.com'),
+            self.compte(2, 'Nouveau@example.com'),
+            self.compte(9, 'autre@example.com'),
+        )
+        self.assertEqual(reponse.status_code, 400)
+        self.assertEqual([erreur['index'] for erreur in reponse.data['erreurs']], [3])
+        reponse = self.provisionner(*[self.compte(1, email) for email in
+                                      ('nouveau@example.com', 'medecin@example.com', 'Nouveau@example.com')])
+        self.assertEqual([erreur['index'] for erreur in reponse.data['erreurs']], [1, 2])
+        reponse = self.provisionner(self.compte(1, 'nouveau@example.com'), self.compte(1, 'b@example.com', hopital='B'))
+        self.assertEqual((reponse.status_code, [erreur['index'] for erreur in reponse.data['erreurs']]), (403, [1]))
+        self.assertFalse(Utilisateur.tous.filter(email__iexact='nouveau@example.com').exists())
+
+
+class OccupationLitsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hopital = Hopital.objects.create(code='A', nom='Hôpital A')
+        cls.infirmier = Infirmier.objects.create(nom='Infirmier', prenom='Un', email='infirmier@example.com', hopital=cls.hopital)
+        chambre = Chambre.objects.create(service=Service.objects.create(hopital=cls.hopital, code='CARDIO', nom='Cardiologie'),
+                                         numero='101')
+        cls.lits = [Lit.objects.create(chambre=chambre, numero=numero) for numero in ('1', '2')]
+        cls.patients = [Patient.objects.create(nom=f'Patient{i}', prenom='Test', email=f'patient{i}@example.com',
+                                               nss=f'00000000000{i}', date_naissance='1980-01-01', hopital=cls.hopital)
+                        for i in range(2)]
+        cls.dossiers = [DossierMedical.objects.create(patient=patient, hopital=cls.hopital) for patient in cls.patients]
+
+    def setUp(self):
+        # Index neuf, relu à chaque lecture : les commits des tests n'ont pas lieu (pas d'on_commit)
+        for patch in (mock.patch.object(hospitalisation, '_index', hospitalisation.IndexOccupation()),
+                      mock.patch.dict(hospitalisation.HOSPITALISATION, RAFRAICHISSEMENT=0, GAP_TIMEOUT=0)):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.client = self.client_de(self.infirmier)
+
+    def client_de(self, utilisateur):
+        client = APIClient()
+        token = jwt.encode({'id': utilisateur.id_utilisateur, 'hopital': self.hopital.pk}, 'secret', algorithm='HS256')
+        client.credentials(HTTP_AUTHORIZATION=token)
+        return client
+
+    def mouvement(self, dossier, type_, lit=None):
+        return self.client.post(f'/api/dossier/{dossier.pk}/{type_}', {'lit': lit.pk} if lit else {}, format='json')
+
+    def occupation(self):
+        reponse = self.client.get('/api/lits')
+        service, = reponse.data['services']
+        return [lit['dossier'] for lit in service['lits']], (service['occupes'], service['libres']), reponse['ETag']
+
+    def test_moves_update_the_census(self):
+        premier, second = self.dossiers
+        lits, compteurs, etag = self.occupation()
+        self.assertEqual((lits, compteurs), ([None, None], (0, 2)))
+        self.assertEqual(self.client.get('/api/lits', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.assertEqual(self.mouvement(premier, 'admission', self.lits[0]).status_code, 201)
+        self.assertEqual(self.mouvement(second, 'admission', self.lits[0]).status_code, 409)  # Lit occupé
+        self.assertEqual(self.mouvement(premier, 'admission', self.lits[1]).status_code, 409)  # Déjà dans un lit
+        lits, compteurs, nouvel_etag = self.occupation()
+        self.assertEqual((lits, compteurs), ([premier.pk, None], (1, 1)))
+        self.assertNotEqual(nouvel_etag, etag)
+
+        self.assertEqual(self.mouvement(premier, 'transfert', self.lits[1]).status_code, 201)
+        self.assertEqual(self.mouvement(second, 'admission', self.lits[0]).status_code, 201)
+        self.assertEqual(self.occupation()[:2], ([second.pk, premier.pk], (2, 0)))
+        self.assertEqual(self.mouvement(premier, 'sortie').status_code, 201)
+        self.assertEqual(self.mouvement(premier, 'sortie').status_code, 409)
+        self.assertEqual(self.occupation()[:2], ([second.pk, None], (1, 1)))
+        self.assertEqual(list(MouvementLit.objects.filter(dossier=premier).values_list('type', flat=True).order_by('seq')),
+                         [MouvementLit.ADMISSION, MouvementLit.TRANSFERT, MouvementLit.SORTIE])
+
+    def test_reserved_to_staff(self):
+        client = self.client_de(self.patients[0])
+        self.assertEqual(client.get('/api/lits').status_code, 403)
+        self.assertEqual(client.post(f'/api/dossier/{self.dossiers[0].pk}/admission', {'lit': self.lits[0].pk},
+                                     format='json').status_code, 403)
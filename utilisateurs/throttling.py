@@ -0,0 +1,162 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+# Limitation de débit par token bucket.
+# Chaque clé (email, IP, utilisateur) a un seau de `burst` jetons qui se remplit
+# à `rate` jetons par seconde ; une requête consomme un jeton, sinon DRF répond
+# 429 avec Retry-After. Le seau en mémoire suffit pour un worker, le backend
+# 'cache' (CACHES) partage les seaux entre workers.
+# Un scope peut régler une vue à part : RATE_LIMITS[scope]['vues'][nom de la vue],
+# avec son propre seau par clé.
+
+RATE_LIMITS = {
+    'BACKEND': 'memory',
+    'CACHE': 'default',
+    'login_email': {'rate': '5/min', 'burst': 5},
+    'login_ip': {'rate': '30/min', 'burst': 30},
+    'ecriture': {'rate': '120/min', 'burst': 30, 'vues': {}},
+    **getattr(settings, 'RATE_LIMITS', {}),
+}
+
+PERIODES = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+
+def parse_rate(rate):
+    # '5/min' -> 5 / 60 jetons par seconde
+    nombre, periode = rate.split('/')
+    return int(nombre) / PERIODES[periode]
+
+
+@functools.lru_cache(maxsize=None)
+def limites(scope, vue):
+    # (préfixe du seau, jetons par seconde, burst) ; le réglage de la vue remplace celui du scope
+    config = RATE_LIMITS[scope]
+    if vue in config.get('vues', {}):
+        scope, config = f'{scope}.{vue}', config['vues'][vue]
+    return scope, parse_rate(config['rate']), config.get('burst', 1)
+
+
+@functools.lru_cache(maxsize=100000)
+def identite(token):
+    # (id, exp) d'un token valide, None sinon : la signature n'est vérifiée qu'au premier passage
+    try:
+        payload = jwt.decode(token, 'secret', algorithms=['HS256'])
+        return payload['id'], payload.get('exp')
+    except (jwt.InvalidTokenError, KeyError):
+        return None
+
+
+class MemoryBucketStore:
+    # Au plus MAX_KEYS seaux, du moins récemment utilisé au plus récent : une rafale de clés
+    # nouvelles (emails inventés) évince les seaux inutilisés depuis le plus longtemps, en O(1)
+    MAX_KEYS = 100000
+
+    def __init__(self):
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def consume(self, key, rate, burst):
+        # Retourne 0 si la requête passe, sinon le nombre de secondes à attendre
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.MAX_KEYS:
+                    self.buckets.popitem(last=False)
+                # [jetons, dernier passage]
+                self.buckets[key] = [burst - 1, now]
+                return 0
+            self.buckets.move_to_end(key)
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0
+            bucket[0] = tokens
+            return (1 - tokens) / rate
+
+
+class CacheBucketStore:
+    # Partagé entre workers via le cache Django. Lecture puis écriture non atomiques :
+    # sous forte concurrence sur une même clé la limite est approximative.
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def consume(self, key, rate, burst):
+        now = time.time()
+        key = f'throttle:{key}'
+        tokens, last = self.cache.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - last) * rate)
+        timeout = int(burst / rate) + 1
+        if tokens >= 1:
+            self.cache.set(key, (tokens - 1, now), timeout)
+            return 0
+        self.cache.set(key, (tokens, now), timeout)
+        return (1 - tokens) / rate
+
+
+store = CacheBucketStore(RATE_LIMITS['CACHE']) if RATE_LIMITS['BACKEND'] == 'cache' else MemoryBucketStore()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    scope = None
+
+    def __init__(self):
+        self.delay = 0
+
+    def get_key(self, request, view):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        key = self.get_key(request, view)
+        if key is None:
+            return True
+        # @api_view nomme la classe de la vue comme la fonction
+        scope, rate, burst = limites(self.scope, type(view).__name__)
+        self.delay = store.consume(f'{scope}:{key}', rate, burst)
+        return self.delay == 0
+
+    def wait(self):
+        return self.delay
+
+
+class LoginEmailThrottle(TokenBucketThrottle):
+    scope = 'login_email'
+
+    def get_key(self, request, view):
+        if not isinstance(request.data, dict):
+            return None  # Corps JSON qui n'est pas un objet : LoginView répondra 400
+        email = request.data.get('email')
+        return email.strip().lower() if isinstance(email, str) else None
+
+
+class LoginIPThrottle(TokenBucketThrottle):
+    scope = 'login_ip'
+
+    def get_key(self, request, view):
+        return self.get_ident(request)
+
+
+class EcritureThrottle(TokenBucketThrottle):
+    # Par utilisateur (id du token), uniquement pour les méthodes d'écriture
+    scope = 'ecriture'
+
+    def get_key(self, request, view):
+        if request.method in SAFE_METHODS:
+            return None
+        token = request.headers.get('Authorization')
+        if not token:
+            return None
+        token = identite(token)
+        if token is None or (token[1] is not None and token[1] <= time.time()):
+            return None  # La vue rejettera le token
+        return token[0]
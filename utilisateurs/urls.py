@@ -7,5 +7,36 @@ urlpatterns = [
     path('login', views.LoginView.as_view()),
     path('ordonnance', views.rediger_ordonnance),
     path('bilan', views.rediger_bilan),
-    path('resume', views.rediger_resume)
+    path('resume', views.rediger_resume),
+    path('ordonnance/<int:id_ordonnance>', views.modifier_ordonnance),
+    path('resume/<int:id_resume>', views.modifier_resume),
+    path('bilan/<int:id_bilan>', views.modifier_bilan),
+    path('dossier/<int:id_dossier>', views.modifier_dossier),
+    path('tache/<int:id_tache>', views.statut_tache),
+    path('dossiers', views.tableau_de_bord),
+    path('traitements/actifs', views.traitements_actifs),
+    path('audit', views.journal_audit),
+    path('patients', views.liste_patients),
+    path('patients/doublons', views.doublons_patient),
+    path('patients/<int:id_patient>/fusionner', views.fusionner_patients),
+    path('ordonnances', views.liste_ordonnances),
+    path('creneaux', views.creneaux_disponibles),
+    path('rendezvous', views.prendre_rendez_vous),
+    path('rendezvous/<int:id_rendez_vous>', views.annuler_rendez_vous),
+    path('ordonnance/<int:id_ordonnance>/dispenser', views.dispenser_ordonnance),
+    path('stock', views.stock),
+    path('events', views.evenements),
+    path('events/ack', views.acquitter_evenements),
+    path('notifications/ticket', views.ticket_notifications),
+    path('recherche', views.recherche_notes),
+    path('sync', views.synchroniser),
+    path('ordonnance/<int:id_ordonnance>/pdf', views.ordonnance_pdf),
+    path('dossier/<int:id_dossier>/pdf', views.dossier_pdf),
+    path('impression', views.imprimer_lot),
+    path('statistiques/<str:indicateur>', views.statistiques_activite),
+    path('personnel', views.provisionner_personnel),
+    path('lits', views.occupation_lits),
+    path('dossier/<int:id_dossier>/admission', views.mouvement_lit, {'type': 'admission'}),
+    path('dossier/<int:id_dossier>/transfert', views.mouvement_lit, {'type': 'transfert'}),
+    path('dossier/<int:id_dossier>/sortie', views.mouvement_lit, {'type': 'sortie'}),
 ]
\ No newline at end of file
@@ -1,15 +1,26 @@
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, throttle_classes
 from rest_framework.views import APIView
 
 from .serializers import *
 from rest_framework.parsers import JSONParser
-from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.exceptions import AuthenticationFailed, ParseError, PermissionDenied
 from .models import *
+from .interactions import get_index as get_interactions
+from . import audit
+from .fastpath import ordonnances_data, prefetch_ordonnances
+from . import planning, pharmacie, outbox, archivage, recherche, sync, impression, statistiques, doublons, provisionnement, hospitalisation, coalescence, realtime
+from .throttling import LoginEmailThrottle, LoginIPThrottle, EcritureThrottle
+from .tenancy import hopital_courant
 import jwt, datetime
 from datetime import datetime, timedelta
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, IsAuthenticatedOrReadOnly
 from django.contrib.auth.hashers import check_password
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.db.models import Count, F, Max, prefetch_related_objects
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 
 
 
@@ -21,7 +32,7 @@ def auth(request):
         payload = jwt.decode(token, 'secret', algorithms=['HS256']) #RS256
     except jwt.ExpiredSignatureError:
         raise AuthenticationFailed("Unauthenticated, expired token")
-    except jwt.DecodeError:
+    except jwt.InvalidTokenError:
         raise AuthenticationFailed("Unauthenticated, invalid token")
     return True
 def getUserFromToken(request, type=5):
@@ -32,7 +43,7 @@ def getUserFromToken(request, type=5):
         payload = jwt.decode(token, 'secret', algorithms=['HS256']) #RS256
     except jwt.ExpiredSignatureError:
         raise AuthenticationFailed("Unauthenticated, expired token")
-    except jwt.DecodeError:
+    except jwt.InvalidTokenError:
         raise AuthenticationFailed("Unauthenticated, invalid token")
     match type:
         case 0:
@@ -45,6 +56,8 @@ def getUserFromToken(request, type=5):
             user = Laborantin.objects.get(id_utilisateur=payload['id'])
         case 4:
             user = Infirmier.objects.get(id_utilisateur=payload['id'])
+        case 6:
+            user = SGPH.objects.get(id_utilisateur=payload['id'])
         case _:
             user = Utilisateur.objects.get(id_utilisateur=payload['id'])
     return user
@@ -122,7 +135,12 @@ def getUserFromToken(request, type=5):
 
 # To login (sign in) -- classic jwt method
 class LoginView(APIView):
+    # Chaque tentative coûte un check_password : limité par email et par IP
+    throttle_classes = [LoginIPThrottle, LoginEmailThrottle]
+
     def post(self, request):
+        if not isinstance(request.data, dict):
+            raise ParseError({"message": "Expected a JSON object"})
         email = request.data['email']
         password = request.data['password']
 
@@ -137,6 +155,7 @@ class LoginView(APIView):
 
         payload = {
             'id': user.id_utilisateur,
+            'hopital': user.hopital_id,  # Lu par HopitalMiddleware pour filtrer les requêtes
             'exp': datetime.utcnow() + timedelta(days=2),
             'iat': datetime.utcnow()
         }
@@ -157,6 +176,7 @@ class LoginView(APIView):
 
 
 @api_view(['POST'])
+@throttle_classes([EcritureThrottle])
 def rediger_ordonnance(request):
 
     medecin = getUserFromToken(request, 1)
@@ -187,19 +207,31 @@ def rediger_ordonnance(request):
     serializer = OrdonnanceSerializer(data=data)
     if not serializer.is_valid():
         return Response(serializer.errors)
-    serializer.save()
+
+    with transaction.atomic():
+        # Dossier archivé : contenu remis en place dans la transaction de l'écriture
+        archivage.rehydrater(dpi)
+        # Interactions entre les nouveaux médicaments et les traitements en cours du patient
+        nouveaux = [traitement['medicament']['nom'] for traitement in serializer.validated_data['medicaments']]
+        actifs = Traitement.objects.actifs().filter(ordonnance__dpi_patient=dpi).values_list('medicament__nom', flat=True)
+        interactions = get_interactions().verifier(nouveaux, actifs)
+
+        ordonnance = serializer.save()
+    audit.ecriture(request, medecin, 'ordonnance', ordonnance.id_ordonnance, dpi.id)
 
     response = Response()
     response.data = {
         "message": "Ordonnance created successfully",
         "medecin": medecin.nom,
-        "medicaments": medicaments
+        "medicaments": medicaments,
+        "interactions": interactions
     }
     response.status_code = 201
     return response
     # return Response(serializer.data, status=201)
 
 @api_view(['POST'])
+@throttle_classes([EcritureThrottle])
 def rediger_resume(request):
     medecin = getUserFromToken(request, 1)
     if medecin is None:
@@ -223,7 +255,10 @@ def rediger_resume(request):
     serializer = ResumeSerializer(data=data)
 
     if serializer.is_valid():
-        serializer.save()
+        with transaction.atomic():
+            archivage.rehydrater(dpi)  # Dossier archivé : contenu remis en place avant l'écriture
+            resume = serializer.save()
+        audit.ecriture(request, medecin, 'resume', resume.id_resume, dpi.id)
         response = Response()
 
         response.data = {
@@ -236,10 +271,11 @@ def rediger_resume(request):
     return Response(serializer.errors)
 
 @api_view(['POST'])
+@throttle_classes([EcritureThrottle])
 def rediger_bilan(request):
-    medecin = getUserFromToken(request, 1)
-    if medecin is None:
-        raise AuthenticationFailed("This Medecin does not exist !!")
+    laborantin = getUserFromToken(request, 3)
+    if laborantin is None:
+        raise AuthenticationFailed("This Laborantin does not exist !!")
 
     patient_nss = request.data['nss']
     patient = Patient.objects.get(nss=patient_nss)
@@ -254,14 +290,17 @@ def rediger_bilan(request):
         "date": request.data['date'],
         "description": request.data['description'],
         "dpi": dpi.id,
-        "medecin": laborantin.id_utilisateur,
+        "laborantin": laborantin.id_utilisateur,
         "result": request.data['result'],
     }
 
     serializer = BilanBiologiqueSerializer(data=data)
 
     if serializer.is_valid():
-        serializer.save()
+        with transaction.atomic():
+            archivage.rehydrater(dpi)  # Dossier archivé : contenu remis en place avant l'écriture
+            bilan = serializer.save()
+        audit.ecriture(request, laborantin, 'bilan', bilan.id_bilan, dpi.id)
         response = Response()
 
         response.data = {
@@ -271,4 +310,831 @@ def rediger_bilan(request):
         }
         response.status_code = 201
         return response
-    return Response(serializer.errors)
\ No newline at end of file
+    return Response(serializer.errors)
+
+def prefetch_rendered(instances, serializer, lookups):
+    # Prefetch only the part of each relation path the (possibly sparse) serializer renders
+    def rendered(fields, path):
+        kept = []
+        for name in path:
+            nested = fields.get(name)
+            nested = getattr(nested, 'child', nested)
+            if not hasattr(nested, 'fields'):
+                break
+            kept.append(name)
+            fields = nested.fields
+        return '__'.join(kept)
+
+    serializer = getattr(serializer, 'child', serializer)
+    lookups = {rendered(serializer.fields, lookup.split('__')) for lookup in lookups} - {''}
+    if lookups:
+        prefetch_related_objects(instances, *lookups)
+
+
+# Optimistic concurrency: reads return the row version as an ETag and
+# updates must send it back in If-Match, a stale version gets a 412
+def etag(instance):
+    return f'"{instance.version}"'
+
+def getExpectedVersion(request):
+    if_match = request.headers.get('If-Match')
+    if if_match:
+        try:
+            return int(if_match.removeprefix('W/').strip('"'))
+        except ValueError:
+            return None
+    if 'version' in request.data:
+        try:
+            return int(request.data['version'])
+        except (TypeError, ValueError):
+            return None
+    return None
+
+def getStaffFromToken(request):
+    # Lectures réservées au personnel de l'hôpital : LoginView donne aussi un token aux patients
+    user = getUserFromToken(request)
+    if Patient.tous.filter(pk=user.pk).exists():
+        raise PermissionDenied({"message": "Reserved to hospital staff"})
+    return user
+
+def verifierLecture(user, dossier_id):
+    # Personnel de l'hôpital, ou le patient pour son propre dossier
+    if (Patient.tous.filter(pk=user.pk).exists()
+            and not DossierMedical.tous.filter(pk=dossier_id, patient_id=user.pk).exists()):
+        raise PermissionDenied({"message": "Patients can only read their own dossier"})
+
+def getIntParam(params, nom, defaut=None, minimum=0, maximum=None):
+    # Paramètre entier de la requête (limit, offset...) ramené entre minimum et maximum ; 400 sinon
+    if nom not in params:
+        return defaut
+    try:
+        valeur = max(int(params[nom]), minimum)
+    except (TypeError, ValueError):
+        raise ParseError({"message": f"{nom} must be an integer"})
+    return valeur if maximum is None else min(valeur, maximum)
+
+def versionedResponse(instance, data, status=200):
+    response = Response(data, status=status)
+    response['ETag'] = etag(instance)
+    return response
+
+def preconditionFailed(instance):
+    response = Response({
+        "message": "This record was modified by someone else, reload it and try again",
+        "version": instance.version
+    }, status=412)
+    response['ETag'] = etag(instance)
+    return response
+
+def versionedUpdate(request, instance, serializer_class, data, user, ressource, dossier_id):
+    version = getExpectedVersion(request)
+    if version is None:
+        return Response({"message": "If-Match header (or version) is required to modify this record"}, status=428)
+    if version != instance.version:
+        return preconditionFailed(instance)
+
+    serializer = serializer_class(instance, data=data, context={'version': version})
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=400)
+    try:
+        serializer.save()
+    except VersionConflict:
+        instance.refresh_from_db()
+        return preconditionFailed(instance)
+    audit.ecriture(request, user, ressource, instance.pk, dossier_id)
+    return versionedResponse(instance, serializer_class(instance).data)
+
+
+@api_view(['GET', 'PUT'])
+@throttle_classes([EcritureThrottle])
+def modifier_ordonnance(request, id_ordonnance):
+    ordonnance = Ordonnance.objects.filter(id_ordonnance=id_ordonnance).first()
+    if not ordonnance:
+        return Response({"message": "Ordonnance not found"}, status=404)
+
+    if request.method == 'GET':
+        user = getUserFromToken(request)
+        verifierLecture(user, ordonnance.dpi_patient_id)
+        audit.lecture(request, user, 'ordonnance', ordonnance.id_ordonnance, ordonnance.dpi_patient_id)
+        return versionedResponse(ordonnance, OrdonnanceSerializer(ordonnance, context={'request': request}).data)
+
+    medecin = getUserFromToken(request, 1)
+    if 'medicaments' not in request.data:
+        return Response({"message": "medicaments is required"}, status=400)
+    data = {
+        "date": request.data.get('date', ordonnance.date),
+        "medecin": medecin.id_utilisateur,
+        "dpi_patient": ordonnance.dpi_patient_id,
+        "medicaments": request.data['medicaments']
+    }
+    return versionedUpdate(request, ordonnance, OrdonnanceSerializer, data, medecin, 'ordonnance', ordonnance.dpi_patient_id)
+
+@api_view(['GET', 'PUT'])
+@throttle_classes([EcritureThrottle])
+def modifier_resume(request, id_resume):
+    resume = Resume.objects.filter(id_resume=id_resume).first()
+    if not resume:
+        return Response({"message": "Resume not found"}, status=404)
+
+    if request.method == 'GET':
+        user = getUserFromToken(request)
+        verifierLecture(user, resume.dpi_id)
+        audit.lecture(request, user, 'resume', resume.id_resume, resume.dpi_id)
+        return versionedResponse(resume, ResumeSerializer(resume, context={'request': request}).data)
+
+    medecin = getUserFromToken(request, 1)
+    data = {
+        "date": request.data.get('date', resume.date),
+        "description": request.data.get('description', resume.description),
+        "dpi": resume.dpi_id,
+        "medecin": medecin.id_utilisateur
+    }
+    return versionedUpdate(request, resume, ResumeSerializer, data, medecin, 'resume', resume.dpi_id)
+
+@api_view(['GET', 'PUT'])
+@throttle_classes([EcritureThrottle])
+def modifier_bilan(request, id_bilan):
+    bilan = BilanBiologique.objects.filter(id_bilan=id_bilan).first()
+    if not bilan:
+        return Response({"message": "Bilan not found"}, status=404)
+
+    if request.method == 'GET':
+        user = getUserFromToken(request)
+        verifierLecture(user, bilan.dpi_id)
+        audit.lecture(request, user, 'bilan', bilan.id_bilan, bilan.dpi_id)
+        return versionedResponse(bilan, BilanBiologiqueSerializer(bilan, context={'request': request}).data)
+
+    laborantin = getUserFromToken(request, 3)
+    data = {
+        "date": request.data.get('date', bilan.date),
+        "description": request.data.get('description', bilan.description),
+        "result": request.data.get('result', bilan.result),
+        "dpi": bilan.dpi_id,
+        "laborantin": laborantin.id_utilisateur
+    }
+    return versionedUpdate(request, bilan, BilanBiologiqueSerializer, data, laborantin, 'bilan', bilan.dpi_id)
+
+# Lectures coalescées (coalescence.py) : les requêtes simultanées avec la même clé partagent
+# un seul calcul. L'authentification et l'audit restent faits par chaque requête.
+def cleLecture(request, ressource, objet_id):
+    # Tout ce qui change le résultat : hôpital actif (TenantManager), hôte des URL absolues, ?fields= / ?expand=
+    params = request.query_params
+    return (ressource, objet_id, hopital_courant(), request.build_absolute_uri('/'),
+            params.get('fields'), params.get('expand'))
+
+def chargerDossier(request, id_dossier):
+    dpi = DossierMedical.objects.select_related('patient').filter(id=id_dossier).first()
+    if not dpi:
+        return None, None
+    if dpi.archive:
+        archivage.charger(dpi)  # Lu depuis l'archive, sans la rehydrater
+    serializer = DossierMedicalSerializer(dpi, context={'request': request})
+    prefetch_rendered([dpi], serializer, ['consultations', 'ordonnances__medicaments__medicament', 'bilans'])
+    return dpi, serializer.data
+
+
+@api_view(['GET', 'PUT'])
+@throttle_classes([EcritureThrottle])
+def modifier_dossier(request, id_dossier):
+    if request.method == 'GET':
+        user = getUserFromToken(request)
+        verifierLecture(user, id_dossier)
+        dpi, data = coalescence.partager(cleLecture(request, 'dossier', id_dossier),
+                                         lambda: chargerDossier(request, id_dossier))
+        if not dpi:
+            return Response({"message": "DPI not found"}, status=404)
+        audit.lecture(request, user, 'dossier', dpi.id, dpi.id)
+        return versionedResponse(dpi, data)
+
+    dpi = DossierMedical.objects.select_related('patient').filter(id=id_dossier).first()
+    if not dpi:
+        return Response({"message": "DPI not found"}, status=404)
+    medecin = getUserFromToken(request, 1)
+    version = getExpectedVersion(request)
+    if version is None:
+        return Response({"message": "If-Match header (or version) is required to modify this record"}, status=428)
+
+    # Only the patient's administrative data and the closing date are editable through the dossier
+    patient_serializer = PatientSerializer(dpi.patient, partial=True, data={
+        field: request.data[field]
+        for field in ('adresse', 'telephone', 'mutuelle')
+        if field in request.data
+    })
+    if not patient_serializer.is_valid():
+        return Response(patient_serializer.errors, status=400)
+    patient_fields = patient_serializer.validated_data
+    dossier_fields = {}
+    if 'date_cloture' in request.data:
+        try:
+            dossier_fields['date_cloture'] = (datetime.fromisoformat(request.data['date_cloture']).date()
+                                              if request.data['date_cloture'] else None)
+        except (TypeError, ValueError):
+            return Response({"message": "date_cloture must be an ISO 8601 date"}, status=400)
+    try:
+        with transaction.atomic():
+            dpi.update_if_version(version, **dossier_fields)
+            if patient_fields:
+                Patient.objects.filter(id_utilisateur=dpi.patient_id).update(**patient_fields, date_maj=timezone.now())
+    except VersionConflict:
+        dpi.refresh_from_db()
+        return preconditionFailed(dpi)
+
+    audit.ecriture(request, medecin, 'dossier', dpi.id, dpi.id)
+    dpi.patient.refresh_from_db()
+    return versionedResponse(dpi, DossierMedicalSerializer(dpi).data)
+
+
+@api_view(['GET'])
+def statut_tache(request, id_tache):
+    # Personnel seulement ; Tache.objects ne voit que les tâches enfilées dans l'hôpital actif
+    getStaffFromToken(request)
+    tache = Tache.objects.filter(id_tache=id_tache).first()
+    if not tache:
+        return Response({"message": "Task not found"}, status=404)
+    return Response({
+        "id": tache.id_tache,
+        "nom": tache.nom,
+        "statut": tache.statut,
+        "tentatives": tache.tentatives,
+        "resultat": tache.resultat,
+        "erreur": tache.erreur,
+        "date_creation": tache.date_creation,
+        "date_fin": tache.date_fin,
+    })
+
+
+@api_view(['GET'])
+def tableau_de_bord(request):
+    # Lecture de la table dénormalisée DossierSummary, sauf les traitements en cours (voir plus bas)
+    getStaffFromToken(request)
+    limit = getIntParam(request.query_params, 'limit', 50, maximum=500)
+    offset = getIntParam(request.query_params, 'offset', 0)
+    summaries = list(DossierSummary.objects
+                     .select_related('dossier__patient')
+                     .order_by(F('derniere_consultation').desc(nulls_last=True), 'dossier_id')[offset:offset + limit])
+    # nb_traitements : traitements en cours aujourd'hui, qui changent sans écriture. Compté pour
+    # la page, seulement dans les dossiers dont le dernier traitement n'est pas terminé
+    jour = timezone.localdate()
+    en_cours = [summary.dossier_id for summary in summaries
+                if summary.fin_traitements is not None and summary.fin_traitements >= jour]
+    actifs = dict(Traitement.tous.actifs(jour).filter(ordonnance__dpi_patient__in=en_cours)
+                  .values_list('ordonnance__dpi_patient').annotate(n=Count('pk')).order_by()) if en_cours else {}
+    for summary in summaries:
+        summary.nb_traitements = actifs.get(summary.dossier_id, 0)
+    return Response(DossierSummarySerializer(summaries, many=True).data)
+
+
+@api_view(['GET'])
+def traitements_actifs(request):
+    # ?nss= ou ?dossier= pour un patient, ?medicament= (id) ou ?medicament_nom= pour un médicament,
+    # sans filtre : tous les traitements en cours. ?date=AAAA-MM-JJ (aujourd'hui par défaut)
+    user = getStaffFromToken(request)
+    params = request.query_params
+    try:
+        jour = datetime.strptime(params['date'], '%Y-%m-%d').date() if 'date' in params else None
+    except ValueError:
+        return Response({"message": "date must be formatted as YYYY-MM-DD"}, status=400)
+
+    traitements = Traitement.objects.actifs(jour).select_related('medicament', 'ordonnance__dpi_patient__patient')
+    if 'dossier' in params:
+        traitements = traitements.filter(ordonnance__dpi_patient=getIntParam(params, 'dossier'))
+    if 'nss' in params:
+        traitements = traitements.filter(ordonnance__dpi_patient__patient__nss=params['nss'])
+    if 'medicament' in params:
+        traitements = traitements.filter(medicament=getIntParam(params, 'medicament'))
+    if 'medicament_nom' in params:
+        traitements = traitements.filter(medicament__nom=params['medicament_nom'])
+
+    traitements = list(traitements.order_by('date_fin', 'id_traitement'))
+    for dossier_id in {traitement.ordonnance.dpi_patient_id for traitement in traitements}:
+        audit.lecture(request, user, 'traitement', dossier_id=dossier_id)
+    return Response(TraitementActifSerializer(traitements, many=True).data)
+
+
+@api_view(['GET'])
+def journal_audit(request):
+    # Réservé aux administratifs, accès de leur hôpital : ?dossier= ou ?nss=, ?utilisateur=, ?debut= / ?fin= (ISO 8601)
+    getUserFromToken(request, 0)
+    params = request.query_params
+    evenements = AuditAcces.objects.all()
+    if 'nss' in params:
+        dossier = DossierMedical.objects.filter(patient__nss=params['nss']).values_list('id', flat=True).first()
+        evenements = evenements.filter(dossier_id=dossier) if dossier is not None else evenements.none()
+    if 'dossier' in params:
+        evenements = evenements.filter(dossier_id=getIntParam(params, 'dossier'))
+    if 'utilisateur' in params:
+        evenements = evenements.filter(utilisateur_id=getIntParam(params, 'utilisateur'))
+    try:
+        if 'debut' in params:
+            evenements = evenements.filter(date__gte=datetime.fromisoformat(params['debut']))
+        if 'fin' in params:
+            evenements = evenements.filter(date__lt=datetime.fromisoformat(params['fin']))
+    except ValueError:
+        return Response({"message": "debut and fin must be ISO 8601 dates"}, status=400)
+
+    limit = getIntParam(params, 'limit', 100, maximum=1000)
+    offset = getIntParam(params, 'offset', 0)
+    evenements = evenements.order_by('-date').values(
+        'date', 'utilisateur_id', 'dossier_id', 'action', 'ressource', 'objet_id', 'adresse_ip'
+    )[offset:offset + limit]
+    return Response(list(evenements))
+
+
+@api_view(['GET'])
+def liste_patients(request):
+    # Liste paginée (limit / offset), accepte ?fields= pour ne renvoyer que nom, prenom...
+    getStaffFromToken(request)
+    limit = getIntParam(request.query_params, 'limit', 100, maximum=1000)
+    offset = getIntParam(request.query_params, 'offset', 0)
+    patients = Patient.objects.order_by('nom', 'prenom', 'id_utilisateur')[offset:offset + limit]
+    return Response(PatientSerializer(patients, many=True, context={'request': request}).data)
+
+
+@api_view(['GET'])
+def liste_ordonnances(request):
+    # ?dossier= / ?nss= / ?medecin=, paginé par limit / offset
+    user = getStaffFromToken(request)
+    params = request.query_params
+    try:
+        dossier_id = int(params['dossier']) if 'dossier' in params else None
+        medecin_id = int(params['medecin']) if 'medecin' in params else None
+    except ValueError:
+        return Response({"message": "dossier and medecin must be ids"}, status=400)
+    ordonnances = Ordonnance.objects.all()
+    archivees = []
+    if 'dossier' in params or 'nss' in params:
+        # Les ordonnances d'un dossier archivé sont lues dans l'archive, sans la rehydrater
+        archives = DossierMedical.objects.filter(archive=True)
+        if dossier_id is not None:
+            archives = archives.filter(id=dossier_id)
+        if 'nss' in params:
+            archives = archives.filter(patient__nss=params['nss'])
+        for dossier in archives:
+            archivage.charger(dossier)
+            archivees += [ordonnance for ordonnance in dossier.ordonnances.all()
+                          if medecin_id is None or ordonnance.medecin_id == medecin_id]
+    if dossier_id is not None:
+        ordonnances = ordonnances.filter(dpi_patient=dossier_id)
+    if 'nss' in params:
+        ordonnances = ordonnances.filter(dpi_patient__patient__nss=params['nss'])
+    if medecin_id is not None:
+        ordonnances = ordonnances.filter(medecin=medecin_id)
+    limit = getIntParam(params, 'limit', 100, maximum=1000)
+    offset = getIntParam(params, 'offset', 0)
+    ordonnances = ordonnances.order_by('-date', '-id_ordonnance')
+
+    def rendre(ordonnances):
+        # (données, dossiers lus)
+        if 'fields' in params or 'expand' in params:
+            ordonnances = list(prefetch_ordonnances(ordonnances))
+            data = OrdonnanceSerializer(ordonnances, many=True, context={'request': request}).data
+            return data, {ordonnance.dpi_patient_id for ordonnance in ordonnances}
+        # Chemin rapide, même sortie que OrdonnanceSerializer
+        data = ordonnances_data(ordonnances)
+        return data, {ordonnance['dpi_patient'] for ordonnance in data}
+
+    if not archivees:
+        data, dossiers = rendre(ordonnances[offset:offset + limit])
+    else:
+        # La page est choisie sur les clés de tri (date, id) des deux sources, puis chacune est
+        # rendue dans cet ordre ; les ordonnances archivées passent par le serializer
+        par_cle = {(ordonnance.date, ordonnance.pk): ordonnance for ordonnance in archivees}
+        cles = list(ordonnances.values_list('date', 'id_ordonnance')[:offset + limit]) + list(par_cle)
+        page = sorted(cles, reverse=True)[offset:offset + limit]
+        courantes, dossiers = rendre(ordonnances.filter(id_ordonnance__in=[cle[1] for cle in page if cle not in par_cle]))
+        lues = [par_cle[cle] for cle in page if cle in par_cle]
+        dossiers |= {ordonnance.dpi_patient_id for ordonnance in lues}
+        courantes = iter(courantes)
+        archivees = iter(OrdonnanceSerializer(lues, many=True, context={'request': request}).data)
+        data = [next(archivees) if cle in par_cle else next(courantes) for cle in page]
+
+    for dossier_id in dossiers:
+        audit.lecture(request, user, 'ordonnance', dossier_id=dossier_id)
+    return Response(data)
+
+
+@api_view(['GET'])
+def creneaux_disponibles(request):
+    # ?specialite=cardiologie&date=AAAA-MM-JJ[&limit=]
+    getUserFromToken(request)
+    params = request.query_params
+    if 'specialite' not in params or 'date' not in params:
+        return Response({"message": "specialite and date are required"}, status=400)
+    try:
+        jour = datetime.strptime(params['date'], '%Y-%m-%d').date()
+    except ValueError:
+        return Response({"message": "date must be formatted as YYYY-MM-DD"}, status=400)
+    limite = getIntParam(params, 'limit', minimum=1)
+    return Response(planning.creneaux_libres(params['specialite'], jour, limite))
+
+@api_view(['POST'])
+@throttle_classes([EcritureThrottle])
+def prendre_rendez_vous(request):
+    user = getUserFromToken(request)
+    if not all(champ in request.data for champ in ('nss', 'medecin', 'debut')):
+        return Response({"message": "nss, medecin and debut are required"}, status=400)
+    patient = Patient.objects.filter(nss=request.data['nss']).first()
+    if not patient:
+        raise AuthenticationFailed("Patient does not exist, you need to add it first")
+    # Un patient ne réserve que pour lui-même
+    if patient.pk != user.pk and Patient.tous.filter(pk=user.pk).exists():
+        return Response({"message": "Patients can only book for themselves"}, status=403)
+    try:
+        medecin = int(request.data['medecin'])
+        debut = datetime.fromisoformat(request.data['debut'])
+    except (TypeError, ValueError):
+        return Response({"message": "medecin must be an id and debut an ISO 8601 datetime"}, status=400)
+    if timezone.is_naive(debut):
+        debut = timezone.make_aware(debut)
+
+    try:
+        rendez_vous = planning.reserver(medecin, patient.id_utilisateur, debut, request.data.get('motif', ''))
+    except planning.CreneauIndisponible as e:
+        return Response({"message": str(e)}, status=409)
+    return Response(RendezVousSerializer(rendez_vous).data, status=201)
+
+@api_view(['DELETE'])
+@throttle_classes([EcritureThrottle])
+def annuler_rendez_vous(request, id_rendez_vous):
+    user = getUserFromToken(request)
+    rendez_vous = RendezVous.objects.filter(id_rendez_vous=id_rendez_vous).first()
+    if not rendez_vous:
+        return Response({"message": "Rendez-vous not found"}, status=404)
+    # Le patient, le médecin du rendez-vous ou un administratif
+    if user.pk not in (rendez_vous.patient_id, rendez_vous.medecin_id) and not Administratif.tous.filter(pk=user.pk).exists():
+        return Response({"message": "Only the patient, the medecin or an administratif can cancel this rendez-vous"}, status=403)
+    # Supprimer la ligne libère le créneau pour la contrainte unique
+    rendez_vous.delete()
+    return Response(status=204)
+
+
+@api_view(['POST'])
+@throttle_classes([EcritureThrottle])
+def dispenser_ordonnance(request, id_ordonnance):
+    sgph = getUserFromToken(request, 6)
+    ordonnance = Ordonnance.objects.filter(id_ordonnance=id_ordonnance).first()
+    if not ordonnance:
+        return Response({"message": "Ordonnance not found"}, status=404)
+
+    # Quantités explicites {"quantites": {"<id_medicament>": n}} ou calculées depuis les traitements
+    besoins = pharmacie.besoins_ordonnance(ordonnance)
+    serializer = DispensationSerializer(data=request.data, context={'besoins': besoins})
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=400)
+    besoins = serializer.validated_data.get('quantites', besoins)
+    try:
+        dispensation = pharmacie.dispenser(ordonnance, sgph, besoins)
+    except pharmacie.DispensationImpossible as e:
+        return Response({"message": str(e), "manquants": e.manquants}, status=409)
+
+    audit.ecriture(request, sgph, 'dispensation', dispensation.id_dispensation, ordonnance.dpi_patient_id)
+    return Response({
+        "message": "Ordonnance dispensed successfully",
+        "dispensation": dispensation.id_dispensation,
+        "lignes": list(dispensation.lignes.values('medicament', 'quantite')),
+    }, status=201)
+
+@api_view(['GET', 'POST'])
+@throttle_classes([EcritureThrottle])
+def stock(request):
+    getUserFromToken(request, 6)
+    if request.method == 'POST':
+        # Réapprovisionnement : {"medicament": id, "quantite": n}
+        serializer = ReapprovisionnementSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=400)
+        medicament = serializer.validated_data['medicament']
+        pharmacie.reapprovisionner(medicament.pk, serializer.validated_data['quantite'])
+        return Response(StockSerializer(pharmacie.stocks().select_related('medicament').get(medicament=medicament)).data)
+    if 'alertes' in request.query_params:
+        stocks = pharmacie.stocks_bas()
+    else:
+        stocks = pharmacie.stocks().select_related('medicament')
+    return Response(StockSerializer(stocks.order_by('medicament_id'), many=True).data)
+
+
+@api_view(['GET'])
+def evenements(request):
+    # Flux des écritures cliniques dans l'ordre de seq, réservé aux administratifs, limité à leur hôpital.
+    # "after" de la réponse est le curseur à renvoyer, même sans événement (il passe ceux des autres hôpitaux)
+    # ?after=<seq>&limit=<n>&wait=<secondes> : long-poll, répond dès qu'un lot est disponible
+    # ?stream=1 : Server-Sent Events, reprise avec l'en-tête Last-Event-ID
+    getUserFromToken(request, 0)
+    params = request.query_params
+    try:
+        after = int(request.headers.get('Last-Event-ID') or params.get('after', 0))
+        wait = float(params.get('wait', 0))
+    except ValueError:
+        return Response({"message": "after and wait must be numbers"}, status=400)
+    limit = getIntParam(params, 'limit', outbox.EVENTS['BATCH_SIZE'], minimum=1, maximum=outbox.EVENTS['BATCH_SIZE'])
+
+    if 'stream' in params:
+        flux = outbox.sse_async if isinstance(request._request, ASGIRequest) else outbox.sse
+        response = StreamingHttpResponse(flux(after, hopital_courant()), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    lot, curseur = outbox.long_poll(after, limit, wait)
+    return Response({
+        "evenements": [outbox.en_dict(evenement) for evenement in lot],
+        "after": curseur,
+    })
+
+@api_view(['POST'])
+def acquitter_evenements(request):
+    # {"consommateur": "entrepot", "seq": 1234} : tout jusqu'à seq a été traité
+    getUserFromToken(request, 0)
+    nom = request.data.get('consommateur')
+    if not nom or 'seq' not in request.data:
+        return Response({"message": "consommateur and seq are required"}, status=400)
+    try:
+        seq = int(request.data['seq'])
+    except (TypeError, ValueError):
+        return Response({"message": "seq must be an integer"}, status=400)
+    # Au plus le dernier événement de l'hôpital : un seq d'avance compacterait des événements futurs
+    seq = min(seq, EvenementClinique.objects.aggregate(seq=Max('seq'))['seq'] or 0)
+    # Un curseur n'avance jamais en arrière (accusés reçus dans le désordre)
+    curseur, created = CurseurConsommateur.objects.get_or_create(
+        hopital_id=hopital_courant(), nom=nom, defaults={'seq': seq}
+    )
+    if not created:
+        CurseurConsommateur.objects.filter(pk=curseur.pk, seq__lt=seq).update(seq=seq, date_maj=timezone.now())
+        curseur.refresh_from_db()
+    return Response({"consommateur": curseur.nom, "seq": curseur.seq})
+
+
+@api_view(['POST'])
+def ticket_notifications(request):
+    # Ticket court pour ouvrir /api/notifications ou /ws/notifications avec ?ticket=
+    user = getUserFromToken(request)
+    return Response({"ticket": realtime.ticket(user.id_utilisateur), "expire": realtime.REALTIME['TICKET_TTL']})
+
+
+@api_view(['GET'])
+def recherche_notes(request):
+    # ?q= (obligatoire), ?dossier= ou ?nss=, ?type=resume|bilan, ?debut= / ?fin= (ISO 8601), limit / offset
+    user = getStaffFromToken(request)
+    params = request.query_params
+    if not params.get('q'):
+        return Response({"message": "q is required"}, status=400)
+    dossier = getIntParam(params, 'dossier')
+    if 'nss' in params:
+        dossier = DossierMedical.objects.filter(patient__nss=params['nss']).values_list('id', flat=True).first()
+        if dossier is None:
+            return Response({"resultats": [], "suivante": False})
+    if params.get('type') not in (None, 'resume', 'bilan'):
+        return Response({"message": "type must be resume or bilan"}, status=400)
+    try:
+        debut = datetime.fromisoformat(params['debut']).date() if 'debut' in params else None
+        fin = datetime.fromisoformat(params['fin']).date() if 'fin' in params else None
+    except ValueError:
+        return Response({"message": "debut and fin must be ISO 8601 dates"}, status=400)
+
+    limit = getIntParam(params, 'limit', 20, minimum=1, maximum=100)
+    offset = getIntParam(params, 'offset', 0)
+    resultats, suivante = recherche.rechercher(
+        params['q'], dossier=dossier, debut=debut, fin=fin, ressource=params.get('type'), limit=limit, offset=offset
+    )
+    for dossier_id in {resultat['dossier'] for resultat in resultats}:
+        audit.lecture(request, user, 'recherche', dossier_id=dossier_id)
+    return Response({"resultats": resultats, "suivante": suivante})
+
+
+@api_view(['GET', 'POST'])
+@throttle_classes([EcritureThrottle])
+def synchroniser(request):
+    # Tablettes de service, voir sync.py
+    # GET ?since=<jeton>&limit=<n> : lignes modifiées et supprimées depuis le jeton, sans jeton tout est envoyé ;
+    #     tant que "suivante" est vrai, rappeler avec le jeton rendu
+    # POST {"operations": [{"operation": <uuid>, "type": "resume", "id": null, "version": null, "donnees": {...}}]}
+    user = getUserFromToken(request)
+    if Patient.tous.filter(pk=user.pk).exists():
+        return Response({"message": "Sync is reserved to hospital staff"}, status=403)
+
+    if request.method == 'POST':
+        operations = request.data.get('operations')
+        if not isinstance(operations, list):
+            return Response({"message": "operations must be a list"}, status=400)
+        if len(operations) > sync.SYNC['MAX_OPERATIONS']:
+            return Response({"message": f"At most {sync.SYNC['MAX_OPERATIONS']} operations per batch"}, status=400)
+        return Response({"resultats": sync.appliquer(request, user, operations)})
+
+    limit = getIntParam(request.query_params, 'limit', sync.SYNC['LIMIT'], minimum=1)
+    try:
+        modifications, suppressions, jeton, suivante = sync.lire(request.query_params.get('since'), limit)
+    except sync.JetonInvalide:
+        return Response({"message": "since must be a token returned by /api/sync"}, status=400)
+    except sync.JetonExpire:
+        return Response({"message": "Sync token too old, sync again without since"}, status=410)
+
+    dossiers = {ligne['id'] for ligne in modifications['dossiers']}
+    dossiers.update(ligne['dpi_id'] for ligne in modifications['resumes'] + modifications['bilans'])
+    dossiers.update(ligne['dpi_patient_id'] for ligne in modifications['ordonnances'])
+    for dossier_id in dossiers:
+        audit.lecture(request, user, 'sync', dossier_id=dossier_id)
+    return Response({
+        "jeton": jeton,
+        "suivante": suivante,
+        "modifications": modifications,
+        "suppressions": suppressions,
+    })
+
+
+def pdfResponse(request, user, documents, fichier):
+    for document in documents:
+        audit.lecture(request, user, 'impression', document['id'], document['dossier'])
+    response = HttpResponse(b''.join(impression.flux_pdf([documents])), content_type='application/pdf')
+    response['Content-Disposition'] = f'inline; filename="{fichier}"'
+    return response
+
+@api_view(['GET'])
+def ordonnance_pdf(request, id_ordonnance):
+    user = getStaffFromToken(request)
+    documents = impression.ordonnances([id_ordonnance])
+    if not documents:
+        return Response({"message": "Ordonnance not found"}, status=404)
+    return pdfResponse(request, user, documents, f'ordonnance-{id_ordonnance}.pdf')
+
+@api_view(['GET'])
+def dossier_pdf(request, id_dossier):
+    user = getStaffFromToken(request)
+    documents = coalescence.partager(cleLecture(request, 'dossier_pdf', id_dossier), lambda: impression.dossiers([id_dossier]))
+    if not documents:
+        return Response({"message": "DPI not found"}, status=404)
+    return pdfResponse(request, user, documents, f'dossier-{id_dossier}.pdf')
+
+@api_view(['POST'])
+def imprimer_lot(request):
+    # {"ordonnances": [ids], "dossiers": [ids], "date": "2024-05-01", "format": "pdf" | "zip"}
+    # date : toutes les ordonnances du jour. Le lot est lu par paquets, rendu en parallèle et envoyé au fil de l'eau.
+    user = getStaffFromToken(request)
+    format = request.data.get('format', 'pdf')
+    if format not in impression.FORMATS:
+        return Response({"message": "format must be pdf or zip"}, status=400)
+    try:
+        ids_ordonnances = [int(i) for i in request.data.get('ordonnances', [])]
+        ids_dossiers = [int(i) for i in request.data.get('dossiers', [])]
+        if request.data.get('date'):
+            jour = datetime.fromisoformat(request.data['date']).date()
+            ids_ordonnances += Ordonnance.objects.filter(date=jour).order_by('dpi_patient_id', 'pk').values_list('pk', flat=True)
+    except (TypeError, ValueError):
+        return Response({"message": "ordonnances and dossiers must be lists of ids, date an ISO 8601 date"}, status=400)
+    if len(ids_ordonnances) + len(ids_dossiers) > impression.PDF['MAX_DOCUMENTS']:
+        return Response({"message": f"At most {impression.PDF['MAX_DOCUMENTS']} documents per batch"}, status=400)
+
+    references = impression.references(ids_ordonnances, ids_dossiers)
+    if not references:
+        return Response({"message": "Nothing to print"}, status=404)
+    for _, id_document, dossier_id in references:
+        audit.lecture(request, user, 'impression', id_document, dossier_id)
+    flux, content_type = impression.FORMATS[format]
+    contenu = flux(impression.lots(references, hopital_courant()))
+    if isinstance(request._request, ASGIRequest):
+        contenu = impression.flux_async(contenu)
+    response = StreamingHttpResponse(contenu, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="impression-{timezone.localdate()}.{format}"'
+    return response
+
+
+@api_view(['GET'])
+def statistiques_activite(request, indicateur):
+    # Réservé aux administratifs : ?debut= / ?fin= (ISO 8601, les 12 derniers mois par défaut), ?top=
+    # Lu uniquement dans les cumuls, avec comparaison à la période précédente et à l'année passée
+    getUserFromToken(request, 0)
+    if indicateur not in statistiques.INDICATEURS:
+        return Response({"message": f"indicateur must be one of {', '.join(statistiques.INDICATEURS)}"}, status=404)
+    params = request.query_params
+    try:
+        fin = datetime.fromisoformat(params['fin']).date() if 'fin' in params else timezone.localdate()
+        debut = datetime.fromisoformat(params['debut']).date() if 'debut' in params else (fin - timedelta(days=365))
+    except ValueError:
+        return Response({"message": "debut and fin must be ISO 8601 dates"}, status=400)
+    if debut > fin or (fin - debut).days > 3660:
+        return Response({"message": "debut must be before fin, at most 10 years apart"}, status=400)
+    top = getIntParam(params, 'top', 10, minimum=1, maximum=100)
+    return Response(statistiques.analyser(indicateur, debut, fin, top=top))
+
+
+@api_view(['GET'])
+def doublons_patient(request):
+    # Réservé aux administratifs, avant l'enregistrement d'un patient : ?nom=&prenom=&date_naissance=&nss=
+    # Patients du même hôpital qui pourraient être la même personne, score décroissant
+    user = getUserFromToken(request, 0)
+    params = request.query_params
+    if not params.get('nom') or not params.get('prenom') or not params.get('date_naissance'):
+        return Response({"message": "nom, prenom and date_naissance are required"}, status=400)
+    try:
+        date_naissance = datetime.fromisoformat(params['date_naissance']).date()
+    except ValueError:
+        return Response({"message": "date_naissance must be an ISO 8601 date"}, status=400)
+    candidats = doublons.candidats(params['nom'], params['prenom'], date_naissance, params.get('nss', ''),
+                                   user.hopital_id, exclure=params.get('exclure'))
+    return Response({"candidats": candidats})
+
+
+@api_view(['POST'])
+def fusionner_patients(request, id_patient):
+    # Réservé aux administratifs : {"doublon": id} ; le contenu clinique du doublon passe dans
+    # le dossier de id_patient, puis le doublon est supprimé
+    user = getUserFromToken(request, 0)
+    try:
+        doublon_id = int(request.data['doublon'])
+    except (KeyError, TypeError, ValueError):
+        return Response({"message": "doublon (patient id) is required"}, status=400)
+    if doublon_id != id_patient and Patient.objects.filter(pk__in=[id_patient, doublon_id]).count() != 2:
+        return Response({"message": "Patient not found"}, status=404)
+    try:
+        deplaces = doublons.fusionner(id_patient, doublon_id, user)
+    except doublons.FusionImpossible as e:
+        return Response({"message": str(e)}, status=400)
+    dossier_id = DossierMedical.objects.filter(patient_id=id_patient).values_list('id', flat=True).first()
+    audit.ecriture(request, user, 'dossier', dossier_id, dossier_id)
+    return Response({"patient": id_patient, "dossier": dossier_id, "deplaces": deplaces})
+
+
+@api_view(['POST'])
+def provisionner_personnel(request):
+    # Réservé aux administratifs : {"comptes": [{type 0-4, nom, prenom, email, password, specialite, hopital}]}
+    # Tout le lot est créé, ou rien : erreurs par index d'entrée
+    user = getUserFromToken(request, 0)
+    comptes = request.data.get('comptes') if isinstance(request.data, dict) else request.data
+    if not isinstance(comptes, list) or not comptes:
+        return Response({"message": "comptes (a non-empty list) is required"}, status=400)
+    if len(comptes) > provisionnement.PROVISIONNEMENT['MAX_COMPTES']:
+        return Response({"message": f"At most {provisionnement.PROVISIONNEMENT['MAX_COMPTES']} comptes per request"}, status=400)
+    serializer = ProvisionnementSerializer(data=comptes, many=True)
+    if not serializer.is_valid():
+        erreurs = [{"index": i, "erreurs": e} for i, e in sorted(provisionnement.erreurs_par_index(serializer.errors).items())]
+        return Response({"message": "Invalid comptes", "erreurs": erreurs}, status=400)
+    erreurs = provisionnement.verifier_emails(serializer.validated_data)
+    if erreurs:
+        return Response({"message": "Invalid comptes",
+                         "erreurs": [{"index": i, "erreurs": {"email": [e]}} for i, e in sorted(erreurs.items())]}, status=400)
+    try:
+        # Un administratif ne crée des comptes que dans son hôpital
+        erreurs = provisionnement.hors_perimetre(serializer.validated_data, user.hopital_id)
+        if erreurs:
+            return Response({"message": "Forbidden comptes",
+                             "erreurs": [{"index": i, "erreurs": {"hopital": [e]}} for i, e in sorted(erreurs.items())]}, status=403)
+        crees = provisionnement.creer(serializer.validated_data, hopital_id=user.hopital_id)
+    except KeyError as e:
+        return Response({"message": f"Unknown hopital: {e.args[0]}"}, status=400)
+    except IntegrityError:
+        # Email enregistré entre la vérification et l'insertion (unique sur Utilisateur.email)
+        return Response({"message": "An email of this batch was registered meanwhile, nothing was created"}, status=400)
+    audit.ecriture(request, user, 'personnel')
+    return Response({"crees": [{"id": pk, "email": email, "type": type_} for pk, email, type_ in crees]}, status=201)
+
+
+@api_view(['GET'])
+def occupation_lits(request):
+    # Occupation des lits par service, lue dans l'index en mémoire (hospitalisation.py).
+    # ?service=<code> pour un seul service ; If-None-Match : 304 tant que rien n'a bougé
+    user = getUserFromToken(request)
+    if Patient.tous.filter(pk=user.pk).exists():
+        return Response({"message": "Bed census is reserved to hospital staff"}, status=403)
+    services, etag_occupation = hospitalisation.get_index().occupation(user.hopital_id, request.query_params.get('service'))
+    if 'service' in request.query_params and not services:
+        return Response({"message": "Service not found"}, status=404)
+    # La compression rend l'ETag faible (W/"..."), le client le renvoie tel quel
+    if etag_occupation in {valeur.strip().removeprefix('W/') for valeur in request.headers.get('If-None-Match', '').split(',')}:
+        response = Response(status=304)
+    else:
+        response = Response({"services": services})
+    response['ETag'] = etag_occupation
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@api_view(['POST'])
+@throttle_classes([EcritureThrottle])
+def mouvement_lit(request, id_dossier, type):
+    # Admission ou transfert {"lit": id}, sortie {} ; 409 si le lit ou le patient a bougé entre-temps
+    user = getUserFromToken(request)
+    if Patient.tous.filter(pk=user.pk).exists():
+        return Response({"message": "Bed moves are reserved to hospital staff"}, status=403)
+    dossier = DossierMedical.objects.filter(id=id_dossier).first()
+    if not dossier:
+        return Response({"message": "Dossier not found"}, status=404)
+    lit_id = None
+    if type != MouvementLit.SORTIE:
+        try:
+            lit_id = int(request.data['lit'])
+        except (KeyError, TypeError, ValueError):
+            return Response({"message": "lit (bed id) is required"}, status=400)
+        if not Lit.objects.filter(pk=lit_id).exists():
+            return Response({"message": "Lit not found"}, status=404)
+    try:
+        mouvement = hospitalisation.deplacer(dossier, type, lit_id, user)
+    except hospitalisation.MouvementImpossible as e:
+        return Response({"message": str(e)}, status=409)
+    audit.ecriture(request, user, 'lit', mouvement.seq, dossier.pk)
+    return Response({
+        "mouvement": mouvement.seq,
+        "type": mouvement.type,
+        "dossier": dossier.pk,
+        "lit_depart": mouvement.lit_depart_id,
+        "lit_arrivee": mouvement.lit_arrivee_id,
+        "date": mouvement.date.isoformat(),
+    }, status=201)